@@ -13,6 +13,7 @@ from clubs.management.commands.remind import send_reminder_to_club
 from clubs.models import (
     AdminNote,
     Advisor,
+    AnalyticsRollup,
     ApplicationCommittee,
     ApplicationCycle,
     ApplicationMultipleChoice,
@@ -26,6 +27,7 @@ from clubs.models import (
     ClubFair,
     ClubFairBooth,
     ClubFairRegistration,
+    ClubRank,
     ClubVisit,
     Event,
     Favorite,
@@ -41,6 +43,7 @@ from clubs.models import (
     Report,
     School,
     SearchQuery,
+    SearchQueryStat,
     StudentType,
     Subscribe,
     Tag,
@@ -231,6 +234,29 @@ class EventAdmin(admin.ModelAdmin):
         return obj.club.name
 
 
+class ClubRankAdmin(admin.ModelAdmin):
+    search_fields = ("club__name", "club__code")
+    list_display = ("club", "rank", "updated_at")
+
+    def club(self, obj):
+        return obj.club.name
+
+    def rank(self, obj):
+        return obj.club.rank
+
+
+class AnalyticsRollupAdmin(admin.ModelAdmin):
+    search_fields = ("club__name", "club__code")
+    list_display = ("club", "metric", "granularity", "bucket", "total")
+    list_filter = ("metric", "granularity", "visit_type")
+
+
+class SearchQueryStatAdmin(admin.ModelAdmin):
+    search_fields = ("query",)
+    list_display = ("query", "date", "count")
+    list_filter = ("date",)
+
+
 class FavoriteAdmin(admin.ModelAdmin):
     search_fields = ("person__username", "person__email", "club__name", "club__pk")
     list_display = ("person", "club")
@@ -417,16 +443,19 @@ admin.site.register(ApplicationQuestion)
 admin.site.register(ApplicationQuestionResponse)
 admin.site.register(ApplicationSubmission, ApplicationSubmissionAdmin)
 admin.site.register(Advisor, AdvisorAdmin)
+admin.site.register(AnalyticsRollup, AnalyticsRollupAdmin)
 admin.site.register(Club, ClubAdmin)
 admin.site.register(ClubFair, ClubFairAdmin)
 admin.site.register(ClubApplication)
 admin.site.register(ClubFairRegistration)
+admin.site.register(ClubRank, ClubRankAdmin)
 admin.site.register(ClubVisit)
 admin.site.register(Badge, BadgeAdmin)
 admin.site.register(Event, EventAdmin)
 admin.site.register(Favorite, FavoriteAdmin)
 admin.site.register(School)
 admin.site.register(SearchQuery)
+admin.site.register(SearchQueryStat, SearchQueryStatAdmin)
 admin.site.register(Subscribe, SubscribeAdmin)
 admin.site.register(MembershipRequest, MembershipRequestAdmin)
 admin.site.register(Major, MajorAdmin)
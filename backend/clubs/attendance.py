@@ -0,0 +1,273 @@
+import math
+import threading
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from clubs.caching import cache_get_tagged, cache_lock, cache_set_tagged
+from clubs.models import Event, Membership, ZoomMeetingVisit
+
+
+# Durations up to this many seconds are counted exactly, longer durations are
+# grouped into buckets that are at most 1% wide
+EXACT_DURATION_LIMIT = 1000
+DURATION_BUCKET_GROWTH = 1.01
+
+
+def get_duration_bucket(seconds):
+    """
+    Return the value that represents a duration in the duration histogram.
+    """
+    seconds = max(0, round(seconds))
+    if seconds <= EXACT_DURATION_LIMIT:
+        return seconds
+    index = math.ceil(math.log(seconds / EXACT_DURATION_LIMIT, DURATION_BUCKET_GROWTH))
+    return round(EXACT_DURATION_LIMIT * DURATION_BUCKET_GROWTH ** index)
+
+
+# Seconds to remember the event of a Zoom meeting, it is also forgotten whenever
+# an event changes
+ZOOM_EVENT_TIMEOUT = 60 * 60 * 24
+
+
+def get_zoom_event_id(meeting_id):
+    """
+    Return the id of the event that links to a Zoom meeting, or None if there is
+    no such event. If several events link to the same meeting, the oldest event
+    is used.
+    """
+    key = f"events:zoom:{meeting_id}"
+    event_id = cache_get_tagged(key)
+    if event_id is None:
+        event_id = (
+            Event.objects.filter(zoom_meeting_id=meeting_id)
+            .order_by("id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        # meetings without an event are remembered as well
+        event_id = event_id or 0
+        cache_set_tagged(key, event_id, ZOOM_EVENT_TIMEOUT, ["events"])
+    return event_id or None
+
+
+class LiveEventStats(object):
+    """
+    Running attendance statistics for the Zoom meeting of an event, kept in the
+    cache and updated whenever a participant joins or leaves the meeting.
+
+    Only the visits that are still open are remembered. A visit is counted as
+    completed when it is removed from the open visits, so repeated leave
+    notifications for the same visit are ignored. A join that is processed after
+    the leave of the same visit cannot be detected and keeps the visit open until
+    the statistics expire or are rebuilt from the visits.
+
+    The durations of completed visits are stored in a histogram with a bounded
+    number of buckets, which is used to estimate the median duration. The users
+    that attended the meeting are kept to count them exactly, so this set grows
+    with the number of distinct participants, but not with repeated visits.
+    """
+
+    # seconds to keep the statistics, they are rebuilt from the visits if missing
+    timeout = 60 * 60 * 24 * 2
+
+    def __init__(self):
+        self.open_visits = {}
+        self.attended = set()
+        self.durations = defaultdict(int)
+
+    @staticmethod
+    def get_key(event_id):
+        return f"events:live:{event_id}"
+
+    @classmethod
+    def build(cls, event_ids):
+        """
+        Compute the statistics of many events from their visits with one query.
+        """
+        stats = {event_id: cls() for event_id in event_ids}
+        for visit in ZoomMeetingVisit.objects.filter(event_id__in=event_ids).only(
+            "id", "event_id", "person_id", "join_time", "leave_time"
+        ):
+            if visit.leave_time is None:
+                stats[visit.event_id].open_visits[visit.id] = visit.person_id
+            else:
+                stats[visit.event_id].add_completed_visit(visit)
+        return stats
+
+    def add_visit(self, visit):
+        """
+        Update the statistics with a visit that has started or ended. A visit that
+        ends is only counted if it was open, so adding the same visit more than
+        once has no effect.
+        """
+        if visit.leave_time is None:
+            self.open_visits[visit.id] = visit.person_id
+        elif visit.id in self.open_visits:
+            del self.open_visits[visit.id]
+            self.add_completed_visit(visit)
+
+    def add_completed_visit(self, visit):
+        if visit.person_id is not None:
+            self.attended.add(visit.person_id)
+        duration = (visit.leave_time - visit.join_time).total_seconds()
+        self.durations[get_duration_bucket(duration)] += 1
+
+    @property
+    def attending(self):
+        """
+        The ids of the users that are currently in the meeting.
+        """
+        return {person for person in self.open_visits.values() if person is not None}
+
+    def get_median(self):
+        """
+        Return the median number of seconds that participants attended the meeting,
+        or 0 if nobody has left the meeting yet.
+        """
+        total = sum(self.durations.values())
+        if not total:
+            return 0
+        target = total // 2
+        seen = 0
+        for bucket in sorted(self.durations):
+            seen += self.durations[bucket]
+            if seen > target:
+                return bucket
+        return 0
+
+
+def get_live_event_stats(event_ids):
+    """
+    Return a mapping of event ids to their live statistics. Statistics that are not
+    in the cache are rebuilt from the visits.
+    """
+    keys = {LiveEventStats.get_key(event_id): event_id for event_id in event_ids}
+    cached = cache.get_many(keys.keys())
+    stats = {keys[key]: value for key, value in cached.items()}
+
+    missing = [event_id for event_id in event_ids if event_id not in stats]
+    if missing:
+        built = LiveEventStats.build(missing)
+        for event_id, value in built.items():
+            # do not replace statistics that were updated in the meantime
+            cache.add(LiveEventStats.get_key(event_id), value, LiveEventStats.timeout)
+        stats.update(built)
+    return stats
+
+
+def record_zoom_visit(visit):
+    """
+    Update the live statistics of the event of a visit once the current
+    transaction commits, and notify the students that are viewing the event.
+    """
+
+    def update():
+        key = LiveEventStats.get_key(visit.event_id)
+        with cache_lock(f"{key}:lock"):
+            stats = cache.get(key)
+            if stats is None:
+                stats = LiveEventStats.build([visit.event_id])[visit.event_id]
+            else:
+                stats.add_visit(visit)
+            cache.set(key, stats, LiveEventStats.timeout)
+        schedule_live_event_broadcast(visit.event_id)
+
+    transaction.on_commit(update)
+
+
+def get_officers(club_ids):
+    """
+    Return a mapping of club ids to the ids and usernames of their officers.
+    """
+    officers = defaultdict(dict)
+    for club_id, person_id, username in Membership.objects.filter(
+        club_id__in=club_ids, role__lte=Membership.ROLE_OFFICER
+    ).values_list("club_id", "person_id", "person__username"):
+        officers[club_id][person_id] = username
+    return officers
+
+
+def get_members(club_ids, person_ids):
+    """
+    Return a mapping of club ids to the ids of the given users that are members
+    of the club.
+    """
+    members = defaultdict(set)
+    for club_id, person_id in Membership.objects.filter(
+        club_id__in=club_ids, person_id__in=person_ids
+    ).values_list("club_id", "person_id"):
+        members[club_id].add(person_id)
+    return members
+
+
+def get_live_event_summary(event_ids):
+    """
+    Return a mapping of event ids to the attendance counts that are shown to
+    students viewing the event. The "officers" count includes every member of
+    the club that is currently in the meeting.
+    """
+    events = dict(Event.objects.filter(id__in=event_ids).values_list("id", "club_id"))
+    stats = get_live_event_stats(list(events))
+    attending = {event_id: stats[event_id].attending for event_id in events}
+    members = {}
+    if any(attending.values()):
+        members = get_members(set(events.values()), set().union(*attending.values()))
+    return {
+        event_id: {
+            "attending": len(stats[event_id].open_visits),
+            "officers": len(attending[event_id] & members.get(club_id, set())),
+            "attended": len(stats[event_id].attended),
+            "time": stats[event_id].get_median(),
+        }
+        for event_id, club_id in events.items()
+    }
+
+
+def broadcast_live_event(event_id):
+    """
+    Send the current attendance counts of an event to the students viewing it.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    summary = get_live_event_summary([event_id]).get(event_id)
+    if summary is not None:
+        async_to_sync(channel_layer.group_send)(
+            f"events-live-{event_id}", {"type": "join_leave", "stats": summary}
+        )
+
+
+def schedule_live_event_broadcast(event_id):
+    """
+    Broadcast the attendance counts of an event after LIVE_EVENT_BROADCAST_DELAY
+    seconds. Participants that join or leave in the meantime, in any process, are
+    included in the same broadcast, so that the counts are computed once for all
+    of the students viewing the event.
+    """
+    if not settings.BACKGROUND_TASKS:
+        broadcast_live_event(event_id)
+        return
+
+    key = f"events:live:{event_id}:broadcast"
+    delay = settings.LIVE_EVENT_BROADCAST_DELAY
+    # the key expires on its own if the process dies before broadcasting
+    if not cache.add(key, True, delay * 2):
+        return
+
+    def run():
+        try:
+            # changes after this point are sent in the next broadcast
+            cache.delete(key)
+            broadcast_live_event(event_id)
+        finally:
+            connection.close()
+
+    timer = threading.Timer(delay, run)
+    timer.daemon = True
+    timer.start()
@@ -0,0 +1,155 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+
+def get_tag_key(tag):
+    """
+    Return the cache key that stores the current version of a cache tag.
+    """
+    return f"cachetag:{tag}"
+
+
+def get_tag_versions(tags):
+    """
+    Return a mapping of cache tags to their current versions.
+    Tags that do not have a version yet are assigned one.
+    """
+    keys = {get_tag_key(tag): tag for tag in tags}
+    versions = cache.get_many(keys.keys())
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        new_version = time.time_ns()
+        for key in missing:
+            cache.add(key, new_version, None)
+        versions.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def cache_set_tagged(key, value, timeout, tags):
+    """
+    Cache a value that is invalidated whenever any of the given tags are invalidated.
+    """
+    cache.set(
+        key, {"value": value, "tags": get_tag_versions(set(tags))}, timeout,
+    )
+
+
+def cache_get_tagged(key):
+    """
+    Retrieve a value stored with cache_set_tagged.
+    Returns None if the value does not exist or any of its tags have been invalidated
+    since the value was cached.
+    """
+    entry = cache.get(key)
+    if entry is None or not _is_fresh(entry):
+        return None
+    return entry["value"]
+
+
+def _is_fresh(entry):
+    keys = {get_tag_key(tag): version for tag, version in entry["tags"].items()}
+    current = cache.get_many(keys.keys())
+    return all(current.get(key) == version for key, version in keys.items())
+
+
+def cache_get_or_build_tagged(key, build, timeout, tags, lock_timeout=30, lock_wait=1):
+    """
+    Return a value stored with cache_set_tagged, calling build to compute and cache
+    the value if it does not exist or any of its tags have been invalidated.
+
+    Only one caller rebuilds a value at a time. While a value is being rebuilt, the
+    other callers receive the previous (stale) value, or wait up to lock_wait
+    seconds for the new value if there is no previous value, and then build the
+    value themselves. If background tasks are enabled, stale values are rebuilt
+    in a background thread and the caller receives the stale value as well.
+    """
+    entry = cache.get(key)
+    if entry is not None and _is_fresh(entry):
+        return entry["value"]
+
+    lock_key = f"{key}:lock"
+
+    def rebuild():
+        try:
+            # versions from before the build, so that changes made during the
+            # build invalidate the new value
+            versions = get_tag_versions(set(tags))
+            try:
+                value = build()
+            except Exception:
+                # do not keep serving a stale value that can no longer be built
+                cache.delete(key)
+                raise
+            cache.set(key, {"value": value, "tags": versions}, timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    if cache.add(lock_key, True, lock_timeout):
+        if entry is not None and settings.BACKGROUND_TASKS:
+
+            def run():
+                try:
+                    rebuild()
+                finally:
+                    connection.close()
+
+            threading.Thread(target=run, daemon=True).start()
+            return entry["value"]
+        return rebuild()
+
+    if entry is not None:
+        return entry["value"]
+
+    # wait for the caller that holds the lock to build the value
+    deadline = time.monotonic() + lock_wait
+    while time.monotonic() < deadline and cache.get(lock_key) is not None:
+        time.sleep(0.05)
+    entry = cache.get(key)
+    if entry is not None and _is_fresh(entry):
+        return entry["value"]
+    return build()
+
+
+@contextmanager
+def cache_lock(key, timeout=10, wait=5):
+    """
+    Hold a lock stored in the cache, so that it is shared between processes.
+
+    If the lock cannot be acquired within the given number of seconds, for example
+    because the process holding it died, the block is executed without it.
+    """
+    deadline = time.monotonic() + wait
+    acquired = cache.add(key, True, timeout)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(0.01)
+        acquired = cache.add(key, True, timeout)
+    try:
+        yield
+    finally:
+        if acquired:
+            cache.delete(key)
+
+
+def _bump_cache_tags(tags):
+    version = time.time_ns()
+    cache.set_many({get_tag_key(tag): version for tag in tags}, None)
+
+
+def invalidate_cache_tags(*tags):
+    """
+    Invalidate all cached values associated with any of the given tags.
+
+    The tags are invalidated immediately and again once the current transaction
+    commits, so that values cached from uncommitted state are not served.
+    """
+    tags = set(tags)
+    if not tags:
+        return
+    _bump_cache_tags(tags)
+    transaction.on_commit(lambda: _bump_cache_tags(tags))
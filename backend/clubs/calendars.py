@@ -0,0 +1,317 @@
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from ics import Calendar
+from urlextract import URLExtract
+
+from clubs.caching import invalidate_cache_tags
+from clubs.models import Event
+from clubs.ranking import queue_rank_update
+from clubs.search import update_search_index
+from clubs.utils import clean, get_zoom_meeting_id
+
+
+# random but consistent uuid used to generate uuid5s from invalid uuids
+ICS_IMPORT_UUID_NAMESPACE = uuid.UUID("8f37c140-3775-42e8-91d4-fda7a2e44152")
+
+# domains that are preferred when picking the url of an event from its description
+MEETING_DOMAINS = {"zoom.us", "bluejeans.com", "hangouts.google.com"}
+
+# fields that are copied from the calendar onto imported events
+ICS_EVENT_FIELDS = [
+    "club_id",
+    "name",
+    "start_time",
+    "end_time",
+    "description",
+    "location",
+    "url",
+    "zoom_meeting_id",
+    "is_ics_event",
+    "ics_uuid",
+]
+
+# seconds to remember the validators of a calendar for conditional requests
+ICS_VALIDATORS_TIMEOUT = 60 * 60 * 24 * 7
+
+_extractor = None
+
+
+def get_url_extractor():
+    global _extractor
+    if _extractor is None:
+        _extractor = URLExtract()
+    return _extractor
+
+
+def get_validators_key(club):
+    return f"ics:validators:{club.id}"
+
+
+def fetch_calendar(club, conditional=True):
+    """
+    Download the ICS calendar of a club and return its contents and validators.
+    The contents are None if the calendar has not changed since it was last
+    imported.
+
+    The ETag and Last-Modified headers of the last imported response are sent back
+    to the server, so that unchanged calendars are not downloaded and parsed again.
+    """
+    url = club.ics_import_url
+    headers = {}
+    validators = cache.get(get_validators_key(club)) if conditional else None
+    if validators is not None and validators["url"] == url:
+        if validators["etag"]:
+            headers["If-None-Match"] = validators["etag"]
+        if validators["last_modified"]:
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    resp = requests.get(url, headers=headers, timeout=settings.ICS_IMPORT_TIMEOUT)
+    if resp.status_code == 304:
+        return None, validators
+    resp.raise_for_status()
+
+    return (
+        resp.text,
+        {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+        },
+    )
+
+
+def import_calendar_text(club, text, validators):
+    """
+    Import the contents of the calendar of a club, and remember its validators
+    once the events have been saved. Returns the number of imported events.
+    """
+    count = sync_club_events(club, parse_calendar(club, text))
+    cache.set(get_validators_key(club), validators, ICS_VALIDATORS_TIMEOUT)
+    return count
+
+
+def get_event_uuid(event):
+    """
+    Return the uuid of a calendar event, or None if it does not have one.
+    """
+    if not event.uid:
+        return None
+    try:
+        return uuid.UUID(event.uid[:36])
+    except ValueError:
+        # generate uuid from malformed/invalid uuids
+        return uuid.uuid5(ICS_IMPORT_UUID_NAMESPACE, event.uid)
+
+
+def get_event_url(event, description, location):
+    """
+    Find the link of a calendar event in its url, location or description.
+    """
+    extractor = get_url_extractor()
+    url = None
+
+    # extract urls from description
+    if description:
+        urls = extractor.find_urls(description)
+        urls.sort(
+            key=lambda url: any(domain in url for domain in MEETING_DOMAINS),
+            reverse=True,
+        )
+        if urls:
+            url = urls[0]
+
+    # extract url from url or location
+    if event.url:
+        url = event.url
+    elif location:
+        location_urls = extractor.find_urls(location)
+        if location_urls:
+            url = location_urls[0]
+
+    # format url properly with schema
+    if url:
+        parsed = urlparse(url)
+        if not parsed.netloc:
+            parsed = parsed._replace(netloc=parsed.path, path="")
+        if not parsed.scheme:
+            parsed = parsed._replace(scheme="https")
+        url = parsed.geturl()[:2048]
+    return url
+
+
+def get_event_type(name, description):
+    """
+    Guess the type of a new event from its name and description.
+    """
+    for val, lbl in Event.TYPES:
+        if val in {Event.FAIR}:
+            continue
+        if lbl.lower() in name.lower() or lbl.lower() in description.lower():
+            return val
+    return Event.OTHER
+
+
+def parse_calendar(club, text):
+    """
+    Convert the events of an ICS calendar into the field values of club events.
+    """
+    calendar = Calendar(text)
+    events = []
+    for event in calendar.events:
+        description = clean(event.description.strip())
+        location = event.location[:255] if event.location else event.location
+        events.append(
+            {
+                "club_id": club.id,
+                "name": event.name.strip()[:255],
+                "start_time": event.begin.datetime,
+                "end_time": event.end.datetime,
+                "description": description,
+                "location": location,
+                "url": get_event_url(event, description, location),
+                "is_ics_event": True,
+                "ics_uuid": get_event_uuid(event),
+            }
+        )
+    return events
+
+
+def sync_club_events(club, events):
+    """
+    Create, update and delete the imported events of a club to match the events
+    of its calendar, and return the number of events in the calendar.
+
+    Calendar events are matched to existing events by their uuid, or otherwise by
+    their start and end time. The existing events are loaded with two queries and
+    the changes are saved in bulk.
+    """
+    if not events:
+        Event.objects.filter(club=club, is_ics_event=True).delete()
+        return 0
+
+    # preload the events that calendar events can be matched to
+    uuids = [event["ics_uuid"] for event in events if event["ics_uuid"] is not None]
+    by_uuid = {ev.ics_uuid: ev for ev in Event.objects.filter(ics_uuid__in=uuids)}
+    by_time = defaultdict(list)
+    for ev in Event.objects.filter(
+        club=club,
+        start_time__gte=min(event["start_time"] for event in events),
+        start_time__lte=max(event["start_time"] for event in events),
+    ).order_by("id"):
+        by_time[(ev.start_time, ev.end_time)].append(ev)
+
+    now = timezone.now()
+    claimed = set()
+    clubs = {club.id}
+    created, updated, kept = [], [], []
+    for event in events:
+        ev = by_uuid.get(event["ics_uuid"])
+        if ev is None or ev.pk in claimed:
+            ev = next(
+                (
+                    ev
+                    for ev in by_time[(event["start_time"], event["end_time"])]
+                    if ev.pk not in claimed
+                ),
+                None,
+            )
+
+        # keep the existing or autogenerated uuid and the existing url if the
+        # calendar does not have them
+        event = {
+            key: value
+            for key, value in event.items()
+            if value is not None or key not in {"ics_uuid", "url"}
+        }
+        event["zoom_meeting_id"] = get_zoom_meeting_id(
+            event.get("url", ev.url if ev is not None else None)
+        )
+
+        if ev is None:
+            ev = Event(**event)
+            # very simple type detection, only performed on first import
+            ev.type = get_event_type(ev.name, ev.description)
+            created.append(ev)
+            continue
+
+        claimed.add(ev.pk)
+        clubs.add(ev.club_id)
+        kept.append(ev.pk)
+        changed = False
+        for field, value in event.items():
+            if getattr(ev, field) != value:
+                setattr(ev, field, value)
+                changed = True
+        if changed:
+            ev.updated_at = now
+            updated.append(ev)
+
+    with transaction.atomic():
+        Event.objects.bulk_update(
+            updated, ICS_EVENT_FIELDS + ["updated_at"], batch_size=500
+        )
+        created = Event.objects.bulk_create(created, batch_size=500)
+        if not all(ev.pk for ev in created):
+            created = list(
+                Event.objects.filter(ics_uuid__in=[ev.ics_uuid for ev in created])
+            )
+        kept.extend(ev.pk for ev in created)
+        Event.objects.filter(club=club, is_ics_event=True).exclude(pk__in=kept).delete()
+
+    # bulk operations do not send signals
+    for ev in created + updated:
+        update_search_index(ev)
+    for club_id in clubs:
+        queue_rank_update(club_id, "events")
+    invalidate_cache_tags(
+        "events", "events:fair", *(f"club:{club_id}" for club_id in clubs)
+    )
+    return len(events)
+
+
+def import_club_calendar(club, conditional=False):
+    """
+    Import the events of the calendar of a club, and return the number of
+    imported events or None if the calendar has not changed.
+    """
+    text, validators = fetch_calendar(club, conditional)
+    if text is None:
+        return None
+    return import_calendar_text(club, text, validators)
+
+
+def import_calendars(clubs, on_error=None):
+    """
+    Import the calendars of many clubs. The calendars are downloaded in parallel
+    and conditionally, and the events of each club are saved as soon as its
+    calendar has been downloaded.
+
+    Returns the number of calendars that were imported and that had not changed.
+    If a calendar fails to import, on_error is called with the club and the
+    exception.
+    """
+    imported = unchanged = 0
+    with ThreadPoolExecutor(max_workers=settings.ICS_IMPORT_WORKERS) as executor:
+        futures = {executor.submit(fetch_calendar, club): club for club in clubs}
+        for future in as_completed(futures):
+            club = futures[future]
+            try:
+                text, validators = future.result()
+                if text is None:
+                    unchanged += 1
+                    continue
+                import_calendar_text(club, text, validators)
+                imported += 1
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(club, e)
+    return imported, unchanged
@@ -0,0 +1,125 @@
+import datetime
+
+from django.db.models.functions import Lower
+from django.http import Http404
+from django.utils import timezone
+
+from clubs.caching import cache_get_or_build_tagged
+from clubs.models import ClubFair, Event
+from clubs.serializers import ClubFairSerializer
+
+
+# Increment when the structure of the cached fair directory changes
+FAIR_DIRECTORY_VERSION = 1
+
+# Seconds to keep a fair directory, it is also rebuilt whenever the fair changes
+FAIR_DIRECTORY_TIMEOUT = 60 * 60 * 24
+
+# Seconds to keep the current fair, which changes as fairs end
+CURRENT_FAIR_TIMEOUT = 60
+
+
+def get_current_fair_id():
+    """
+    Return the id of the fair that is happening now or the next upcoming fair,
+    or None if there is no such fair.
+    """
+
+    def build():
+        return (
+            ClubFair.objects.filter(
+                end_time__gte=timezone.now() - datetime.timedelta(minutes=30)
+            )
+            .order_by("start_time")
+            .values_list("id", flat=True)
+            .first()
+        )
+
+    return cache_get_or_build_tagged(
+        "events:fair:current", build, CURRENT_FAIR_TIMEOUT, ["events:fair"]
+    )
+
+
+def build_fair_directory(fair, date=None):
+    """
+    Group the events of the clubs that have a badge for the fair by start time and
+    then by badge. The events are fetched in sorted order with a single query and
+    grouped in one pass.
+
+    If there is no fair, the events around the given date are used instead.
+    """
+    now = date or timezone.now()
+    events = Event.objects.filter(
+        type=Event.FAIR, club__badges__purpose="fair", club__badges__fair=fair
+    )
+
+    # filter event range based on the fair times or provide a reasonable fallback
+    if fair is None:
+        events = events.filter(
+            start_time__lte=now + datetime.timedelta(days=7),
+            end_time__gte=now - datetime.timedelta(days=1),
+        )
+    else:
+        events = events.filter(
+            start_time__lte=fair.end_time, end_time__gte=fair.start_time
+        )
+
+    events = (
+        events.values_list(
+            "start_time", "end_time", "club__name", "club__code", "club__badges__label",
+        )
+        .order_by("start_time", "club__badges__label", Lower("club__name"))
+        .distinct()
+    )
+
+    output = {}
+    for start_time, end_time, name, code, category in events:
+        # group by start date
+        ts = int(start_time.replace(second=0, microsecond=0).timestamp())
+        if ts not in output:
+            output[ts] = {"start_time": start_time, "end_time": end_time, "events": {}}
+
+        # group by category
+        categories = output[ts]["events"]
+        if category not in categories:
+            categories[category] = {"category": category, "events": []}
+        categories[category]["events"].append({"name": name, "code": code})
+
+    for item in output.values():
+        item["events"] = sorted(item["events"].values(), key=lambda c: c["category"])
+
+    return {
+        "events": list(output.values()),
+        "fair": ClubFairSerializer(instance=fair).data,
+    }
+
+
+def get_fair_directory(fair_id=None):
+    """
+    Return the directory of the given fair, or the current fair if no fair is
+    specified. Raises Http404 if the fair does not exist.
+
+    Directories are cached until the fair, its events, registrations or badges
+    change. Outdated directories are served while a single request rebuilds them,
+    so that many students opening the directory at once do not all rebuild it.
+    """
+    if fair_id is None:
+        fair_id = get_current_fair_id()
+
+    def build():
+        fair = None
+        if fair_id is not None:
+            fair = ClubFair.objects.filter(id=fair_id).first()
+            # raising instead of returning a value does not cache anything, so
+            # requests for arbitrary fair ids do not fill the cache
+            if fair is None:
+                raise Http404("The fair does not exist.")
+        return build_fair_directory(fair)
+
+    # without a fair, the directory depends on the current time
+    return cache_get_or_build_tagged(
+        f"events:fair:directory:v{FAIR_DIRECTORY_VERSION}:{fair_id}",
+        build,
+        FAIR_DIRECTORY_TIMEOUT if fair_id is not None else 60 * 5,
+        ["events:fair"],
+    )
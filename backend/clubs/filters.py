@@ -1,31 +1,254 @@
+import base64
+import binascii
+import datetime
+import hashlib
+import json
 import random
 from collections import OrderedDict
 from urllib.parse import quote
 
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, F, IntegerField, Q, When
 from rest_framework import filters
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from clubs.caching import cache_get_tagged, cache_set_tagged
+from clubs.search import search_queryset
 
 
 DEFAULT_PAGE_SIZE = 15
 DEFAULT_SEED = 1234
 
 
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    JSON encoder that keeps the full precision of times, which is required for the
+    cursor positions to compare equal to the database values.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that filters on the values of the ordering fields of the last
+    object on the page instead of using OFFSET, so that deep pages cost the same as
+    the first page and objects inserted while paginating do not shift the pages.
+
+    Unlike the cursor pagination in rest framework, the ordering is taken from the
+    queryset and may contain any number of (possibly related) fields. The primary
+    key is appended as a tiebreaker so that the cursors are always stable.
+
+    Counting all of the objects is skipped unless count=true is passed.
+    """
+
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    page_size = DEFAULT_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, queryset):
+        """
+        Return a list of (field, descending) pairs for the ordering of the queryset.
+        """
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        fields = []
+        for field in ordering:
+            if not isinstance(field, str) or field == "?":
+                raise ParseError(
+                    "Cursor pagination is not supported for this ordering."
+                )
+            fields.append((field.lstrip("-"), field.startswith("-")))
+
+        if not any(name in {"pk", "id"} for name, _ in fields):
+            fields.append(("pk", bool(fields) and fields[-1][1]))
+        return fields
+
+    def get_position(self, instance):
+        position = []
+        for name, _ in self.ordering:
+            value = instance
+            for attr in name.split("__"):
+                value = getattr(value, attr, None)
+                if value is None:
+                    break
+            position.append(getattr(value, "pk", value))
+        return position
+
+    def encode_cursor(self, position, reverse):
+        data = json.dumps({"p": position, "r": int(reverse)}, cls=CursorEncoder)
+        cursor = base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+        # only count the objects for the first page that was requested
+        url = remove_query_param(self.base_url, self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param, "")
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            position, reverse = data["p"], bool(data["r"])
+        except (binascii.Error, KeyError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_order_by(self, reverse):
+        """
+        Return the order by expressions. Null values are always placed last when
+        paginating forwards, regardless of the database.
+        """
+        order_by = []
+        for name, descending in self.ordering:
+            if descending != reverse:
+                order_by.append(F(name).desc(nulls_last=not reverse))
+            else:
+                order_by.append(F(name).asc(nulls_last=not reverse))
+        return order_by
+
+    def get_after_filter(self, position, reverse):
+        """
+        Return a filter that matches all objects strictly after the position.
+        This is the expanded form of the row comparison (a, b) > (x, y), which is
+        (a > x) OR (a = x AND b > y).
+        """
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, position):
+            if value is None:
+                # nulls are last going forwards and first going backwards
+                after = Q(**{f"{name}__isnull": False}) if reverse else Q(pk__in=[])
+                same = Q(**{f"{name}__isnull": True})
+            else:
+                lookup = "lt" if descending != reverse else "gt"
+                after = Q(**{f"{name}__{lookup}": value})
+                if not reverse:
+                    after |= Q(**{f"{name}__isnull": True})
+                same = Q(**{name: value})
+            condition |= equal & after
+            equal &= same
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        position, reverse = self.decode_cursor(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param, "").lower() == "true":
+            self.count = queryset.count()
+
+        page_queryset = queryset.order_by(*self.get_order_by(reverse))
+        if position is not None:
+            try:
+                page_queryset = page_queryset.filter(
+                    self.get_after_filter(position, reverse)
+                )
+            except (FieldDoesNotExist, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # fetch one extra object to determine if there is another page
+        results = list(page_queryset[: self.page_size + 1])
+        page = results[: self.page_size]
+        has_more = len(results) > len(page)
+
+        if reverse:
+            page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.next_position = self.get_position(page[-1]) if page else position
+        self.previous_position = self.get_position(page[0]) if page else position
+        return page
+
+    def get_next_link(self):
+        if not self.has_next or self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, True)
+
+    def get_paginated_response(self, data):
+        fields = [
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]
+        if self.count is not None:
+            fields.insert(0, ("count", self.count))
+        return Response(OrderedDict(fields))
+
+
 class OptionalPageNumberPagination(PageNumberPagination):
     """
     Optional pagination that does not paginate the response
     if the user does not specify it.
+
+    If the cursor parameter is passed instead of a page number (use an empty
+    cursor for the first page), the response is paginated using a keyset cursor.
     """
 
     page_size = DEFAULT_PAGE_SIZE
     page_size_query_param = "page_size"
+    cursor_pagination_class = KeysetPagination
 
     def paginate_queryset(self, queryset, request, view=None):
+        if (
+            self.page_query_param not in request.query_params
+            and self.cursor_pagination_class.cursor_query_param in request.query_params
+        ):
+            self._cursor_paginator = self.cursor_pagination_class()
+            return self._cursor_paginator.paginate_queryset(queryset, request, view)
+
         if self.page_query_param not in request.query_params:
             return None
 
         return super().paginate_queryset(queryset, request, view)
 
+    def get_next_link(self):
+        if hasattr(self, "_cursor_paginator"):
+            return self._cursor_paginator.get_next_link()
+
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if hasattr(self, "_cursor_paginator"):
+            return self._cursor_paginator.get_previous_link()
+
+        return super().get_previous_link()
+
+    def get_paginated_response(self, data):
+        if hasattr(self, "_cursor_paginator"):
+            return self._cursor_paginator.get_paginated_response(data)
+
+        return super().get_paginated_response(data)
+
 
 class RandomPageNumberPagination(OptionalPageNumberPagination):
     """
@@ -35,9 +258,8 @@ class RandomPageNumberPagination(OptionalPageNumberPagination):
 
     def paginate_queryset(self, queryset, request, view=None):
         if "random" in request.query_params.get("ordering", "").split(","):
-            rng = random.Random(request.GET.get("seed", DEFAULT_SEED))
+            # already filtered to the current page and ordered by the ordering filter
             results = list(queryset)
-            rng.shuffle(results)
 
             self._random_count = getattr(request, "_original_item_count", None)
             if self._random_count is None:
@@ -82,8 +304,36 @@ class RandomOrderingFilter(filters.OrderingFilter):
     """
     Custom ordering filter that supports random pagination.
     Must be used with the associated pagination class.
+
+    The shuffled list of ids for each seed and set of filters is cached, so that
+    fetching a page only needs to retrieve the objects on that page.
+    The view can specify the cache tags that invalidate this list in the
+    random_ordering_cache_tags attribute.
     """
 
+    def get_random_ids(self, request, queryset, view):
+        """
+        Return a deterministic permutation of all of the ids in the queryset.
+        """
+        seed = request.GET.get("seed", DEFAULT_SEED)
+        ids_queryset = queryset.order_by("id").values_list("id", flat=True)
+        try:
+            sql = str(ids_queryset.query)
+        except EmptyResultSet:
+            return []
+
+        key = "random:ordering:{}".format(
+            hashlib.md5(f"{seed}:{sql}".encode("utf-8")).hexdigest()
+        )
+        all_ids = cache_get_tagged(key)
+        if all_ids is None:
+            all_ids = list(ids_queryset)
+            random.Random(seed).shuffle(all_ids)
+            cache_set_tagged(
+                key, all_ids, 60 * 60, getattr(view, "random_ordering_cache_tags", []),
+            )
+        return all_ids
+
     def filter_queryset(self, request, queryset, view):
         new_queryset = super().filter_queryset(request, queryset, view)
         ordering = request.GET.get("ordering", "").split(",")
@@ -92,17 +342,34 @@ class RandomOrderingFilter(filters.OrderingFilter):
         if "random" in ordering:
             page = int(request.GET.get("page", 1)) - 1
             page_size = int(request.GET.get("page_size", DEFAULT_PAGE_SIZE))
-            rng = random.Random(request.GET.get("seed", DEFAULT_SEED))
 
-            all_ids = list(new_queryset.order_by("id").values_list("id", flat=True))
-            rng.shuffle(all_ids)
+            all_ids = self.get_random_ids(request, new_queryset, view)
 
             start_index = page * page_size
             end_index = (page + 1) * page_size
             page_ids = all_ids[start_index:end_index]
 
-            request._original_item_count = new_queryset.count()
+            request._original_item_count = len(all_ids)
 
-            return new_queryset.filter(id__in=page_ids)
+            return new_queryset.filter(id__in=page_ids).order_by(
+                Case(
+                    *[When(id=pk, then=index) for index, pk in enumerate(page_ids)],
+                    output_field=IntegerField(),
+                )
+            )
 
         return new_queryset
+
+
+class SearchIndexFilter(filters.SearchFilter):
+    """
+    Search filter that uses the full text search index instead of scanning the
+    table with case insensitive substring lookups.
+    Annotates results with a search_rank that can be used for relevance ordering.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, "")
+        if not query.strip():
+            return queryset
+        return search_queryset(queryset, query)
@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+from clubs.caching import cache_get_tagged, cache_set_tagged
+from clubs.models import Club
+
+
+HIERARCHY_CACHE_KEY = "clubs:hierarchy"
+
+
+def get_club_graph():
+    """
+    Return the parent and child relationships between all clubs as a pair of
+    adjacency mappings from club ids to lists of club ids.
+
+    The graph is loaded with a single query and cached until the relationships
+    change. It is small, since most clubs have no parents or children.
+    """
+    graph = cache_get_tagged(HIERARCHY_CACHE_KEY)
+    if graph is None:
+        parents = defaultdict(list)
+        children = defaultdict(list)
+        for child, parent in Club.parent_orgs.through.objects.values_list(
+            "from_club_id", "to_club_id"
+        ):
+            parents[child].append(parent)
+            children[parent].append(child)
+        graph = {"parent_orgs": dict(parents), "children_orgs": dict(children)}
+        cache_set_tagged(HIERARCHY_CACHE_KEY, graph, 60 * 60 * 24, ["hierarchy"])
+    return graph
+
+
+def get_related_club_ids(relationship, club_id, graph=None):
+    """
+    Return the ids of all ancestors (parent_orgs) or descendants (children_orgs)
+    of a club, including the club itself.
+    """
+    edges = (graph or get_club_graph())[relationship]
+    found = {club_id}
+    queue = [club_id]
+    while queue:
+        for related in edges.get(queue.pop(), []):
+            if related not in found:
+                found.add(related)
+                queue.append(related)
+    return found
+
+
+def get_relationship_tree(relationship, club):
+    """
+    Format all parents (parent_orgs) or children (children_orgs) of a club into
+    a tree. Clubs that appear again further down a branch are not expanded.
+    """
+    edges = get_club_graph()[relationship]
+    ids = get_related_club_ids(relationship, club.id)
+
+    # sort the related clubs using the default club ordering
+    clubs = {
+        row["id"]: row
+        for row in Club.objects.filter(id__in=ids).values("id", "code", "name")
+    }
+    order = {pk: index for index, pk in enumerate(clubs)}
+
+    def build(pk, path):
+        related = sorted(
+            (child for child in edges.get(pk, []) if child in clubs), key=order.get
+        )
+        children = []
+        for child in related:
+            if child not in path:
+                children.append(build(child, path | {child}))
+            else:
+                children.append(
+                    {"name": clubs[child]["name"], "code": clubs[child]["code"]}
+                )
+        return {
+            "name": clubs[pk]["name"],
+            "code": clubs[pk]["code"],
+            "children": children,
+        }
+
+    clubs[club.id] = {"id": club.id, "code": club.code, "name": club.name}
+    return build(club.id, {club.id})
@@ -79,7 +79,7 @@ class Command(BaseCommand):
             # allow existing approved version to stay on penn clubs website for now
             ghosted = 0
             for club in clubs:
-                if club.history.filter(approved=True).exists():
+                if club.approved_snapshot:
                     club.ghost = True
                     club._change_reason = (
                         "Mark pending approval (yearly renewal process)"
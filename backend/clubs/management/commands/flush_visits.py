@@ -0,0 +1,176 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from clubs.management.commands.rollup_analytics import record_analytics
+from clubs.models import AnalyticsRollup, ClubVisit
+
+
+class VisitBuffer(object):
+    """
+    A write-behind buffer of club visits. Visits are stored in the cache under
+    sequential keys and written to the database in batches, either when
+    VISIT_BUFFER_SIZE visits are waiting or after VISIT_BUFFER_DELAY seconds.
+
+    Since the buffer lives in the cache and not in the process, visits that
+    are waiting when a process exits are written by the next flush in any
+    process, or by running the flush_visits command.
+    """
+
+    head_key = "visits:buffer:head"
+    tail_key = "visits:buffer:tail"
+    lock_key = "visits:buffer:lock"
+    missing_key = "visits:buffer:missing"
+
+    # seconds after which a visit that was never written to the cache is skipped
+    missing_timeout = 60
+
+    # seconds to keep visits in the cache before they are discarded
+    timeout = 60 * 60 * 24 * 7
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timer = None
+        self.flushing = False
+
+    def get_item_key(self, seq):
+        return f"visits:buffer:{seq}"
+
+    def add(self, club_id, person_id, visit_type, ip):
+        """
+        Record a club visit. The visit is written synchronously if background
+        tasks are disabled.
+        """
+        if not settings.BACKGROUND_TASKS:
+            ClubVisit.objects.create(
+                club_id=club_id, person_id=person_id, visit_type=visit_type, ip=ip
+            )
+            return
+
+        cache.add(self.head_key, 0, None)
+        seq = cache.incr(self.head_key)
+        cache.set(
+            self.get_item_key(seq),
+            (club_id, person_id, visit_type, ip, timezone.now().isoformat()),
+            self.timeout,
+        )
+
+        full = seq - cache.get(self.tail_key, 0) >= settings.VISIT_BUFFER_SIZE
+        with self.lock:
+            # at most one flush is started by each process at a time
+            if full and not self.flushing:
+                self.flushing = True
+                threading.Thread(target=self.run_flush, daemon=True).start()
+            elif self.timer is None:
+                self.timer = threading.Timer(settings.VISIT_BUFFER_DELAY, self.run)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def get_pending(self, tail, head):
+        """
+        Return the buffered visits after the tail in order, and the sequence
+        number of the last one. Stops at the first visit that has not been
+        written to the cache yet, unless it has been missing for a while.
+        """
+        keys = [self.get_item_key(seq) for seq in range(tail + 1, head + 1)]
+        items = cache.get_many(keys)
+
+        pending = []
+        last = tail
+        for seq, key in enumerate(keys, start=tail + 1):
+            if key not in items:
+                missing = cache.get(self.missing_key)
+                if missing is None or missing[0] != seq:
+                    cache.set(self.missing_key, (seq, time.time()), None)
+                    break
+                if time.time() - missing[1] < self.missing_timeout:
+                    break
+            else:
+                pending.append(items[key])
+            last = seq
+        return pending, last
+
+    def flush(self, batch_size=1000):
+        """
+        Write all buffered visits to the database. Only one process flushes the
+        buffer at a time. Return the number of visits that were written.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = None
+
+        if not cache.add(self.lock_key, True, 60 * 5):
+            return 0
+
+        written = 0
+        try:
+            head = cache.get(self.head_key, 0)
+            tail = cache.get(self.tail_key, 0)
+            while tail < head:
+                pending, last = self.get_pending(tail, min(head, tail + batch_size))
+                if last == tail:
+                    break
+
+                visits = [
+                    ClubVisit(
+                        club_id=club_id,
+                        person_id=person_id,
+                        visit_type=visit_type,
+                        ip=ip,
+                        created_at=parse_datetime(created_at),
+                    )
+                    for club_id, person_id, visit_type, ip, created_at in pending
+                ]
+                with transaction.atomic():
+                    ClubVisit.objects.bulk_create(visits)
+                    record_analytics(AnalyticsRollup.METRIC_VISIT, visits)
+
+                cache.set(self.tail_key, last, None)
+                cache.delete_many(
+                    [self.get_item_key(seq) for seq in range(tail + 1, last + 1)]
+                )
+                written += len(visits)
+                tail = last
+        finally:
+            cache.delete(self.lock_key)
+        return written
+
+    def run(self):
+        with self.lock:
+            self.timer = None
+            if self.flushing:
+                # visits that the running flush misses start a new timer
+                return
+            self.flushing = True
+        self.run_flush()
+
+    def run_flush(self):
+        try:
+            self.flush()
+        finally:
+            with self.lock:
+                self.flushing = False
+            connection.close()
+
+
+visit_buffer = VisitBuffer()
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes all club visits that are waiting in the visit buffer to the database. "
+        "Visits are normally written automatically, this script can be run on "
+        "shutdown or periodically to drain visits left behind by stopped processes."
+    )
+    web_execute = True
+
+    def handle(self, *args, **kwargs):
+        written = visit_buffer.flush()
+        self.stdout.write(f"Wrote {written} buffered club visits.")
@@ -2,6 +2,7 @@ import traceback
 
 from django.core.management.base import BaseCommand
 
+from clubs.calendars import import_calendars
 from clubs.models import Club
 
 
@@ -10,18 +11,21 @@ class Command(BaseCommand):
     web_execute = True
 
     def handle(self, *args, **kwargs):
-        count = 0
-        for club in Club.objects.filter(ics_import_url__isnull=False).exclude(
-            ics_import_url=""
-        ):
-            try:
-                club.add_ics_events()
-                count += 1
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f"Could not import ICS events for {club.code}: {e}"
-                    )
-                )
-                self.stdout.write(self.style.ERROR(traceback.format_exc()))
-        self.stdout.write(self.style.SUCCESS(f"Imported {count} ICS calendars!"))
+        def on_error(club, e):
+            self.stdout.write(
+                self.style.ERROR(f"Could not import ICS events for {club.code}: {e}")
+            )
+            self.stdout.write(self.style.ERROR(traceback.format_exc()))
+
+        clubs = (
+            Club.objects.filter(ics_import_url__isnull=False)
+            .exclude(ics_import_url="")
+            .only("id", "code", "ics_import_url")
+        )
+        imported, unchanged = import_calendars(clubs, on_error)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {imported} ICS calendars, "
+                f"{unchanged} calendars have not changed!"
+            )
+        )
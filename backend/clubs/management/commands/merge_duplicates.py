@@ -2,6 +2,8 @@ from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from django.db.models import Count, Q
 
+from clubs.caching import invalidate_cache_tags
+from clubs.management.commands.rollup_analytics import rebuild_analytics
 from clubs.models import (
     Club,
     Event,
@@ -182,7 +184,14 @@ def merge_clubs(one, two):
     Membership.objects.filter(
         club=secondary, person__in=duplicate_memberships,
     ).delete()
-    Membership.objects.filter(club=secondary).update(club=primary)
+    moved = Membership.objects.filter(club=secondary)
+    invalidate_cache_tags(
+        *(
+            f"permissions:{person}"
+            for person in moved.values_list("person_id", flat=True)
+        )
+    )
+    moved.update(club=primary)
 
     # Take all membership invites
     MembershipInvite.objects.filter(club=secondary).update(club=primary)
@@ -205,4 +214,7 @@ def merge_clubs(one, two):
     secondary.delete()
     primary.save()
 
+    # moved bookmarks and subscriptions do not update the analytics rollups
+    rebuild_analytics([primary.id])
+
     return primary
@@ -1,34 +1,45 @@
 import datetime
+import itertools
+import random
+import uuid
 
 import pytz
 import requests
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
 from django.core.files.base import ContentFile
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from django.utils import timezone
 from options.models import Option
 
+from clubs.management.commands.rollup_analytics import rebuild_analytics
 from clubs.models import (
     Advisor,
     ApplicationCommittee,
     ApplicationMultipleChoice,
     ApplicationQuestion,
+    ApplicationQuestionResponse,
     ApplicationSubmission,
     Badge,
     Club,
     ClubApplication,
     ClubFair,
     ClubFairRegistration,
+    ClubVisit,
     Event,
+    Favorite,
     Major,
     Membership,
     Profile,
     QuestionAnswer,
     School,
     StudentType,
+    Subscribe,
     Tag,
     Testimonial,
     Year,
+    update_club_cards,
 )
 
 
@@ -237,9 +248,531 @@ fair_registration_text = """
 """
 
 
+class SyntheticDataGenerator(object):
+    """
+    Generates a large synthetic dataset for load testing and profiling.
+
+    The popularity of the clubs follows a power law controlled by the skew, so that
+    a few clubs receive most of the memberships, favorites and visits, like in
+    production. All random choices are made using a seeded random number
+    generator, so the same parameters always produce the same dataset.
+    """
+
+    # number of objects created for each unit of scale
+    CLUBS_PER_SCALE = 100
+    USERS_PER_SCALE = 1000
+
+    ADJECTIVES = [
+        "Amateur",
+        "Competitive",
+        "Creative",
+        "Global",
+        "Independent",
+        "Intercollegiate",
+        "Modern",
+        "Undergraduate",
+    ]
+    NOUNS = [
+        "Astronomy",
+        "Chess",
+        "Consulting",
+        "Dance",
+        "Debate",
+        "Film",
+        "Robotics",
+        "Sailing",
+    ]
+    GROUPS = ["Association", "Club", "Collective", "Council", "Society", "Team"]
+    TAGS = [
+        "Academic",
+        "Arts",
+        "Athletics",
+        "Cultural",
+        "Graduate",
+        "Professional",
+        "Service",
+        "Undergraduate",
+    ]
+
+    def __init__(
+        self,
+        scale,
+        seed=0,
+        skew=1.0,
+        memberships_per_user=2,
+        favorites_per_user=5,
+        subscriptions_per_user=2,
+        visits_per_club=200,
+        events_per_club=4,
+        application_rate=0.1,
+        submissions_per_application=30,
+        batch_size=1000,
+        stdout=None,
+    ):
+        self.scale = scale
+        self.random = random.Random(seed)
+        self.skew = skew
+        self.memberships_per_user = memberships_per_user
+        self.favorites_per_user = favorites_per_user
+        self.subscriptions_per_user = subscriptions_per_user
+        self.visits_per_club = visits_per_club
+        self.events_per_club = events_per_club
+        self.application_rate = application_rate
+        self.submissions_per_application = submissions_per_application
+        self.batch_size = batch_size
+        self.stdout = stdout
+        self.now = timezone.now()
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def get_count(self, mean):
+        """
+        Return a random count with an exponential distribution around the mean.
+        """
+        if mean <= 0:
+            return 0
+        return int(self.random.expovariate(1 / mean))
+
+    def get_uuid(self):
+        return uuid.UUID(int=self.random.getrandbits(128), version=4)
+
+    def sample_clubs(self, count):
+        """
+        Return up to count distinct clubs, weighted by popularity.
+        """
+        count = min(count, len(self.clubs))
+        chosen = set()
+        for _ in range(4):
+            chosen.update(
+                self.random.choices(
+                    range(len(self.clubs)), cum_weights=self.weights, k=count
+                )
+            )
+            if len(chosen) >= count:
+                break
+        return [self.clubs[index] for index in sorted(chosen)[:count]]
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        return len(objects)
+
+    def generate(self):
+        """
+        Generate the dataset and return the number of objects created per model.
+        """
+        if Club.objects.filter(code__startswith="synthetic-").exists():
+            raise CommandError(
+                "Synthetic data has already been generated, "
+                "flush the database before generating it again."
+            )
+
+        counts = {}
+        with transaction.atomic():
+            counts["users"] = self.create_users()
+            counts["clubs"] = self.create_clubs()
+            counts["memberships"] = self.create_memberships()
+            counts["favorites"] = self.create_relations(
+                Favorite, self.favorites_per_user
+            )
+            counts["subscriptions"] = self.create_relations(
+                Subscribe, self.subscriptions_per_user
+            )
+            counts["visits"] = self.create_visits()
+            counts["events"] = self.create_events()
+            counts["fair registrations"] = self.create_fairs()
+            counts["submissions"] = self.create_applications()
+
+            rebuild_analytics([club.id for club in self.clubs])
+        return counts
+
+    def create_users(self):
+        count = self.USERS_PER_SCALE * self.scale
+        self.bulk_create(
+            get_user_model(),
+            [
+                get_user_model()(
+                    username=f"synthetic{i}",
+                    email=f"synthetic{i}@example.com",
+                    first_name=self.random.choice(self.ADJECTIVES),
+                    last_name=f"Student {i}",
+                    password=UNUSABLE_PASSWORD_PREFIX,
+                )
+                for i in range(count)
+            ],
+        )
+        self.users = list(
+            get_user_model()
+            .objects.filter(username__startswith="synthetic")
+            .order_by("id")
+        )
+
+        # profiles are usually created by a signal that bulk_create does not send
+        schools = list(School.objects.filter(is_graduate=False).order_by("id"))
+        years = range(self.now.year, self.now.year + 4)
+        self.bulk_create(
+            Profile,
+            [
+                Profile(
+                    user=user,
+                    graduation_year=self.random.choice(years),
+                    has_been_prompted=True,
+                    uuid_secret=self.get_uuid(),
+                )
+                for user in self.users
+            ],
+        )
+        if schools:
+            self.bulk_create(
+                Profile.school.through,
+                [
+                    Profile.school.through(
+                        profile_id=user.id, school=self.random.choice(schools)
+                    )
+                    for user in self.users
+                ],
+            )
+        self.log(f"Created {count} synthetic users.")
+        return count
+
+    def create_clubs(self):
+        count = self.CLUBS_PER_SCALE * self.scale
+        clubs = []
+        for i in range(count):
+            adjective = self.random.choice(self.ADJECTIVES)
+            noun = self.random.choice(self.NOUNS)
+            group = self.random.choice(self.GROUPS)
+            clubs.append(
+                Club(
+                    code=f"synthetic-club-{i}",
+                    name=f"Penn {adjective} {noun} {group} {i}",
+                    subtitle="" if i % 3 else f"The {noun.lower()} club at Penn.",
+                    description=f"<p>We are the {adjective.lower()} {noun.lower()} "
+                    f"{group.lower()} at Penn. Everyone is welcome to join!</p>",
+                    email=f"synthetic-club-{i}@example.com",
+                    active=True,
+                    approved=self.random.random() < 0.95,
+                    size=self.random.choice(Club.SIZE_CHOICES)[0],
+                    application_required=self.random.choice(Club.APPLICATION_CHOICES)[
+                        0
+                    ],
+                    recruiting_cycle=self.random.choice(Club.RECRUITING_CYCLES)[0],
+                    accepting_members=self.random.random() < 0.5,
+                    founded=datetime.date(self.random.randint(1900, 2020), 1, 1),
+                )
+            )
+        self.bulk_create(Club, clubs)
+        self.clubs = list(
+            Club.objects.filter(code__startswith="synthetic-club-").order_by("id")
+        )
+
+        # clubs created first are the most popular
+        self.weights = list(
+            itertools.accumulate(
+                1 / (rank + 1) ** self.skew for rank in range(len(self.clubs))
+            )
+        )
+
+        tags = [Tag.objects.get_or_create(name=name)[0] for name in self.TAGS]
+        self.bulk_create(
+            Club.tags.through,
+            [
+                Club.tags.through(club=club, tag=tag)
+                for club in self.clubs
+                for tag in self.random.sample(tags, self.random.randint(1, 3))
+            ],
+        )
+        update_club_cards([club.id for club in self.clubs])
+        self.log(f"Created {count} synthetic clubs.")
+        return count
+
+    def create_memberships(self):
+        memberships = []
+        for user in self.users:
+            for club in self.sample_clubs(self.get_count(self.memberships_per_user)):
+                memberships.append(
+                    Membership(
+                        person=user,
+                        club=club,
+                        role=Membership.ROLE_OFFICER
+                        if self.random.random() < 0.1
+                        else Membership.ROLE_MEMBER,
+                    )
+                )
+
+        # every club with members has an owner
+        owners = set()
+        for membership in memberships:
+            if membership.club.id not in owners:
+                owners.add(membership.club.id)
+                membership.role = Membership.ROLE_OWNER
+                membership.title = "Owner"
+
+        count = self.bulk_create(Membership, memberships)
+        self.log(f"Created {count} synthetic memberships.")
+        return count
+
+    def create_relations(self, model, mean):
+        count = self.bulk_create(
+            model,
+            [
+                model(person=user, club=club)
+                for user in self.users
+                for club in self.sample_clubs(self.get_count(mean))
+            ],
+        )
+        self.log(f"Created {count} synthetic {model._meta.verbose_name_plural}.")
+        return count
+
+    def create_visits(self):
+        total = self.visits_per_club * len(self.clubs)
+        visit_types = [value for value, _ in ClubVisit.VISIT_TYPES]
+        count = 0
+        while count < total:
+            size = min(self.batch_size * 10, total - count)
+            clubs = self.random.choices(self.clubs, cum_weights=self.weights, k=size)
+            count += self.bulk_create(
+                ClubVisit,
+                [
+                    ClubVisit(
+                        person=self.random.choice(self.users),
+                        club=club,
+                        visit_type=self.random.choice(visit_types),
+                        created_at=self.now
+                        - datetime.timedelta(
+                            seconds=self.random.randint(0, 365 * 24 * 60 * 60)
+                        ),
+                    )
+                    for club in clubs
+                ],
+            )
+        self.log(f"Created {count} synthetic club visits.")
+        return count
+
+    def create_events(self):
+        types = [value for value, _ in Event.TYPES if value != Event.FAIR]
+        events = []
+        for club in self.clubs:
+            for j in range(self.get_count(self.events_per_club)):
+                start_time = self.now + datetime.timedelta(
+                    hours=self.random.randint(-90 * 24, 90 * 24)
+                )
+                events.append(
+                    Event(
+                        code=f"{club.code}-event-{j}",
+                        club=club,
+                        name=f"{club.name} Event {j}",
+                        description="<p>Come to our event!</p>",
+                        type=self.random.choice(types),
+                        start_time=start_time,
+                        end_time=start_time + datetime.timedelta(hours=2),
+                        ics_uuid=self.get_uuid(),
+                    )
+                )
+        count = self.bulk_create(Event, events)
+        self.log(f"Created {count} synthetic events.")
+        return count
+
+    def create_fairs(self):
+        count = 0
+        for i in range(2):
+            start_time = self.now + datetime.timedelta(days=30 * (i + 1))
+            fair = ClubFair.objects.create(
+                name=f"Synthetic Activities Fair {i}",
+                organization="Student Activities Council",
+                contact="sac@example.com",
+                start_time=start_time,
+                end_time=start_time + datetime.timedelta(days=2),
+                registration_end_time=start_time - datetime.timedelta(days=7),
+            )
+            badge = Badge.objects.create(
+                label=f"Synthetic Fair Category {i}",
+                purpose="fair",
+                fair=fair,
+                visible=True,
+            )
+            clubs = [club for club in self.clubs if self.random.random() < 0.4]
+            count += self.bulk_create(
+                ClubFairRegistration,
+                [ClubFairRegistration(club=club, fair=fair) for club in clubs],
+            )
+            self.bulk_create(
+                Club.badges.through,
+                [Club.badges.through(club=club, badge=badge) for club in clubs],
+            )
+            self.bulk_create(
+                Event,
+                [
+                    Event(
+                        code=f"{club.code}-fair-{i}",
+                        club=club,
+                        name=f"{club.name} at {fair.name}",
+                        type=Event.FAIR,
+                        start_time=fair.start_time,
+                        end_time=fair.end_time,
+                        ics_uuid=self.get_uuid(),
+                    )
+                    for club in clubs
+                ],
+            )
+        self.log(f"Created {count} synthetic fair registrations.")
+        return count
+
+    def create_applications(self):
+        count = 0
+        for club in self.clubs:
+            if self.random.random() >= self.application_rate:
+                continue
+            application = ClubApplication.objects.create(
+                club=club,
+                name=f"{club.name} Application",
+                application_start_time=self.now - datetime.timedelta(days=7),
+                application_end_time=self.now + datetime.timedelta(days=7),
+                result_release_time=self.now + datetime.timedelta(days=14),
+            )
+            committees = [
+                ApplicationCommittee.objects.create(
+                    name=f"Committee {i}", application=application
+                )
+                for i in range(2)
+            ]
+            free_response = ApplicationQuestion.objects.create(
+                question_type=ApplicationQuestion.FREE_RESPONSE,
+                prompt="Why do you want to join?",
+                application=application,
+                precedence=0,
+            )
+            multiple_choice = ApplicationQuestion.objects.create(
+                question_type=ApplicationQuestion.MULTIPLE_CHOICE,
+                prompt="How did you hear about us?",
+                application=application,
+                precedence=1,
+            )
+            choices = [
+                ApplicationMultipleChoice.objects.create(
+                    value=value, question=multiple_choice
+                )
+                for value in ["Friends", "Fair", "Website"]
+            ]
+
+            applicants = self.random.sample(
+                self.users,
+                min(len(self.users), self.get_count(self.submissions_per_application)),
+            )
+            self.bulk_create(
+                ApplicationSubmission,
+                [
+                    ApplicationSubmission(
+                        user=user,
+                        application=application,
+                        committee=self.random.choice(committees),
+                        status=self.random.choice(ApplicationSubmission.STATUS_TYPES)[
+                            0
+                        ],
+                    )
+                    for user in applicants
+                ],
+            )
+            submissions = list(application.submissions.order_by("id"))
+            self.bulk_create(
+                ApplicationQuestionResponse,
+                [
+                    ApplicationQuestionResponse(
+                        text="I love this club!",
+                        question=free_response,
+                        submission=submission,
+                    )
+                    for submission in submissions
+                ]
+                + [
+                    ApplicationQuestionResponse(
+                        question=multiple_choice,
+                        multiple_choice=self.random.choice(choices),
+                        submission=submission,
+                    )
+                    for submission in submissions
+                ],
+            )
+            count += len(submissions)
+        self.log(f"Created {count} synthetic application submissions.")
+        return count
+
+
 class Command(BaseCommand):
     help = "Populates the development environment with dummy data."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            type=int,
+            default=0,
+            help="Instead of the demo clubs, generate a synthetic dataset with "
+            f"{SyntheticDataGenerator.CLUBS_PER_SCALE} clubs and "
+            f"{SyntheticDataGenerator.USERS_PER_SCALE} users per unit of scale.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="The random seed used to generate the synthetic dataset.",
+        )
+        parser.add_argument(
+            "--skew",
+            type=float,
+            default=1.0,
+            help="The exponent of the power law used to distribute activity across "
+            "clubs, higher values concentrate activity on fewer clubs.",
+        )
+        parser.add_argument(
+            "--memberships-per-user",
+            type=float,
+            default=2,
+            help="The average number of memberships per synthetic user.",
+        )
+        parser.add_argument(
+            "--favorites-per-user",
+            type=float,
+            default=5,
+            help="The average number of favorites per synthetic user.",
+        )
+        parser.add_argument(
+            "--subscriptions-per-user",
+            type=float,
+            default=2,
+            help="The average number of subscriptions per synthetic user.",
+        )
+        parser.add_argument(
+            "--visits-per-club",
+            type=int,
+            default=200,
+            help="The average number of page visits per synthetic club.",
+        )
+        parser.add_argument(
+            "--events-per-club",
+            type=float,
+            default=4,
+            help="The average number of events per synthetic club.",
+        )
+        parser.add_argument(
+            "--application-rate",
+            type=float,
+            default=0.1,
+            help="The fraction of synthetic clubs with an application.",
+        )
+        parser.add_argument(
+            "--submissions-per-application",
+            type=float,
+            default=30,
+            help="The average number of submissions per synthetic application.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of rows inserted per query.",
+        )
+
     def handle(self, *args, **kwargs):
         if Club.objects.filter(name="Penn Labs").exists():
             raise CommandError(
@@ -325,6 +858,29 @@ class Command(BaseCommand):
             ]
         ]
 
+        if kwargs.get("scale"):
+            generator = SyntheticDataGenerator(
+                kwargs["scale"],
+                seed=kwargs["seed"],
+                skew=kwargs["skew"],
+                memberships_per_user=kwargs["memberships_per_user"],
+                favorites_per_user=kwargs["favorites_per_user"],
+                subscriptions_per_user=kwargs["subscriptions_per_user"],
+                visits_per_club=kwargs["visits_per_club"],
+                events_per_club=kwargs["events_per_club"],
+                application_rate=kwargs["application_rate"],
+                submissions_per_application=kwargs["submissions_per_application"],
+                batch_size=kwargs["batch_size"],
+                stdout=self.stdout,
+            )
+            counts = generator.generate()
+            self.stdout.write(
+                "Finished generating synthetic data: "
+                + ", ".join(f"{count} {name}" for name, count in counts.items())
+                + "."
+            )
+            return
+
         image_cache = {}
 
         def get_image(url):
@@ -1,12 +1,347 @@
 import datetime
+import hashlib
 import random
+from collections import defaultdict
 from math import floor
 
 import bleach
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
 from django.utils import timezone
 
-from clubs.models import Club, ClubFair, Membership
+from clubs.caching import invalidate_cache_tags
+from clubs.models import (
+    Club,
+    ClubApplication,
+    ClubFairRegistration,
+    ClubRank,
+    Event,
+    Favorite,
+    Membership,
+    Testimonial,
+)
+from clubs.ranking import rank_update_queue
+
+
+SOCIAL_FIELDS = [
+    "facebook",
+    "website",
+    "twitter",
+    "instagram",
+    "linkedin",
+    "github",
+    "youtube",
+]
+
+# club fields that are used to compute the ranking
+RANK_FIELDS = [
+    "active",
+    "image",
+    "subtitle",
+    "description",
+    "email",
+    "email_public",
+    "how_to_get_involved",
+    "updated_at",
+] + SOCIAL_FIELDS
+
+
+def get_cleaned_description_lengths(descriptions):
+    """
+    Return the length of each description with all html removed.
+    Lengths are cached by the hash of the description, since bleach is slow and
+    descriptions rarely change.
+    """
+    keys = {
+        desc: "rank:description:{}".format(
+            hashlib.md5(desc.encode("utf-8")).hexdigest()
+        )
+        for desc in set(descriptions)
+    }
+    cached = cache.get_many(keys.values())
+
+    lengths = {}
+    missing = {}
+    for desc, key in keys.items():
+        if key in cached:
+            lengths[desc] = cached[key]
+        else:
+            lengths[desc] = missing[key] = len(
+                bleach.clean(
+                    desc, tags=[], attributes={}, styles=[], strip=True
+                ).strip()
+            )
+    cache.set_many(missing, 60 * 60 * 24 * 30)
+    return lengths
+
+
+def club_filter(ids):
+    """
+    Return the filter that restricts a query on a club related model to the
+    given club ids. If ids is None, the query is not restricted.
+    """
+    return {} if ids is None else {"club__in": ids}
+
+
+def get_event_points(events, threshold, min_description_length):
+    """
+    Return the points for a list of upcoming events for a club.
+    """
+    if not events:
+        return 0
+
+    points = 0
+    if any((e.end_time - e.start_time).seconds / 3600 < 16 for e in events):
+        points += threshold
+        if all(
+            len(e.description) >= min_description_length
+            and e.description not in {"Replace this description!"}
+            and e.image is not None
+            for e in events
+        ):
+            points += threshold
+    return points
+
+
+class RankingEngine(object):
+    """
+    Computes the ranking of clubs in batches.
+    Each component of the ranking is computed for all of the clubs at once with
+    a single grouped query, regardless of the number of clubs.
+    """
+
+    COMPONENTS = [
+        "status",
+        "favorites",
+        "tags",
+        "members",
+        "profile",
+        "fair",
+        "applications",
+        "events",
+        "testimonials",
+        "random",
+    ]
+
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+
+    def compute(self, clubs, components=None, all_clubs=False):
+        """
+        Return a mapping of club ids to a mapping of component names to the points
+        awarded to the club for that component.
+        The clubs must have all of the RANK_FIELDS loaded.
+        If all_clubs is set, the queries are not restricted to the given clubs.
+        """
+        ids = None if all_clubs else [club.id for club in clubs]
+        scores = {club.id: {} for club in clubs}
+        for component in components or self.COMPONENTS:
+            points = getattr(self, f"rank_{component}")(clubs, ids)
+            for club in clubs:
+                scores[club.id][component] = points.get(club.id, 0)
+        return scores
+
+    def rank_status(self, clubs, ids):
+        # inactive clubs get deprioritized
+        return {club.id: -1000 for club in clubs if not club.active}
+
+    def rank_favorites(self, clubs, ids):
+        # small points for favorites
+        counts = (
+            Favorite.objects.filter(**club_filter(ids))
+            .values_list("club")
+            .annotate(count=Count("id"))
+        )
+        return {club_id: count / 25 for club_id, count in counts}
+
+    def rank_tags(self, clubs, ids):
+        # points for minimum amount of tags
+        counts = (
+            Club.tags.through.objects.filter(**club_filter(ids))
+            .values_list("club")
+            .annotate(count=Count("id"))
+        )
+        points = {}
+        for club_id, count in counts:
+            if count >= 3 and count <= 7:
+                points[club_id] = 15
+            elif count > 7:
+                points[club_id] = 7
+        return points
+
+    def rank_members(self, clubs, ids):
+        counts = (
+            Membership.objects.filter(active=True, **club_filter(ids))
+            .values_list("club")
+            .annotate(
+                officers=Count("id", filter=Q(role__lte=Membership.ROLE_OFFICER)),
+                members=Count("id", filter=Q(role__gte=Membership.ROLE_MEMBER)),
+            )
+        )
+        points = {}
+        for club_id, officers, members in counts:
+            # lots of points for officers
+            score = 15 if officers >= 3 else 0
+
+            # ordinary members give even more points
+            if members >= 3:
+                score += 10
+            score += members / 10
+            points[club_id] = score
+        return points
+
+    def rank_profile(self, clubs, ids):
+        lengths = get_cleaned_description_lengths(club.description for club in clubs)
+
+        points = {}
+        for club in clubs:
+            score = 0
+
+            # points for logo
+            if club.image is not None:
+                score += 15
+
+            # points for subtitle
+            subtitle = club.subtitle.strip()
+            if subtitle.lower() == "your subtitle here":
+                score -= 10
+            elif len(subtitle) > 3:
+                score += 5
+
+            # images in description? awesome
+            if "<img" in club.description or "<iframe" in club.description:
+                score += 3
+
+            # points for longer descriptions
+            length = lengths[club.description]
+            if length > 25:
+                score += 25
+            if length > 250:
+                score += 10
+            if length > 1000:
+                score += 10
+
+            # points for public contact email
+            if club.email and club.email_public:
+                score += 10
+
+            # points for social links
+            if len([field for field in SOCIAL_FIELDS if getattr(club, field)]) >= 2:
+                score += 10
+
+            # points for how to get involved
+            if len(club.how_to_get_involved.strip()) <= 3:
+                score -= 30
+
+            # points for updated
+            if club.updated_at < self.now - datetime.timedelta(days=30 * 8):
+                score -= 10
+
+            points[club.id] = score
+        return points
+
+    def rank_fair(self, clubs, ids):
+        # points for fair
+        registered = ClubFairRegistration.objects.filter(
+            fair__end_time__gte=self.now, **club_filter(ids)
+        ).values_list("club", flat=True)
+        return {club_id: 10 for club_id in registered}
+
+    def rank_applications(self, clubs, ids):
+        # points for club applications
+        current = ClubApplication.objects.filter(
+            application_start_time__lte=self.now,
+            application_end_time__gte=self.now,
+            **club_filter(ids),
+        ).values_list("club", flat=True)
+        return {club_id: 25 for club_id in current}
+
+    def rank_events(self, clubs, ids):
+        # points for events
+        events = Event.objects.filter(
+            end_time__gte=self.now,
+            start_time__lte=self.now + datetime.timedelta(weeks=1),
+            **club_filter(ids),
+        ).only("club", "start_time", "end_time", "description", "image")
+
+        today_events = defaultdict(list)
+        close_events = defaultdict(list)
+        for event in events:
+            close_events[event.club_id].append(event)
+            if event.start_time <= self.now + datetime.timedelta(days=1):
+                today_events[event.club_id].append(event)
+
+        return {
+            club_id: get_event_points(today_events[club_id], 10, 3)
+            + get_event_points(close_events[club_id], 5, 4)
+            for club_id in close_events
+        }
+
+    def rank_testimonials(self, clubs, ids):
+        # points for testimonials
+        counts = (
+            Testimonial.objects.filter(**club_filter(ids))
+            .values_list("club")
+            .annotate(count=Count("id"))
+        )
+        return {
+            club_id: (10 if count >= 1 else 0) + (5 if count >= 3 else 0)
+            for club_id, count in counts
+        }
+
+    def rank_random(self, clubs, ids):
+        # rng
+        return {club.id: random.random() * 10 for club in clubs}
+
+
+def update_club_ranks(components):
+    """
+    Recompute the given ranking components for each club and update the rank of
+    those clubs using their stored rank breakdowns.
+    Takes a mapping of club ids to the names of the components that have changed.
+    Clubs without a stored rank breakdown have all of their components computed.
+    """
+    clubs = list(Club.objects.filter(pk__in=components.keys()).only(*RANK_FIELDS))
+    breakdowns = {
+        rank.club_id: rank for rank in ClubRank.objects.filter(club__in=clubs)
+    }
+    engine = RankingEngine()
+
+    # batch clubs with the same changed components together
+    groups = defaultdict(list)
+    for club in clubs:
+        if club.id in breakdowns:
+            groups[frozenset(components[club.id])].append(club)
+        else:
+            groups[frozenset(RankingEngine.COMPONENTS)].append(club)
+
+    new_breakdowns = []
+    for changed, group in groups.items():
+        scores = engine.compute(group, sorted(changed))
+        for club in group:
+            if club.id not in breakdowns:
+                breakdowns[club.id] = ClubRank(club=club)
+                new_breakdowns.append(breakdowns[club.id])
+            for component, points in scores[club.id].items():
+                setattr(breakdowns[club.id], component, points)
+
+    for club in clubs:
+        breakdown = breakdowns[club.id]
+        breakdown.updated_at = engine.now
+        club.rank = floor(
+            sum(getattr(breakdown, field) for field in RankingEngine.COMPONENTS)
+        )
+
+    existing_breakdowns = [rank for rank in breakdowns.values() if rank.pk is not None]
+    with transaction.atomic():
+        ClubRank.objects.bulk_create(new_breakdowns)
+        ClubRank.objects.bulk_update(
+            existing_breakdowns, RankingEngine.COMPONENTS + ["updated_at"]
+        )
+        Club.objects.bulk_update(clubs, ["rank"])
+    invalidate_cache_tags("clubs")
 
 
 class Command(BaseCommand):
@@ -59,163 +394,25 @@ class Command(BaseCommand):
         )
 
     def rank(self):
-        count = 0
-        for club in Club.objects.all():
-            ranking = 0
-
-            # inactive clubs get deprioritized
-            if not club.active:
-                ranking -= 1000
-
-            # small points for favorites
-            ranking += club.favorite_set.count() / 25
-
-            # points for minimum amount of tags
-            tags = club.tags.count()
-            if tags >= 3 and tags <= 7:
-                ranking += 15
-            elif tags > 7:
-                ranking += 7
-
-            # lots of points for officers
-            officers = club.membership_set.filter(
-                active=True, role__lte=Membership.ROLE_OFFICER
-            ).count()
-            if officers >= 3:
-                ranking += 15
-
-            # ordinary members give even more points
-            members = club.membership_set.filter(
-                active=True, role__gte=Membership.ROLE_MEMBER
-            ).count()
-            if members >= 3:
-                ranking += 10
-            ranking += members / 10
-
-            # points for logo
-            if club.image is not None:
-                ranking += 15
-
-            # points for subtitle
-            subtitle = club.subtitle.strip()
-            if subtitle.lower() == "your subtitle here":
-                ranking -= 10
-            elif len(subtitle) > 3:
-                ranking += 5
-
-            # images in description? awesome
-            if "<img" in club.description or "<iframe" in club.description:
-                ranking += 3
-
-            # points for longer descriptions
-            cleaned_description = bleach.clean(
-                club.description, tags=[], attributes={}, styles=[], strip=True
-            ).strip()
-
-            if len(cleaned_description) > 25:
-                ranking += 25
-
-            if len(cleaned_description) > 250:
-                ranking += 10
-
-            if len(cleaned_description) > 1000:
-                ranking += 10
-
-            # points for fair
-            now = timezone.now()
-            if ClubFair.objects.filter(
-                end_time__gte=now, participating_clubs=club
-            ).exists():
-                ranking += 10
-
-            # points for club applications
-            if club.clubapplication_set.filter(
-                application_start_time__lte=now, application_end_time__gte=now
-            ).exists():
-                ranking += 25
-
-            # points for events
-            today_events = club.events.filter(
-                end_time__gte=now, start_time__lte=now + datetime.timedelta(days=1)
+        # every club is recomputed, including the clubs that are waiting for an
+        # incremental update
+        rank_update_queue.take()
+
+        clubs = list(Club.objects.only(*RANK_FIELDS))
+        scores = RankingEngine().compute(clubs, all_clubs=True)
+        for club in clubs:
+            club.rank = floor(sum(scores[club.id].values()))
+
+        # bulk updates do not send signals or create history records
+        with transaction.atomic():
+            Club.objects.bulk_update(clubs, ["rank"], batch_size=1000)
+            ClubRank.objects.all().delete()
+            ClubRank.objects.bulk_create(
+                [ClubRank(club=club, **scores[club.id]) for club in clubs],
+                batch_size=1000,
             )
+        invalidate_cache_tags("clubs")
 
-            if today_events.exists():
-                short_events = [
-                    (e.end_time - e.start_time).seconds / 3600 < 16
-                    for e in today_events
-                ]
-                if any(short_events):
-                    ranking += 10
-                    if all(
-                        len(e.description) >= 3
-                        and e.description not in {"Replace this description!"}
-                        and e.image is not None
-                        for e in today_events
-                    ):
-                        ranking += 10
-
-            close_events = club.events.filter(
-                end_time__gte=now, start_time__lte=now + datetime.timedelta(weeks=1)
-            )
-
-            if close_events.exists():
-                short_events = [
-                    (e.end_time - e.start_time).seconds / 3600 < 16
-                    for e in close_events
-                ]
-                if any(short_events):
-                    ranking += 5
-                    if all(
-                        len(e.description) > 3
-                        and e.description not in {"Replace this description!"}
-                        and e.image is not None
-                        for e in close_events
-                    ):
-                        ranking += 5
-
-            # points for public contact email
-            if club.email and club.email_public:
-                ranking += 10
-
-            # points for social links
-            social_fields = [
-                "facebook",
-                "website",
-                "twitter",
-                "instagram",
-                "linkedin",
-                "github",
-                "youtube",
-            ]
-            social_fields = [getattr(club, field) for field in social_fields]
-            has_fields = [
-                field is not None and len(field) >= 3 for field in social_fields
-            ]
-            has_fields = [field for field in social_fields if field]
-            if len(has_fields) >= 2:
-                ranking += 10
-
-            # points for how to get involved
-            if len(club.how_to_get_involved.strip()) <= 3:
-                ranking -= 30
-
-            # points for updated
-            if club.updated_at < now - datetime.timedelta(days=30 * 8):
-                ranking -= 10
-
-            # points for testimonials
-            num_testimonials = club.testimonials.count()
-            if num_testimonials >= 1:
-                ranking += 10
-            if num_testimonials >= 3:
-                ranking += 5
-
-            # rng
-            ranking += random.random() * 10
-
-            club.rank = floor(ranking)
-            club.skip_history_when_saving = True
-            club.save(update_fields=["rank"])
-            count += 1
-
-        self.stdout.write(self.style.SUCCESS(f"Computed rankings for {count} clubs!"))
+        self.stdout.write(
+            self.style.SUCCESS(f"Computed rankings for {len(clubs)} clubs!")
+        )
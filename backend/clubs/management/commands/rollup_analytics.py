@@ -0,0 +1,244 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from clubs.models import AnalyticsRollup, Club, ClubVisit, Favorite, Profile, Subscribe
+
+
+# the raw tables that are aggregated for each metric
+METRIC_MODELS = {
+    AnalyticsRollup.METRIC_VISIT: ClubVisit,
+    AnalyticsRollup.METRIC_FAVORITE: Favorite,
+    AnalyticsRollup.METRIC_SUBSCRIBE: Subscribe,
+}
+
+
+def get_bucket(time, granularity):
+    """
+    Return the start of the hour or day containing the given time in the local
+    timezone, matching the behavior of Trunc on the raw tables.
+    """
+    if timezone.is_naive(time):
+        time = timezone.make_aware(time)
+    local = timezone.localtime(time).replace(
+        tzinfo=None, minute=0, second=0, microsecond=0
+    )
+    if granularity == AnalyticsRollup.GRANULARITY_DAY:
+        local = local.replace(hour=0)
+    return timezone.make_aware(local, is_dst=False)
+
+
+def get_person_dimensions(person_ids):
+    """
+    Return a mapping of person ids to their graduation year and list of schools.
+    """
+    dimensions = {
+        person: (year, [])
+        for person, year in Profile.objects.filter(user_id__in=person_ids).values_list(
+            "user_id", "graduation_year"
+        )
+    }
+    schools = (
+        Profile.school.through.objects.filter(profile__user_id__in=person_ids)
+        .values_list("profile__user_id", "school_id")
+        .order_by("school_id")
+    )
+    for person, school in schools:
+        dimensions[person][1].append(school)
+    return dimensions
+
+
+def get_rollup_counts(objects, sign=1):
+    """
+    Given an iterable of (club id, person id, visit type, created at) tuples,
+    return a mapping of rollup keys to the change in the total and school total.
+    """
+    objects = list(objects)
+    if not objects:
+        return {}
+    dimensions = get_person_dimensions({person for _, person, _, _ in objects})
+
+    counts = defaultdict(lambda: [0, 0])
+    for club, person, visit_type, created_at in objects:
+        year, schools = dimensions.get(person, (None, []))
+        for granularity, _ in AnalyticsRollup.GRANULARITY_TYPES:
+            bucket = get_bucket(created_at, granularity)
+            for index, school in enumerate(schools or [None]):
+                count = counts[(club, visit_type, school, year, granularity, bucket)]
+                # only count the object once towards the total
+                if index == 0:
+                    count[0] += sign
+                count[1] += sign
+    return counts
+
+
+def apply_rollup_counts(metric, counts, create=True):
+    """
+    Add the given counts to the existing rollup rows, creating rows that do not
+    exist yet. Rows that are missing are inserted empty, ignoring rows that were
+    inserted concurrently for the same key, and the counts are then added to them.
+    """
+    missing = []
+    with transaction.atomic():
+        for key, (total, school_total) in counts.items():
+            club, visit_type, school, year, granularity, bucket = key
+            fields = {
+                "club_id": club,
+                "metric": metric,
+                "visit_type": visit_type,
+                "school_id": school,
+                "graduation_year": year,
+                "granularity": granularity,
+                "bucket": bucket,
+            }
+            updated = AnalyticsRollup.objects.filter(**fields).update(
+                total=F("total") + total, school_total=F("school_total") + school_total
+            )
+            if not updated and create:
+                missing.append((fields, total, school_total))
+
+        if missing:
+            AnalyticsRollup.objects.bulk_create(
+                [AnalyticsRollup(**fields) for fields, _, _ in missing],
+                ignore_conflicts=True,
+            )
+            for fields, total, school_total in missing:
+                AnalyticsRollup.objects.filter(**fields).update(
+                    total=F("total") + total,
+                    school_total=F("school_total") + school_total,
+                )
+
+
+def record_analytics(metric, objects, sign=1):
+    """
+    Update the rollups after objects for the given metric have been created
+    (sign of 1) or deleted (sign of -1).
+
+    Deletions are attributed to the current school and graduation year of the
+    student, so the breakdowns can drift if a profile changes. Running the
+    rollup_analytics command rebuilds the rollups from scratch.
+    """
+    model = METRIC_MODELS[metric]
+    counts = get_rollup_counts(
+        (
+            (
+                obj.club_id,
+                obj.person_id,
+                obj.visit_type if model is ClubVisit else None,
+                obj.created_at,
+            )
+            for obj in objects
+        ),
+        sign,
+    )
+    if counts:
+        # rollups for deleted clubs are removed with the club
+        apply_rollup_counts(metric, counts, create=sign > 0)
+
+
+def rebuild_metric(metric, club_ids=None, batch_size=5000):
+    """
+    Replace the rollups for a metric with counts computed from the raw table.
+    Return the number of raw rows and the number of rollups that were created.
+    """
+    model = METRIC_MODELS[metric]
+    queryset = model.objects.all()
+    if club_ids is not None:
+        queryset = queryset.filter(club_id__in=club_ids)
+    fields = ["club_id", "person_id", "created_at"]
+    if model is ClubVisit:
+        fields.append("visit_type")
+
+    counts = defaultdict(lambda: [0, 0])
+
+    def add_batch(batch):
+        for key, (total, school_total) in get_rollup_counts(batch).items():
+            counts[key][0] += total
+            counts[key][1] += school_total
+
+    batch = []
+    total_rows = 0
+    rows = queryset.values_list(*fields).order_by()
+    for club, person, created_at, *visit_type in rows.iterator(chunk_size=batch_size):
+        batch.append((club, person, visit_type[0] if visit_type else None, created_at))
+        total_rows += 1
+        if len(batch) >= batch_size:
+            add_batch(batch)
+            batch = []
+    add_batch(batch)
+
+    rollups = []
+    for key, (total, school_total) in counts.items():
+        club, visit_type, school, year, granularity, bucket = key
+        rollups.append(
+            AnalyticsRollup(
+                club_id=club,
+                metric=metric,
+                visit_type=visit_type,
+                school_id=school,
+                graduation_year=year,
+                granularity=granularity,
+                bucket=bucket,
+                total=total,
+                school_total=school_total,
+            )
+        )
+
+    with transaction.atomic():
+        existing = AnalyticsRollup.objects.filter(metric=metric)
+        if club_ids is not None:
+            existing = existing.filter(club_id__in=club_ids)
+        existing.delete()
+        AnalyticsRollup.objects.bulk_create(rollups, batch_size=1000)
+
+    return total_rows, len(rollups)
+
+
+def rebuild_analytics(club_ids=None, batch_size=5000):
+    """
+    Rebuild the rollups for all metrics, optionally only for the given clubs.
+    """
+    return {
+        metric: rebuild_metric(metric, club_ids, batch_size) for metric in METRIC_MODELS
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the hourly and daily analytics rollups for club visits, "
+        "favorites and subscriptions from the raw tables. "
+        "The rollups are kept up to date automatically after they are built."
+    )
+    web_execute = True
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clubs",
+            dest="clubs",
+            type=str,
+            help="If this parameter is specified, only rebuild the rollups for the "
+            "comma separated list of club codes specified by this argument.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            dest="batch_size",
+            type=int,
+            default=5000,
+            help="The number of raw rows to process at a time.",
+        )
+
+    def handle(self, *args, **kwargs):
+        club_ids = None
+        if kwargs["clubs"]:
+            club_ids = list(
+                Club.objects.filter(
+                    code__in=[code.strip() for code in kwargs["clubs"].split(",")]
+                ).values_list("id", flat=True)
+            )
+
+        results = rebuild_analytics(club_ids, kwargs["batch_size"])
+        for metric, (rows, rollups) in results.items():
+            self.stdout.write(f"Created {rollups} {metric} rollups from {rows} rows.")
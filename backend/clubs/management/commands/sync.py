@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.db.models import Count
 
+from clubs.hierarchy import get_related_club_ids
 from clubs.models import Badge, Club, ClubFairRegistration
 
 
@@ -22,12 +23,13 @@ class Command(BaseCommand):
         )
         parser.set_defaults(dry_run=False)
 
-    def recursively_add_badge(self, club, badge):
-        if club.code in self._visited:
-            return 0
-        self._visited.add(club.code)
+    def add_badge_to_descendants(self, club, badge):
+        """
+        Add the badge to the club and all of its children, recursively.
+        """
         count = 0
-        if not club.badges.filter(pk=badge.pk).exists():
+        descendants = get_related_club_ids("children_orgs", club.id)
+        for club in Club.objects.filter(id__in=descendants).exclude(badges=badge):
             if not self.dry_run:
                 self.stdout.write(f"Adding badge {badge.label} to club {club.name}.")
                 club.badges.add(badge)
@@ -36,26 +38,8 @@ class Command(BaseCommand):
                     f"Would have added badge {badge.label} to club {club.name}."
                 )
             count += 1
-        for child in club.children_orgs.all():
-            return self.recursively_add_badge(club, badge) + count
         return count
 
-    def get_parent_club_codes(self, club):
-        queue = [club.code]
-        found = set()
-
-        while queue:
-            item = queue.pop(0)
-            if item in found:
-                continue
-
-            found.add(item)
-            club = Club.objects.get(code=item)
-            for parent in club.parent_orgs.all():
-                queue.append(parent.code)
-
-        return found
-
     def handle(self, *args, **kwargs):
         self.dry_run = kwargs["dry_run"]
         if self.dry_run:
@@ -102,10 +86,8 @@ class Command(BaseCommand):
         """
         # add badges to parent child relationships
         count = 0
-        for badge in Badge.objects.all():
-            if badge.org is not None:
-                self._visited = set()
-                count += self.recursively_add_badge(badge.org, badge)
+        for badge in Badge.objects.filter(org__isnull=False).select_related("org"):
+            count += self.add_badge_to_descendants(badge.org, badge)
         self.stdout.write(
             self.style.SUCCESS(f"Modified {count} club badge relationships.")
         )
@@ -113,25 +95,24 @@ class Command(BaseCommand):
         # if badge exist on child, link it to the parent directly
         # unless it is already indirectly linked
         count = 0
-        for badge in Badge.objects.all():
-            if badge.org is not None:
-                for club in badge.club_set.all():
-                    if club.pk == badge.org.pk:
-                        continue
+        for badge in Badge.objects.filter(org__isnull=False).select_related("org"):
+            for club in badge.club_set.all():
+                if club.pk == badge.org.pk:
+                    continue
 
-                    parent_club_codes = self.get_parent_club_codes(club)
-                    if badge.org.code not in parent_club_codes:
-                        if not self.dry_run:
-                            self.stdout.write(
-                                f"Adding {badge.org.name} as parent for {club.name}."
-                            )
-                            club.parent_orgs.add(badge.org)
-                        else:
-                            self.stdout.write(
-                                f"Would have added {badge.org.name} "
-                                f"as a parent for {club.name}."
-                            )
-                        count += 1
+                parent_club_ids = get_related_club_ids("parent_orgs", club.id)
+                if badge.org.pk not in parent_club_ids:
+                    if not self.dry_run:
+                        self.stdout.write(
+                            f"Adding {badge.org.name} as parent for {club.name}."
+                        )
+                        club.parent_orgs.add(badge.org)
+                    else:
+                        self.stdout.write(
+                            f"Would have added {badge.org.name} "
+                            f"as a parent for {club.name}."
+                        )
+                    count += 1
         self.stdout.write(
             self.style.SUCCESS(f"Modified {count} parent child relationships.")
         )
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+# These expressions must match clubs.search.get_postgres_vector exactly
+INDEXES = {
+    "clubs_club_search_idx": (
+        "clubs_club",
+        "setweight(to_tsvector('simple'::regconfig, COALESCE(name, '')), 'A') || "
+        "setweight(to_tsvector('simple'::regconfig, COALESCE(code, '') || ' ' || "
+        "COALESCE(subtitle, '') || ' ' || COALESCE(terms, '')), 'B')",
+    ),
+    "clubs_event_search_idx": (
+        "clubs_event",
+        "setweight(to_tsvector('simple'::regconfig, COALESCE(name, '')), 'A') || "
+        "setweight(to_tsvector('simple'::regconfig, COALESCE(description, '')), 'B')",
+    ),
+}
+
+
+def forwards_func(apps, schema_editor):
+    # other databases use the in process search index
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, (table, expression) in INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING GIN (({expression}))"
+        )
+
+
+def reverse_func(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0090_auto_20230106_1443"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_func, reverse_func),
+    ]
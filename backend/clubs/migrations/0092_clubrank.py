@@ -0,0 +1,47 @@
+# Generated by Django 3.2.17 on 2026-10-16 23:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0091_search_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClubRank",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("status", models.FloatField(default=0)),
+                ("favorites", models.FloatField(default=0)),
+                ("tags", models.FloatField(default=0)),
+                ("members", models.FloatField(default=0)),
+                ("profile", models.FloatField(default=0)),
+                ("fair", models.FloatField(default=0)),
+                ("applications", models.FloatField(default=0)),
+                ("events", models.FloatField(default=0)),
+                ("testimonials", models.FloatField(default=0)),
+                ("random", models.FloatField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "club",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rank_breakdown",
+                        to="clubs.club",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 3.2.17 on 2026-10-16 23:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0092_clubrank"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AnalyticsRollup",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[
+                            ("visit", "Visit"),
+                            ("favorite", "Favorite"),
+                            ("subscribe", "Subscribe"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                (
+                    "visit_type",
+                    models.IntegerField(
+                        blank=True,
+                        choices=[
+                            (1, "Club Page Visit"),
+                            (2, "Event Modal Visit"),
+                            (3, "Event Link Clicked"),
+                            (4, "Manage Page Visit"),
+                            (5, "Fair Page Visit"),
+                        ],
+                        null=True,
+                    ),
+                ),
+                (
+                    "graduation_year",
+                    models.PositiveSmallIntegerField(blank=True, null=True),
+                ),
+                (
+                    "granularity",
+                    models.CharField(
+                        choices=[("hour", "Hour"), ("day", "Day")], max_length=8
+                    ),
+                ),
+                ("bucket", models.DateTimeField()),
+                ("total", models.IntegerField(default=0)),
+                ("school_total", models.IntegerField(default=0)),
+                (
+                    "club",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="clubs.club"
+                    ),
+                ),
+                (
+                    "school",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="clubs.school",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="analyticsrollup",
+            index=models.Index(
+                fields=["club", "metric", "granularity", "bucket"],
+                name="clubs_analy_club_id_8591d1_idx",
+            ),
+        ),
+    ]
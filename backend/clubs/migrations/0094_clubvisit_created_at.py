@@ -0,0 +1,21 @@
+# Generated by Django 3.2.17 on 2026-10-16 23:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0093_analyticsrollup"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="clubvisit",
+            name="created_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.2.17 on 2026-10-16 23:17
+
+from collections import defaultdict
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def compute_search_query_stats(apps, schema_editor):
+    SearchQuery = apps.get_model("clubs", "SearchQuery")
+    SearchQueryStat = apps.get_model("clubs", "SearchQueryStat")
+
+    # must match clubs.search.normalize_query
+    counts = defaultdict(int)
+    for query, created_at in SearchQuery.objects.values_list(
+        "query", "created_at"
+    ).iterator():
+        query = " ".join(query.lower().split())[:255]
+        if query:
+            counts[(query, timezone.localdate(created_at))] += 1
+
+    SearchQueryStat.objects.bulk_create(
+        [
+            SearchQueryStat(query=query, date=date, count=count)
+            for (query, date), count in counts.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0094_clubvisit_created_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchQueryStat",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("query", models.CharField(max_length=255)),
+                ("date", models.DateField()),
+                ("count", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="searchquery",
+            name="created_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="searchquerystat",
+            index=models.Index(
+                fields=["date", "query"], name="clubs_searc_date_176851_idx"
+            ),
+        ),
+        migrations.RunPython(
+            compute_search_query_stats, lambda apps, schema_editor: None
+        ),
+    ]
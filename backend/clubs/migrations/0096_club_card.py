@@ -0,0 +1,65 @@
+# Generated by Django 3.2.17 on 2026-10-16 23:29
+
+import re
+
+from django.db import migrations, models
+
+
+def get_short_description(description):
+    """
+    Frozen copy of clubs.utils.get_short_description at the time of this migration.
+    """
+    desc = description.lstrip()[:1000]
+    cleaned_desc = re.sub(r"<[^>]+>", "", desc)
+    return (
+        "".join(re.split(r"(\.|\n|!)", cleaned_desc)[:2])
+        .replace("&amp;", "&")
+        .replace("&lt;", "<")
+        .replace("&gt;", ">")
+        .replace("&ndash;", "-")
+        .replace("&mdash;", "-")
+        .replace("&nbsp;", " ")
+        .strip()
+    )
+
+
+def compute_club_cards(apps, schema_editor):
+    Club = apps.get_model("clubs", "Club")
+
+    # must match clubs.models.Club.get_card
+    tags = {}
+    for club_id, tag_id, name in (
+        Club.tags.through.objects.order_by("tag_id")
+        .values_list("club_id", "tag_id", "tag__name")
+        .iterator()
+    ):
+        tags.setdefault(club_id, []).append({"id": tag_id, "name": name})
+
+    clubs = []
+    for club in Club.objects.only(
+        "id", "subtitle", "description", "image", "image_small"
+    ).iterator():
+        image = club.image_small or club.image
+        club.card = {
+            "subtitle": club.subtitle or get_short_description(club.description),
+            "image_url": image.url if image else None,
+            "tags": tags.get(club.id, []),
+        }
+        clubs.append(club)
+    Club.objects.bulk_update(clubs, ["card"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0095_searchquerystat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="club",
+            name="card",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(compute_club_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 3.2.17 on 2026-10-16 23:33
+
+import json
+import re
+
+import django.core.serializers.json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+from django.db.models import F
+
+
+def get_short_description(description):
+    """
+    The preview text of a club description, copied from clubs.utils so that this
+    migration does not change with the helper.
+    """
+    desc = description.lstrip()[:1000]
+    cleaned_desc = re.sub(r"<[^>]+>", "", desc)
+    return (
+        "".join(re.split(r"(\.|\n|!)", cleaned_desc)[:2])
+        .replace("&amp;", "&")
+        .replace("&lt;", "<")
+        .replace("&gt;", ">")
+        .replace("&ndash;", "-")
+        .replace("&mdash;", "-")
+        .replace("&nbsp;", " ")
+        .strip()
+    )
+
+
+def compute_approved_snapshots(apps, schema_editor):
+    Club = apps.get_model("clubs", "Club")
+    HistoricalClub = apps.get_model("clubs", "HistoricalClub")
+
+    # must match clubs.models.Club.get_snapshot
+    fields = [
+        field
+        for field in Club._meta.concrete_fields
+        if field.name not in {"id", "approved_snapshot", "rank", "updated_at", "card"}
+    ]
+
+    storage = Club._meta.get_field("image").storage
+
+    # find the most recently approved version of each club
+    latest = {}
+    for record in (
+        HistoricalClub.objects.filter(approved=True)
+        .order_by("id", F("approved_on").desc(nulls_last=True), "-history_date")
+        .iterator()
+    ):
+        latest.setdefault(record.id, record)
+
+    tags = {}
+    for club_id, tag_id, name in (
+        Club.tags.through.objects.order_by("tag_id")
+        .values_list("club_id", "tag_id", "tag__name")
+        .iterator()
+    ):
+        tags.setdefault(club_id, []).append({"id": tag_id, "name": name})
+
+    clubs = []
+    for club_id in Club.objects.filter(id__in=latest.keys()).values_list(
+        "id", flat=True
+    ):
+        record = latest[club_id]
+        # file fields are stored as plain names in the history
+        data = {field.attname: getattr(record, field.attname) for field in fields}
+        data["image"] = data["image"] or None
+        data["image_small"] = data["image_small"] or None
+        # must match clubs.models.Club.get_card
+        image = record.image_small or record.image
+        data["card"] = {
+            "subtitle": record.subtitle or get_short_description(record.description),
+            "image_url": storage.url(image) if image else None,
+            "tags": tags.get(club_id, []),
+        }
+        snapshot = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+        clubs.append(Club(id=club_id, approved_snapshot=snapshot))
+    Club.objects.bulk_update(clubs, ["approved_snapshot"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0096_club_card"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="club",
+            name="approved_snapshot",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                editable=False,
+                encoder=django.core.serializers.json.DjangoJSONEncoder,
+            ),
+        ),
+        migrations.RunPython(compute_approved_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.17 on 2026-10-17 00:16
+
+import re
+from urllib.parse import urlparse
+
+from django.db import migrations, models
+
+
+def get_zoom_meeting_id(url):
+    """
+    Return the meeting id of a Zoom meeting link, or None. This is the parsing
+    of clubs.utils.get_zoom_meeting_id when the field was added.
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    host = parsed.hostname or ""
+    if parsed.scheme not in {"http", "https"} or not (
+        host == "zoom.us" or host.endswith(".zoom.us")
+    ):
+        return None
+    match = re.match(r"/[^/]*/(\d+)/?$", parsed.path)
+    return match[1] if match is not None else None
+
+
+def extract_zoom_meeting_ids(apps, schema_editor):
+    Event = apps.get_model("clubs", "Event")
+
+    events = []
+    for event in (
+        Event.objects.filter(url__icontains="zoom.us").only("id", "url").iterator()
+    ):
+        event.zoom_meeting_id = get_zoom_meeting_id(event.url)
+        if event.zoom_meeting_id is not None:
+            events.append(event)
+    Event.objects.bulk_update(events, ["zoom_meeting_id"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0097_club_approved_snapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="event",
+            name="zoom_meeting_id",
+            field=models.CharField(
+                blank=True, db_index=True, editable=False, max_length=255, null=True
+            ),
+        ),
+        migrations.RunPython(extract_zoom_meeting_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,170 @@
+# Generated by Django 3.2.17 on 2026-10-17 00:28
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+KEY_FIELDS = [
+    "club_id",
+    "metric",
+    "visit_type",
+    "school_id",
+    "graduation_year",
+    "granularity",
+    "bucket",
+]
+
+
+def merge_duplicate_rollups(apps, schema_editor):
+    AnalyticsRollup = apps.get_model("clubs", "AnalyticsRollup")
+
+    # every row with the same key was incremented by later changes, so keep the
+    # row with the largest counts, running rollup_analytics restores exact counts
+    duplicates = (
+        AnalyticsRollup.objects.values(*KEY_FIELDS)
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for group in list(duplicates):
+        rows = AnalyticsRollup.objects.filter(
+            **{field: group[field] for field in KEY_FIELDS}
+        )
+        keep = rows.order_by("-total", "-school_total", "id").first()
+        rows.exclude(id=keep.id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0098_event_zoom_meeting_id"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="analyticsrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("graduation_year__isnull", False),
+                    ("school__isnull", False),
+                    ("visit_type__isnull", False),
+                ),
+                fields=(
+                    "club",
+                    "metric",
+                    "granularity",
+                    "bucket",
+                    "visit_type",
+                    "school",
+                    "graduation_year",
+                ),
+                name="unique_analytics_rollup_vvv",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="analyticsrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("graduation_year__isnull", True),
+                    ("school__isnull", False),
+                    ("visit_type__isnull", False),
+                ),
+                fields=(
+                    "club",
+                    "metric",
+                    "granularity",
+                    "bucket",
+                    "visit_type",
+                    "school",
+                ),
+                name="unique_analytics_rollup_vvn",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="analyticsrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("graduation_year__isnull", False),
+                    ("school__isnull", True),
+                    ("visit_type__isnull", False),
+                ),
+                fields=(
+                    "club",
+                    "metric",
+                    "granularity",
+                    "bucket",
+                    "visit_type",
+                    "graduation_year",
+                ),
+                name="unique_analytics_rollup_vnv",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="analyticsrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("graduation_year__isnull", True),
+                    ("school__isnull", True),
+                    ("visit_type__isnull", False),
+                ),
+                fields=("club", "metric", "granularity", "bucket", "visit_type"),
+                name="unique_analytics_rollup_vnn",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="analyticsrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("graduation_year__isnull", False),
+                    ("school__isnull", False),
+                    ("visit_type__isnull", True),
+                ),
+                fields=(
+                    "club",
+                    "metric",
+                    "granularity",
+                    "bucket",
+                    "school",
+                    "graduation_year",
+                ),
+                name="unique_analytics_rollup_nvv",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="analyticsrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("graduation_year__isnull", True),
+                    ("school__isnull", False),
+                    ("visit_type__isnull", True),
+                ),
+                fields=("club", "metric", "granularity", "bucket", "school"),
+                name="unique_analytics_rollup_nvn",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="analyticsrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("graduation_year__isnull", False),
+                    ("school__isnull", True),
+                    ("visit_type__isnull", True),
+                ),
+                fields=("club", "metric", "granularity", "bucket", "graduation_year"),
+                name="unique_analytics_rollup_nnv",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="analyticsrollup",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("graduation_year__isnull", True),
+                    ("school__isnull", True),
+                    ("visit_type__isnull", True),
+                ),
+                fields=("club", "metric", "granularity", "bucket"),
+                name="unique_analytics_rollup_nnn",
+            ),
+        ),
+    ]
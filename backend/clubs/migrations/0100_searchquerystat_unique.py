@@ -0,0 +1,41 @@
+# Generated by Django 3.2.17 on 2026-10-17 00:31
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_stats(apps, schema_editor):
+    SearchQueryStat = apps.get_model("clubs", "SearchQueryStat")
+
+    # every row with the same query and date was incremented by later searches,
+    # so keep the row with the largest count
+    duplicates = (
+        SearchQueryStat.objects.values("query", "date")
+        .annotate(rows=Count("id"))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    for group in list(duplicates):
+        rows = SearchQueryStat.objects.filter(query=group["query"], date=group["date"])
+        keep = rows.order_by("-count", "id").first()
+        rows.exclude(id=keep.id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clubs", "0099_analyticsrollup_unique"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_stats, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="searchquerystat", name="clubs_searc_date_176851_idx",
+        ),
+        migrations.AddConstraint(
+            model_name="searchquerystat",
+            constraint=models.UniqueConstraint(
+                fields=("date", "query"), name="unique_search_query_stat"
+            ),
+        ),
+    ]
@@ -1,3 +1,4 @@
+import io
 from collections import OrderedDict
 
 import dateutil.parser
@@ -9,8 +10,12 @@ from django.core.exceptions import (
 from django.db.models import BooleanField, DateTimeField, ManyToManyField
 from django.db.models.fields.reverse_related import ManyToOneRel
 from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
 from rest_framework import serializers
-from rest_framework.renderers import JSONRenderer
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.response import Response
 from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
 
@@ -128,28 +133,25 @@ class XLSXFormatterMixin(object):
 
     Changes the default filename to include the date and time of creation.
     Changes the default column header to be bolded.
-    """
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    The formatter for each column is looked up once, and the rows are written one at
+    a time to a write-only workbook. Unpaginated lists are serialized in chunks of
+    xlsx_chunk_size objects, so large reports are exported in bounded memory.
+    """
 
-        self._column_cache = {}
+    # number of objects serialized at a time when exporting a list
+    xlsx_chunk_size = 500
 
     def get_xlsx_column_name(self, key):
         """
         Format the text displayed in the column header.
-        Cache the column name if obtained from the serializer,
-        as this method is called once for every cell.
         """
-        if key in self._column_cache:
-            return self._column_cache[key]
         serializer_class = self.get_serializer_class()
         val = None
         if hasattr(serializer_class, "get_xlsx_column_name"):
             val = serializer_class.get_xlsx_column_name(key)
         if val is None:
             val = key.replace("_", " ").title()
-        self._column_cache[key] = val
         return val
 
     def _many_to_many_individual_formatter(self, value):
@@ -160,7 +162,9 @@ class XLSXFormatterMixin(object):
         """
         if isinstance(value, dict):
             if len(value) == 1:
-                return self._many_to_many_individual_formatter(next(value.values()))
+                return self._many_to_many_individual_formatter(
+                    next(iter(value.values()))
+                )
             elif len(value) > 1:
                 return self._many_to_many_individual_formatter(
                     next(v for k, v in value.items() if not k == "id")
@@ -256,17 +260,65 @@ class XLSXFormatterMixin(object):
         else:
             return lambda x: x
 
-    def _format_cell(self, key, value):
+    def get_xlsx_columns(self, keys):
+        """
+        Return the header and formatter of each column given the keys of a row.
+        """
+        return [
+            (key, self.get_xlsx_column_name(key), self._lookup_field_formatter(key))
+            for key in keys
+        ]
+
+    def render_xlsx(self, data):
+        """
+        Write the serialized rows to a spreadsheet and return the contents of the
+        file. The columns are determined by the keys of the first row.
+        """
+        if isinstance(data, dict) and not isinstance(data, ReturnDict):
+            data = data["results"]
+        rows = [data] if isinstance(data, dict) else data
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Report")
+        header_style = self.get_column_header().get("style", {})
+        columns = None
+
+        for row in rows:
+            if columns is None:
+                columns = self.get_xlsx_columns(row.keys())
+                for index in range(len(columns)):
+                    sheet.column_dimensions[get_column_letter(index + 1)].width = 20
+                header = []
+                for _, name, _ in columns:
+                    cell = WriteOnlyCell(sheet, value=name)
+                    cell.font = Font(**header_style.get("font", {}))
+                    header.append(cell)
+                sheet.append(header)
+            sheet.append(
+                [
+                    _to_xlsx_value(formatter(row.get(key)))
+                    for key, _, formatter in columns
+                ]
+            )
+
+        output = io.BytesIO()
+        workbook.save(output)
+        return output.getvalue()
+
+    def list(self, request, *args, **kwargs):
         """
-        Format a cell in the exported Excel spreadsheet given (column name, cell value).
-        Returns (new column name, new cell value). Looks up formatting information using
-        the modal obtained from the serializer.
+        If the requested format is a spreadsheet and the list is not paginated,
+        serialize the objects in chunks while the spreadsheet is written.
         """
-        new_key = self.get_xlsx_column_name(key)
-        # cache column formatter by column name
-        if key not in self._field_dict:
-            self._field_dict[key] = self._lookup_field_formatter(key)
-        return (new_key, self._field_dict[key](value))
+        if request.accepted_renderer.format != "xlsx":
+            return super(XLSXFormatterMixin, self).list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response(XLSXRows(self, queryset))
 
     def get_filename(self):
         """
@@ -295,23 +347,12 @@ class XLSXFormatterMixin(object):
             isinstance(response, Response)
             and response.accepted_renderer.format == "xlsx"
         ):
-            self._field_dict = {}
-            if isinstance(response.data, ReturnList):
-                new_data = [
-                    OrderedDict([self._format_cell(k, v) for k, v in row.items()])
-                    for row in response.data
-                ]
-                response.data = ReturnList(
-                    new_data, serializer=response.data.serializer
-                )
-            elif isinstance(response.data, ReturnDict):
-                new_data = OrderedDict(
-                    [self._format_cell(k, v) for k, v in response.data.items()]
-                )
-                response.data = ReturnDict(
-                    new_data, serializer=response.data.serializer
-                )
-            elif isinstance(response.data, dict):
+            data = response.data
+            if (
+                isinstance(data, dict)
+                and not isinstance(data, ReturnDict)
+                and not isinstance(data.get("results"), ReturnList)
+            ):
                 # If this is not a proper spreadsheet response
                 # (ex: object does not exist),
                 # then return the response in JSON format.
@@ -321,8 +362,70 @@ class XLSXFormatterMixin(object):
                 response.renderer_context = {}
                 return response
 
+            response.accepted_renderer = XLSXRowRenderer()
             response["Content-Disposition"] = "attachment; filename={}".format(
                 self.get_filename()
             )
 
         return response
+
+
+def _to_xlsx_value(value):
+    """
+    Convert a formatted value into a value that can be written to a cell.
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return ", ".join(str(item) for item in value)
+    return str(value)
+
+
+class XLSXRows(object):
+    """
+    A lazily serialized list of objects for a spreadsheet export. Iterating over the
+    rows loads and serializes the objects in chunks, using the order of the queryset.
+    """
+
+    def __init__(self, view, queryset):
+        self.view = view
+        self.queryset = queryset
+        self._pks = None
+
+    @property
+    def pks(self):
+        if self._pks is None:
+            self._pks = list(
+                OrderedDict.fromkeys(self.queryset.values_list("pk", flat=True))
+            )
+        return self._pks
+
+    def get_chunk(self, pks):
+        objects = {obj.pk: obj for obj in self.queryset.filter(pk__in=pks)}
+        objects = [objects[pk] for pk in pks if pk in objects]
+        return self.view.get_serializer(objects, many=True).data
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __getitem__(self, index):
+        return self.get_chunk([self.pks[index]])[0]
+
+    def __iter__(self):
+        size = self.view.xlsx_chunk_size
+        for start in range(0, len(self.pks), size):
+            yield from self.get_chunk(self.pks[start : start + size])
+
+
+class XLSXRowRenderer(BaseRenderer):
+    """
+    Renderer for spreadsheets that are written by a view using XLSXFormatterMixin.
+    """
+
+    media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    format = "xlsx"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return renderer_context["view"].render_xlsx(data)
@@ -1,9 +1,10 @@
 import datetime
+import itertools
+import json
 import os
 import re
 import uuid
 import warnings
-from urllib.parse import urlparse
 
 import pytz
 import requests
@@ -12,22 +13,31 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.mail import EmailMultiAlternatives
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import validate_email
 from django.db import models, transaction
-from django.db.models import Sum
+from django.db.models import Q, Sum
+from django.db.models.fields.files import FieldFile
 from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.utils.functional import cached_property
-from ics import Calendar
 from jinja2 import Environment, meta
 from model_clone.models import CloneModel
 from phonenumber_field.modelfields import PhoneNumberField
 from simple_history.models import HistoricalRecords
-from urlextract import URLExtract
 
-from clubs.utils import clean, get_django_minified_image, get_domain, html_to_text
+from clubs.caching import invalidate_cache_tags
+from clubs.ranking import queue_rank_update
+from clubs.search import remove_from_search_index, update_search_index
+from clubs.utils import (
+    get_django_minified_image,
+    get_domain,
+    get_short_description,
+    get_zoom_meeting_id,
+    html_to_text,
+)
 
 
 subject_regex = re.compile(r"\s*<!--\s*SUBJECT:\s*(.*?)\s*-->", re.I)
@@ -325,137 +335,111 @@ class Club(models.Model):
     # cache club rankings
     rank = models.IntegerField(default=0)
 
+    # precomputed fields for the club list, see get_card
+    card = models.JSONField(default=dict, blank=True, editable=False)
+
+    # the club as it was when it was last approved, see get_approved_version
+    approved_snapshot = models.JSONField(
+        default=dict, blank=True, editable=False, encoder=DjangoJSONEncoder
+    )
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     ghost = models.BooleanField(default=False)
-    history = HistoricalRecords(cascade_delete_history=True)
+    history = HistoricalRecords(
+        cascade_delete_history=True, excluded_fields=["card", "approved_snapshot"]
+    )
+
+    # fields that are not stored in the approved snapshot
+    SNAPSHOT_EXCLUDED_FIELDS = {"id", "approved_snapshot", "rank", "updated_at"}
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # computed after saving so that uploaded images have their final urls
+        self.update_card()
+
+    def get_card(self, tags=None):
+        """
+        Return the representation of the club that is shown in the club list,
+        containing the preview text, the logo url and the tags of the club.
+        The tags are reused from the current card unless they are passed in.
+        """
+        if tags is None:
+            tags = self.card.get("tags")
+        if tags is None:
+            tags = list(self.tags.order_by("id").values("id", "name"))
+        image = self.image_small or self.image
+        return {
+            "subtitle": self.subtitle or get_short_description(self.description),
+            "image_url": image.url if image else None,
+            "tags": tags,
+        }
+
+    def get_snapshot(self):
+        """
+        Return the fields of the club in a form that can be stored as JSON.
+        """
+        data = {}
+        for field in self._meta.concrete_fields:
+            if field.name not in self.SNAPSHOT_EXCLUDED_FIELDS:
+                value = field.value_from_object(self)
+                if isinstance(value, FieldFile):
+                    value = value.name or None
+                data[field.attname] = value
+        return json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+
+    def get_approved_version(self):
+        """
+        Return an unsaved copy of the club as it was when it was last approved,
+        or None if the club has never been approved.
+        """
+        if not self.approved_snapshot:
+            return None
+        values = {"id": self.pk}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.approved_snapshot:
+                values[field.attname] = field.to_python(
+                    self.approved_snapshot[field.attname]
+                )
+        return Club(**values)
+
+    def update_card(self, tags=None):
+        """
+        Recompute and save the club list representation of the club.
+        If the club is approved, the approved snapshot is also updated.
+        """
+        fields = {}
+        card = self.get_card(tags)
+        if card != self.card:
+            self.card = fields["card"] = card
+        if self.approved:
+            snapshot = self.get_snapshot()
+            if snapshot != self.approved_snapshot:
+                self.approved_snapshot = fields["approved_snapshot"] = snapshot
+        if fields:
+            Club.objects.filter(pk=self.pk).update(**fields)
+            invalidate_cache_tags("clubs", f"club:{self.id}")
+
     def create_thumbnail(self, request=None):
         return create_thumbnail_helper(self, request, 200)
 
     @cached_property
     def is_wharton(self):
-        wc_badge = Badge.objects.filter(label="Wharton Council").first()
-        return wc_badge in self.badges.all()
+        return any(badge.label == "Wharton Council" for badge in self.badges.all())
 
     def add_ics_events(self):
         """
         Fetch the ICS events from the club's calendar URL
-        and return the number of modified events.
+        and return the number of imported events.
         """
-        # random but consistent uuid used to generate uuid5s from invalid uuids
-        ics_import_uuid_namespace = uuid.UUID("8f37c140-3775-42e8-91d4-fda7a2e44152")
-
-        extractor = URLExtract()
-
-        url = self.ics_import_url
-        if url:
-            calendar = Calendar(requests.get(url).text)
-            event_list = Event.objects.filter(is_ics_event=True, club=self)
-            modified_events = []
-            for event in calendar.events:
-                tries = [
-                    Event.objects.filter(
-                        club=self,
-                        start_time=event.begin.datetime,
-                        end_time=event.end.datetime,
-                    ).first(),
-                    Event(),
-                ]
-
-                # try matching using uuid if it is valid
-                if event.uid:
-                    try:
-                        event_uuid = uuid.UUID(event.uid[:36])
-                    except ValueError:
-                        # generate uuid from malformed/invalid uuids
-                        event_uuid = uuid.uuid5(ics_import_uuid_namespace, event.uid)
-
-                    tries.insert(0, Event.objects.filter(ics_uuid=event_uuid).first())
-                else:
-                    event_uuid = None
-
-                for ev in tries:
-                    if ev:
-                        ev.club = self
-                        ev.name = event.name.strip()
-                        ev.start_time = event.begin.datetime
-                        ev.end_time = event.end.datetime
-                        ev.description = clean(event.description.strip())
-                        ev.location = event.location
-                        ev.is_ics_event = True
-
-                        # very simple type detection, only perform on first time
-                        if ev.pk is None:
-                            ev.type = Event.OTHER
-                            for val, lbl in Event.TYPES:
-                                if val in {Event.FAIR}:
-                                    continue
-                                if (
-                                    lbl.lower() in ev.name.lower()
-                                    or lbl.lower() in ev.description.lower()
-                                ):
-                                    ev.type = val
-                                    break
-
-                        # extract urls from description
-                        if ev.description:
-                            urls = extractor.find_urls(ev.description)
-                            urls.sort(
-                                key=lambda url: any(
-                                    domain in url
-                                    for domain in {
-                                        "zoom.us",
-                                        "bluejeans.com",
-                                        "hangouts.google.com",
-                                    }
-                                ),
-                                reverse=True,
-                            )
-                            if urls:
-                                ev.url = urls[0]
-
-                        # extract url from url or location
-                        if event.url:
-                            ev.url = event.url
-                        elif ev.location:
-                            location_urls = extractor.find_urls(ev.location)
-                            if location_urls:
-                                ev.url = location_urls[0]
-
-                        # format url properly with schema
-                        if ev.url:
-                            parsed = urlparse(ev.url)
-                            if not parsed.netloc:
-                                parsed = parsed._replace(netloc=parsed.path, path="")
-                            if not parsed.scheme:
-                                parsed = parsed._replace(scheme="https")
-                            ev.url = parsed.geturl()
-
-                        # add uuid if it exists, otherwise will be autogenerated
-                        if event_uuid:
-                            ev.ics_uuid = event_uuid
-
-                        # ensure length limits are met before saving
-                        if ev.location:
-                            ev.location = ev.location[:255]
-                        if ev.name:
-                            ev.name = ev.name[:255]
-                        if ev.code:
-                            ev.code = ev.code[:255]
-                        if ev.url:
-                            ev.url = ev.url[:2048]
-
-                        ev.save()
-                        modified_events.append(ev)
-                        break
-
-            event_list.exclude(pk__in=[e.pk for e in modified_events]).delete()
-            return len(modified_events)
+        from clubs.calendars import import_club_calendar
+
+        if self.ics_import_url:
+            return import_club_calendar(self)
         return 0
 
     def send_virtual_fair_email(
@@ -788,6 +772,33 @@ class Testimonial(models.Model):
         return self.text
 
 
+class ClubRank(models.Model):
+    """
+    Stores the points awarded to a club for each component of its ranking,
+    so that individual components can be recomputed when they change.
+    """
+
+    club = models.OneToOneField(
+        Club, on_delete=models.CASCADE, related_name="rank_breakdown"
+    )
+
+    status = models.FloatField(default=0)
+    favorites = models.FloatField(default=0)
+    tags = models.FloatField(default=0)
+    members = models.FloatField(default=0)
+    profile = models.FloatField(default=0)
+    fair = models.FloatField(default=0)
+    applications = models.FloatField(default=0)
+    events = models.FloatField(default=0)
+    testimonials = models.FloatField(default=0)
+    random = models.FloatField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.club.name} rank breakdown"
+
+
 class ClubFair(models.Model):
     """
     Represents an activities fair with multiple clubs as participants.
@@ -908,6 +919,10 @@ class Event(models.Model):
     end_time = models.DateTimeField()
     location = models.CharField(max_length=255, null=True, blank=True)
     url = models.URLField(max_length=2048, null=True, blank=True)
+    # extracted from the url, used to find the event of a Zoom webhook
+    zoom_meeting_id = models.CharField(
+        max_length=255, null=True, blank=True, editable=False, db_index=True
+    )
     image = models.ImageField(upload_to=get_event_file_name, null=True, blank=True)
     image_small = models.ImageField(
         upload_to=get_event_small_file_name, null=True, blank=True
@@ -945,6 +960,13 @@ class Event(models.Model):
     def create_thumbnail(self, request=None):
         return create_thumbnail_helper(self, request, 400)
 
+    def save(self, *args, **kwargs):
+        self.zoom_meeting_id = get_zoom_meeting_id(self.url)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "url" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "zoom_meeting_id"}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -1013,13 +1035,91 @@ class ClubVisit(models.Model):
     )
     visit_type = models.IntegerField(choices=VISIT_TYPES, default=CLUB_PAGE)
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    # not auto_now_add, since buffered visits are written after they happen
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return "<Visit: {} visited {}>".format(self.person.username, self.club.code)
 
 
+def get_rollup_constraints():
+    """
+    Return the constraints that ensure that there is a single rollup for every
+    key. Unique constraints do not consider null values to be equal, so there is
+    a partial constraint for every combination of null dimensions, and every
+    rollup is covered by exactly one of them.
+    """
+    nullable = ["visit_type", "school", "graduation_year"]
+    constraints = []
+    for nulls in itertools.product([False, True], repeat=len(nullable)):
+        fields = ["club", "metric", "granularity", "bucket"] + [
+            field for field, null in zip(nullable, nulls) if not null
+        ]
+        suffix = "".join("n" if null else "v" for null in nulls)
+        constraints.append(
+            models.UniqueConstraint(
+                fields=fields,
+                condition=Q(
+                    **{f"{field}__isnull": null for field, null in zip(nullable, nulls)}
+                ),
+                name=f"unique_analytics_rollup_{suffix}",
+            )
+        )
+    return constraints
+
+
+class AnalyticsRollup(models.Model):
+    """
+    Stores the number of visits, favorites and subscriptions for a club in an hour
+    or a day, broken down by the school and graduation year of the students.
+
+    The total counts each object once. The school total counts each object once
+    for every school that the student belongs to, and should only be used when
+    grouping by school.
+    """
+
+    METRIC_VISIT = "visit"
+    METRIC_FAVORITE = "favorite"
+    METRIC_SUBSCRIBE = "subscribe"
+    METRIC_TYPES = (
+        (METRIC_VISIT, "Visit"),
+        (METRIC_FAVORITE, "Favorite"),
+        (METRIC_SUBSCRIBE, "Subscribe"),
+    )
+
+    GRANULARITY_HOUR = "hour"
+    GRANULARITY_DAY = "day"
+    GRANULARITY_TYPES = ((GRANULARITY_HOUR, "Hour"), (GRANULARITY_DAY, "Day"))
+
+    club = models.ForeignKey(Club, on_delete=models.CASCADE)
+    metric = models.CharField(max_length=16, choices=METRIC_TYPES)
+    visit_type = models.IntegerField(
+        choices=ClubVisit.VISIT_TYPES, null=True, blank=True
+    )
+    school = models.ForeignKey(
+        "School", on_delete=models.SET_NULL, null=True, blank=True
+    )
+    graduation_year = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    granularity = models.CharField(max_length=8, choices=GRANULARITY_TYPES)
+    bucket = models.DateTimeField()
+
+    total = models.IntegerField(default=0)
+    school_total = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "<AnalyticsRollup: {} {} for {} at {}>".format(
+            self.total, self.metric, self.club.code, self.bucket
+        )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["club", "metric", "granularity", "bucket"]),
+        ]
+        constraints = get_rollup_constraints()
+
+
 class ZoomMeetingVisit(models.Model):
     """
     Stores information on a user's attendance to a Zoom meeting
@@ -1047,12 +1147,36 @@ class ZoomMeetingVisit(models.Model):
 class SearchQuery(models.Model):
     person = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, null=True)
     query = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # not auto_now_add, since search queries are logged in batches
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     def __str__(self):
         return "<SearchQuery: {} at {}>".format(self.query, self.created_at)
 
 
+class SearchQueryStat(models.Model):
+    """
+    Stores the number of times that a normalized search query was made on a day,
+    so that popular queries can be found without scanning all search queries.
+    """
+
+    query = models.CharField(max_length=255)
+    date = models.DateField()
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "<SearchQueryStat: {} x{} on {}>".format(
+            self.query, self.count, self.date
+        )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "query"], name="unique_search_query_stat"
+            )
+        ]
+
+
 class MembershipRequest(models.Model):
     """
     Used when users are not in the club but request membership from the owner
@@ -1763,3 +1887,237 @@ def user_create(sender, instance, created, **kwargs):
 def profile_delete_cleanup(sender, instance, **kwargs):
     if instance.image:
         instance.image.delete(save=False)
+
+
+@receiver(models.signals.post_save, sender=Club)
+@receiver(models.signals.post_delete, sender=Club)
+def club_invalidate_cache(sender, instance, **kwargs):
+    invalidate_cache_tags("clubs", f"club:{instance.id}", "events:fair")
+
+
+@receiver(models.signals.post_save, sender=Event)
+@receiver(models.signals.post_delete, sender=Event)
+def event_invalidate_cache(sender, instance, **kwargs):
+    invalidate_cache_tags("events", f"club:{instance.club_id}", "events:fair")
+
+
+@receiver(models.signals.post_save, sender=Membership)
+@receiver(models.signals.post_delete, sender=Membership)
+@receiver(models.signals.post_save, sender=Favorite)
+@receiver(models.signals.post_delete, sender=Favorite)
+def club_relation_invalidate_cache(sender, instance, **kwargs):
+    invalidate_cache_tags(f"club:{instance.club_id}")
+
+
+@receiver(models.signals.post_save, sender=Membership)
+@receiver(models.signals.post_delete, sender=Membership)
+def membership_invalidate_permissions(sender, instance, **kwargs):
+    invalidate_cache_tags(f"permissions:{instance.person_id}")
+
+
+@receiver(models.signals.post_save, sender=ClubFairRegistration)
+@receiver(models.signals.post_delete, sender=ClubFairRegistration)
+def fair_registration_invalidate_cache(sender, instance, **kwargs):
+    invalidate_cache_tags(f"club:{instance.club_id}", "events:fair")
+
+
+@receiver(models.signals.post_save, sender=ClubFair)
+@receiver(models.signals.post_delete, sender=ClubFair)
+def fair_invalidate_cache(sender, instance, **kwargs):
+    invalidate_cache_tags("events:fair")
+
+
+@receiver(models.signals.post_save, sender=Badge)
+@receiver(models.signals.post_delete, sender=Badge)
+def badge_invalidate_cache(sender, instance, **kwargs):
+    invalidate_cache_tags("badges", "events:fair")
+
+
+@receiver(models.signals.post_save, sender=Tag)
+@receiver(models.signals.post_delete, sender=Tag)
+def tag_invalidate_cache(sender, instance, **kwargs):
+    invalidate_cache_tags("tags")
+
+
+@receiver(models.signals.m2m_changed, sender=Club.parent_orgs.through)
+def club_hierarchy_invalidate_cache(sender, action, **kwargs):
+    if action in {"post_add", "post_remove", "post_clear"}:
+        invalidate_cache_tags("hierarchy")
+
+
+@receiver(models.signals.post_delete, sender=Club)
+def club_delete_invalidate_hierarchy(sender, instance, **kwargs):
+    # relationships are removed without sending m2m_changed
+    invalidate_cache_tags("hierarchy")
+
+
+def update_club_cards(club_ids):
+    """
+    Refresh the tags in the club list representation of many clubs at once.
+    """
+    tags = {}
+    for club_id, tag_id, name in (
+        Club.tags.through.objects.filter(club_id__in=club_ids)
+        .order_by("tag_id")
+        .values_list("club_id", "tag_id", "tag__name")
+    ):
+        tags.setdefault(club_id, []).append({"id": tag_id, "name": name})
+
+    for club in Club.objects.filter(id__in=club_ids):
+        club.update_card(tags.get(club.id, []))
+
+
+@receiver(models.signals.m2m_changed, sender=Club.tags.through)
+def club_tags_update_card(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and reverse:
+        # the related clubs cannot be looked up after they are cleared
+        instance._card_club_ids = list(instance.club_set.values_list("id", flat=True))
+    if action not in {"post_add", "post_remove", "post_clear"}:
+        return
+
+    if not reverse:
+        instance.update_card(list(instance.tags.order_by("id").values("id", "name")))
+    elif pk_set is not None:
+        update_club_cards(pk_set)
+    else:
+        update_club_cards(getattr(instance, "_card_club_ids", []))
+
+
+@receiver(models.signals.pre_delete, sender=Tag)
+def tag_delete_store_clubs(sender, instance, **kwargs):
+    instance._card_club_ids = list(instance.club_set.values_list("id", flat=True))
+
+
+@receiver(models.signals.post_save, sender=Tag)
+@receiver(models.signals.post_delete, sender=Tag)
+def tag_update_club_cards(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    club_ids = getattr(instance, "_card_club_ids", None)
+    if club_ids is None:
+        club_ids = list(instance.club_set.values_list("id", flat=True))
+    update_club_cards(club_ids)
+
+
+@receiver(models.signals.m2m_changed, sender=Club.tags.through)
+@receiver(models.signals.m2m_changed, sender=Club.badges.through)
+def club_m2m_invalidate_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in {"post_add", "post_remove", "post_clear"}:
+        return
+
+    tags = ["clubs", "events:fair"]
+    if not reverse:
+        tags.append(f"club:{instance.id}")
+    elif pk_set:
+        tags.extend(f"club:{pk}" for pk in pk_set)
+    else:
+        tags.extend(["tags", "badges"])
+    invalidate_cache_tags(*tags)
+
+
+@receiver(models.signals.post_save, sender=ApplicationSubmission)
+@receiver(models.signals.post_delete, sender=ApplicationSubmission)
+def submission_invalidate_cache(sender, instance, **kwargs):
+    invalidate_cache_tags(f"application:{instance.application_id}")
+
+
+@receiver(models.signals.post_save, sender=Club)
+@receiver(models.signals.post_save, sender=Event)
+def search_index_update(sender, instance, **kwargs):
+    update_search_index(instance)
+
+
+@receiver(models.signals.post_delete, sender=Club)
+@receiver(models.signals.post_delete, sender=Event)
+def search_index_remove(sender, instance, **kwargs):
+    remove_from_search_index(instance)
+
+
+@receiver(models.signals.post_save, sender=Club)
+def club_update_rank(sender, instance, update_fields, **kwargs):
+    if update_fields is None or set(update_fields) - {"rank"}:
+        queue_rank_update(instance.id, "status", "profile")
+
+
+@receiver(models.signals.m2m_changed, sender=Club.tags.through)
+def club_tags_update_rank(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in {"post_add", "post_remove", "post_clear"} and not reverse:
+        queue_rank_update(instance.id, "tags")
+
+
+@receiver(models.signals.post_save, sender=Favorite)
+@receiver(models.signals.post_delete, sender=Favorite)
+def favorite_update_rank(sender, instance, **kwargs):
+    queue_rank_update(instance.club_id, "favorites")
+
+
+@receiver(models.signals.post_save, sender=Membership)
+@receiver(models.signals.post_delete, sender=Membership)
+def membership_update_rank(sender, instance, **kwargs):
+    queue_rank_update(instance.club_id, "members")
+
+
+@receiver(models.signals.post_save, sender=Event)
+@receiver(models.signals.post_delete, sender=Event)
+def event_update_rank(sender, instance, **kwargs):
+    queue_rank_update(instance.club_id, "events")
+
+
+@receiver(models.signals.post_save, sender=Testimonial)
+@receiver(models.signals.post_delete, sender=Testimonial)
+def testimonial_update_rank(sender, instance, **kwargs):
+    queue_rank_update(instance.club_id, "testimonials")
+
+
+@receiver(models.signals.post_save, sender=ClubFairRegistration)
+@receiver(models.signals.post_delete, sender=ClubFairRegistration)
+def fair_registration_update_rank(sender, instance, **kwargs):
+    queue_rank_update(instance.club_id, "fair")
+
+
+@receiver(models.signals.post_save, sender=ClubApplication)
+@receiver(models.signals.post_delete, sender=ClubApplication)
+def application_update_rank(sender, instance, **kwargs):
+    queue_rank_update(instance.club_id, "applications")
+
+
+def record_analytics(metric, instance, sign):
+    """
+    Update the analytics rollups after a visit, favorite or subscription changes.
+    """
+    from clubs.management.commands.rollup_analytics import record_analytics
+
+    record_analytics(metric, [instance], sign)
+
+
+@receiver(models.signals.post_save, sender=ClubVisit)
+def club_visit_record_analytics(sender, instance, created, **kwargs):
+    if created:
+        record_analytics(AnalyticsRollup.METRIC_VISIT, instance, 1)
+
+
+@receiver(models.signals.post_save, sender=Favorite)
+def favorite_record_analytics(sender, instance, created, **kwargs):
+    if created:
+        record_analytics(AnalyticsRollup.METRIC_FAVORITE, instance, 1)
+
+
+@receiver(models.signals.post_save, sender=Subscribe)
+def subscribe_record_analytics(sender, instance, created, **kwargs):
+    if created:
+        record_analytics(AnalyticsRollup.METRIC_SUBSCRIBE, instance, 1)
+
+
+@receiver(models.signals.post_delete, sender=ClubVisit)
+def club_visit_remove_analytics(sender, instance, **kwargs):
+    record_analytics(AnalyticsRollup.METRIC_VISIT, instance, -1)
+
+
+@receiver(models.signals.post_delete, sender=Favorite)
+def favorite_remove_analytics(sender, instance, **kwargs):
+    record_analytics(AnalyticsRollup.METRIC_FAVORITE, instance, -1)
+
+
+@receiver(models.signals.post_delete, sender=Subscribe)
+def subscribe_remove_analytics(sender, instance, **kwargs):
+    record_analytics(AnalyticsRollup.METRIC_SUBSCRIBE, instance, -1)
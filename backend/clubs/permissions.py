@@ -1,30 +1,154 @@
-from django.contrib.auth import get_user_model
 from rest_framework import permissions
 
+from clubs.caching import cache_get_tagged, cache_set_tagged
+from clubs.hierarchy import get_club_graph, get_related_club_ids
 from clubs.models import Club, Membership
 
 
-def codes_extract_helper(obj, key):
+def get_user_club_roles(user):
     """
-    Traverses parent tree and returns
-    flattened list of parent club codes
+    Return a mapping of club ids to the role with the most authority that the
+    user has in each club, either directly or through a parent club. Clubs that
+    the user has no authority over are not included.
+
+    The mapping is cached until the memberships of the user or the club
+    hierarchy change.
+    """
+    if not user.is_authenticated:
+        return {}
+
+    key = f"permissions:roles:{user.id}"
+    roles = cache_get_tagged(key)
+    if roles is None:
+        memberships = Membership.objects.filter(person=user).values_list(
+            "club_id", "role"
+        )
+        graph = None
+        roles = {}
+        for club_id, role in memberships:
+            if graph is None:
+                graph = get_club_graph()
+            for related in get_related_club_ids("children_orgs", club_id, graph):
+                if related not in roles or role < roles[related]:
+                    roles[related] = role
+        cache_set_tagged(
+            key, roles, 60 * 60 * 24, [f"permissions:{user.id}", "hierarchy"]
+        )
+    return roles
+
+
+class PermissionResolver(object):
     """
-    arr = []
+    Resolves the memberships of a user across the club hierarchy.
+
+    All of the memberships of the user are loaded once, and the membership with
+    the most authority for each club (including memberships in parent clubs) is
+    memoized, so that checking permissions for many clubs or checking several
+    permissions for the same club does not issue any additional queries.
+
+    Role checks are answered from the cached role mapping of the user, so they
+    usually do not need any queries at all.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._roles = None
+        self._memberships = None
+        self._graph = None
+        self._club_ids = {}
+        self._resolved = {}
+
+    @property
+    def memberships(self):
+        """
+        A mapping of club ids to the memberships of the user.
+        """
+        if self._memberships is None:
+            if self.user.is_authenticated:
+                self._memberships = {
+                    membership.club_id: membership
+                    for membership in Membership.objects.filter(
+                        person=self.user
+                    ).select_related("club")
+                }
+            else:
+                self._memberships = {}
+        return self._memberships
+
+    @property
+    def roles(self):
+        """
+        A mapping of club ids to the role with the most authority that the user
+        has in each club, including roles inherited from parent clubs.
+        """
+        if self._roles is None:
+            self._roles = get_user_club_roles(self.user)
+        return self._roles
+
+    def get_club_id(self, club):
+        """
+        Return the id of a club instance or club code.
+        Raises Club.DoesNotExist if there is no club with the code.
+        """
+        if isinstance(club, Club):
+            return club.id
+        if club not in self._club_ids:
+            for membership in self.memberships.values():
+                if membership.club.code == club:
+                    self._club_ids[club] = membership.club_id
+                    break
+            else:
+                self._club_ids[club] = Club.objects.values_list("id", flat=True).get(
+                    code=club
+                )
+        return self._club_ids[club]
+
+    def get_direct_membership(self, club):
+        """
+        Return the membership of the user in the club itself, ignoring the
+        memberships in parent clubs.
+        """
+        return self.memberships.get(self.get_club_id(club))
+
+    def get_membership(self, club):
+        """
+        Return the membership with the most authority in the club or any of its
+        parent clubs, or None if the user is not in any of them.
+        """
+        club_id = self.get_club_id(club)
+        if club_id not in self._resolved:
+            membership = None
+            if club_id in self.roles and self.memberships:
+                if self._graph is None:
+                    self._graph = get_club_graph()
+                related_ids = get_related_club_ids("parent_orgs", club_id, self._graph)
+                membership = min(
+                    (m for pk, m in self.memberships.items() if pk in related_ids),
+                    key=lambda m: m.role,
+                    default=None,
+                )
+            self._resolved[club_id] = membership
+        return self._resolved[club_id]
+
+    def has_role(self, club, role):
+        """
+        Return whether the user has at least the given role in the club or any of
+        its parent clubs.
+        """
+        club_role = self.roles.get(self.get_club_id(club))
+        return club_role is not None and club_role <= role
 
-    def extract(obj, arr, key):
-        if isinstance(obj, dict):
-            for k, v in obj.items():
-                if isinstance(v, (dict, list)):
-                    extract(v, arr, key)
-                elif k == key:
-                    arr.append(v)
-        elif isinstance(obj, list):
-            for item in obj:
-                extract(item, arr, key)
-        return arr
 
-    values = extract(obj, arr, key)
-    return values
+def get_permission_resolver(request):
+    """
+    Return the permission resolver for the user making the request, which is
+    shared by all permission checks performed while handling the request.
+    """
+    resolver = getattr(request, "_permission_resolver", None)
+    if resolver is None or resolver.user != request.user:
+        resolver = PermissionResolver(request.user)
+        request._permission_resolver = resolver
+    return resolver
 
 
 def find_membership_helper(user, club):
@@ -34,18 +158,7 @@ def find_membership_helper(user, club):
 
     Returns None if there is no membership between the specified club and user.
     """
-    from clubs.views import find_relationship_helper
-
-    related_codes = codes_extract_helper(
-        find_relationship_helper("parent_orgs", club, {club.code}), "code"
-    )
-    membership_instance = (
-        Membership.objects.filter(person=user, club__code__in=related_codes)
-        .order_by("role")
-        .first()
-    )
-
-    return membership_instance
+    return PermissionResolver(user).get_membership(club)
 
 
 class ReadOnly(permissions.BasePermission):
@@ -140,7 +253,7 @@ class ClubPermission(permissions.BasePermission):
             return request.user.is_authenticated and (
                 request.user.has_perm("clubs.see_pending_clubs")
                 or request.user.has_perm("clubs.manage_club")
-                or find_membership_helper(request.user, obj) is not None
+                or get_permission_resolver(request).get_membership(obj) is not None
             )
 
         if not request.user.is_authenticated:
@@ -160,14 +273,30 @@ class ClubPermission(permissions.BasePermission):
             return True
 
         # user must be in club or parent club to perform non-view actions
-        membership = find_membership_helper(request.user, obj)
-        if membership is None:
-            return False
         # user has to be an owner to delete a club, an officer to edit it
-        if view.action in ["destroy"]:
-            return membership.role <= Membership.ROLE_OWNER
-        else:
-            return membership.role <= Membership.ROLE_OFFICER
+        return get_permission_resolver(request).has_role(
+            obj,
+            Membership.ROLE_OWNER
+            if view.action in ["destroy"]
+            else Membership.ROLE_OFFICER,
+        )
+
+    def has_object_permissions(self, request, view, objs):
+        """
+        Evaluate the object permission for many clubs at once, returning a
+        mapping of club codes to whether the user has permission.
+
+        The global permissions and the roles of the user are only looked up once,
+        so the number of queries does not depend on the number of clubs.
+        """
+        resolver = get_permission_resolver(request)
+        if request.user.is_authenticated:
+            # load the user permissions and roles before checking any clubs
+            request.user.get_all_permissions()
+            resolver.roles
+        return {
+            obj.code: self.has_object_permission(request, view, obj) for obj in objs
+        }
 
     def has_permission(self, request, view):
         if view.action in {
@@ -200,8 +329,9 @@ class EventPermission(permissions.BasePermission):
                 return False
             if request.user.has_perm("clubs.manage_club"):
                 return True
-            obj = Club.objects.get(code=view.kwargs["club_code"])
-            membership = find_membership_helper(request.user, obj)
+            membership = get_permission_resolver(request).get_membership(
+                view.kwargs["club_code"]
+            )
             return membership is not None and membership.role <= Membership.ROLE_OFFICER
         else:
             return True
@@ -248,7 +378,7 @@ class ClubBadgePermission(permissions.BasePermission):
             return False
 
         # club officers and above can modify badges they own
-        membership = find_membership_helper(request.user, obj.org)
+        membership = get_permission_resolver(request).get_membership(obj.org)
 
         return membership is not None and membership.role <= Membership.ROLE_OFFICER
 
@@ -284,8 +414,9 @@ class ClubItemPermission(permissions.BasePermission):
                 return False
             if request.user.has_perm("clubs.manage_club"):
                 return True
-            obj = Club.objects.get(code=view.kwargs["club_code"])
-            membership = find_membership_helper(request.user, obj)
+            membership = get_permission_resolver(request).get_membership(
+                view.kwargs["club_code"]
+            )
             return membership is not None and membership.role <= Membership.ROLE_OFFICER
         else:
             return True
@@ -304,8 +435,9 @@ class ClubSensitiveItemPermission(permissions.BasePermission):
             return False
         if request.user.has_perm("clubs.manage_club"):
             return True
-        obj = Club.objects.get(code=view.kwargs["club_code"])
-        membership = find_membership_helper(request.user, obj)
+        membership = get_permission_resolver(request).get_membership(
+            view.kwargs["club_code"]
+        )
         return membership is not None and membership.role <= Membership.ROLE_OFFICER
 
 
@@ -331,14 +463,13 @@ class WhartonApplicationPermission(permissions.BasePermission):
     def check_wharton_council_officer(self, request):
         if not request.user.is_authenticated:
             return False
-        user = get_user_model().objects.filter(username=request.user).first()
-        if user is not None:
-            membership = Membership.objects.filter(
-                club__code=self.WHARTON_COUNCIL_CLUB_CODE, person=user
-            ).first()
-            if membership is not None:
-                return membership.role <= Membership.ROLE_OFFICER
-        return False
+        try:
+            membership = get_permission_resolver(request).get_direct_membership(
+                self.WHARTON_COUNCIL_CLUB_CODE
+            )
+        except Club.DoesNotExist:
+            return False
+        return membership is not None and membership.role <= Membership.ROLE_OFFICER
 
     def has_object_permission(self, request, view, obj):
         return self.check_wharton_council_officer(request)
@@ -373,7 +504,7 @@ class MemberPermission(permissions.BasePermission):
         if request.user.has_perm("clubs.manage_club"):
             return True
 
-        membership = find_membership_helper(request.user, obj.club)
+        membership = get_permission_resolver(request).get_membership(obj.club)
         if membership is None:
             return False
 
@@ -405,8 +536,9 @@ class MemberPermission(permissions.BasePermission):
                 return False
             if request.user.has_perm("clubs.manage_club"):
                 return True
-            obj = Club.objects.get(code=view.kwargs["club_code"])
-            membership = find_membership_helper(request.user, obj)
+            membership = get_permission_resolver(request).get_membership(
+                view.kwargs["club_code"]
+            )
             return membership is not None and membership.role <= Membership.ROLE_OFFICER
         else:
             return True
@@ -427,8 +559,9 @@ class MembershipRequestPermission(permissions.BasePermission):
         if request.user.has_perm("clubs.manage_club"):
             return True
 
-        obj = Club.objects.get(code=view.kwargs["club_code"])
-        membership = find_membership_helper(request.user, obj)
+        membership = get_permission_resolver(request).get_membership(
+            view.kwargs["club_code"]
+        )
         return membership is not None and membership.role <= Membership.ROLE_OFFICER
 
 
@@ -448,8 +581,9 @@ class InvitePermission(permissions.BasePermission):
                 return False
             if request.user.has_perm("clubs.manage_club"):
                 return True
-            obj = Club.objects.get(code=view.kwargs["club_code"])
-            membership = find_membership_helper(request.user, obj)
+            membership = get_permission_resolver(request).get_membership(
+                view.kwargs["club_code"]
+            )
             return membership is not None and membership.role <= Membership.ROLE_OFFICER
 
 
@@ -469,8 +603,9 @@ class AssetPermission(permissions.BasePermission):
                 return False
             if request.user.has_perm("clubs.manage_club"):
                 return True
-            obj = Club.objects.get(code=view.kwargs["club_code"])
-            membership = find_membership_helper(request.user, obj)
+            membership = get_permission_resolver(request).get_membership(
+                view.kwargs["club_code"]
+            )
             return membership is not None and membership.role <= Membership.ROLE_OFFICER
 
 
@@ -495,7 +630,7 @@ class QuestionAnswerPermission(permissions.BasePermission):
                 return True
 
             # otherwise, allow club officers to edit and delete comments
-            membership = find_membership_helper(request.user, obj.club)
+            membership = get_permission_resolver(request).get_membership(obj.club)
 
             return membership is not None and membership.role <= Membership.ROLE_OFFICER
 
@@ -540,8 +675,9 @@ class NotePermission(permissions.BasePermission):
             if creating_club_permission is None:
                 return False
 
-            obj = Club.objects.get(code=view.kwargs["club_code"])
-            membership = find_membership_helper(request.user, obj)
+            membership = get_permission_resolver(request).get_membership(
+                view.kwargs["club_code"]
+            )
 
             if membership is None or membership.role > creating_club_permission:
                 return False
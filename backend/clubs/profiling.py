@@ -0,0 +1,236 @@
+import contextvars
+import random
+import re
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils import timezone
+from rest_framework.serializers import BaseSerializer
+
+
+# Number of duplicated queries stored for each profiled request
+PROFILING_DUPLICATE_LIMIT = 5
+
+# Maximum length of the queries stored for each profiled request
+PROFILING_SQL_LENGTH = 500
+
+_current_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+def get_query_fingerprint(sql):
+    """
+    Normalize a parameterized query so that queries that only differ in their
+    parameters, including the number of values in an IN clause, are equal.
+    """
+    sql = re.sub(r"\((?:%s|\?)(?:,\s*(?:%s|\?))*\)", "(...)", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+class RequestProfile(object):
+    """
+    The queries and serializer time of a single request. Queries are recorded
+    using a database execute wrapper, and serializer time is measured around
+    the outermost call to serializer.data.
+    """
+
+    def __init__(self):
+        self.queries = Counter()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.query_count += 1
+            self.queries[get_query_fingerprint(sql)] += 1
+
+    def get_duplicates(self):
+        return [
+            {"sql": sql[:PROFILING_SQL_LENGTH], "count": count}
+            for sql, count in self.queries.most_common(PROFILING_DUPLICATE_LIMIT)
+            if count > 1
+        ]
+
+
+def _profile_serializer_data(prop):
+    """
+    Wrap a serializer data property to add its time to the current profile.
+    Nested calls, such as a serializer method field that uses another
+    serializer, are counted as part of the outermost serializer.
+    """
+
+    def data(self):
+        profile = _current_profile.get()
+        if profile is None:
+            return prop.fget(self)
+
+        profile.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return prop.fget(self)
+        finally:
+            profile.serializer_depth -= 1
+            if profile.serializer_depth == 0:
+                profile.serializer_time += time.perf_counter() - start
+
+    return property(data)
+
+
+class ProfileBuffer(object):
+    """
+    A ring buffer of request profiles stored in the cache, so that the
+    profiles of all processes can be inspected together. Only the last
+    REQUEST_PROFILING_BUFFER_SIZE profiles are kept.
+    """
+
+    head_key = "profiling:buffer:head"
+
+    # seconds to keep profiles in the cache
+    timeout = 60 * 60 * 24 * 7
+
+    def get_item_key(self, seq):
+        return f"profiling:buffer:{seq % settings.REQUEST_PROFILING_BUFFER_SIZE}"
+
+    def add(self, record):
+        cache.add(self.head_key, 0, None)
+        seq = cache.incr(self.head_key)
+        cache.set(self.get_item_key(seq), record, self.timeout)
+
+    def get_records(self):
+        head = cache.get(self.head_key, 0)
+        size = settings.REQUEST_PROFILING_BUFFER_SIZE
+        keys = [
+            self.get_item_key(seq) for seq in range(max(1, head - size + 1), head + 1)
+        ]
+        items = cache.get_many(keys)
+        return [items[key] for key in keys if key in items]
+
+    def clear(self):
+        head = cache.get(self.head_key, 0)
+        size = settings.REQUEST_PROFILING_BUFFER_SIZE
+        cache.delete_many(
+            [self.get_item_key(seq) for seq in range(max(1, head - size + 1), head + 1)]
+        )
+        cache.set(self.head_key, 0, None)
+
+    def get_summary(self):
+        """
+        Aggregate the buffered profiles by view, ordered by the total time spent
+        in the database.
+        """
+        groups = defaultdict(list)
+        for record in self.get_records():
+            groups[record["view"]].append(record)
+
+        summary = []
+        for view, records in groups.items():
+            count = len(records)
+            duplicates = Counter()
+            for record in records:
+                for item in record["duplicates"]:
+                    duplicates[item["sql"]] = max(
+                        duplicates[item["sql"]], item["count"]
+                    )
+            sizes = [r["size"] for r in records if r["size"] is not None]
+            summary.append(
+                {
+                    "view": view,
+                    "requests": count,
+                    "queries_avg": sum(r["queries"] for r in records) / count,
+                    "queries_max": max(r["queries"] for r in records),
+                    "sql_time_total": sum(r["sql_time"] for r in records),
+                    "sql_time_avg": sum(r["sql_time"] for r in records) / count,
+                    "serializer_time_avg": sum(r["serializer_time"] for r in records)
+                    / count,
+                    "time_avg": sum(r["time"] for r in records) / count,
+                    "size_avg": sum(sizes) / len(sizes) if sizes else None,
+                    "duplicates": [
+                        {"sql": sql, "count": count}
+                        for sql, count in duplicates.most_common(
+                            PROFILING_DUPLICATE_LIMIT
+                        )
+                    ],
+                    "last_seen": max(r["time_stamp"] for r in records),
+                }
+            )
+        summary.sort(key=lambda item: item["sql_time_total"], reverse=True)
+        return summary
+
+
+profile_buffer = ProfileBuffer()
+
+
+def get_view_name(request, view_func):
+    """
+    Return a readable name for a view, including the action for viewsets.
+    """
+    cls = getattr(view_func, "cls", None)
+    if cls is None:
+        return f"{view_func.__module__}.{view_func.__name__}"
+    actions = getattr(view_func, "actions", None) or {}
+    action = actions.get(request.method.lower())
+    return f"{cls.__name__}.{action}" if action else cls.__name__
+
+
+class ProfilingMiddleware(object):
+    """
+    Record the number of queries, time spent in the database and serializers,
+    duplicated queries and response size of sampled requests in the profile
+    buffer. The middleware is only used if REQUEST_PROFILING is enabled.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+        # measure the time spent serializing responses
+        if not getattr(BaseSerializer.data.fget, "profiled", False):
+            BaseSerializer.data = _profile_serializer_data(BaseSerializer.data)
+            BaseSerializer.data.fget.profiled = True
+
+    def __call__(self, request):
+        if random.random() >= settings.REQUEST_PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        request._profile_view = None
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        elapsed = time.perf_counter() - start
+
+        if request._profile_view is not None:
+            profile_buffer.add(
+                {
+                    "view": request._profile_view,
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "queries": profile.query_count,
+                    "sql_time": profile.sql_time,
+                    "serializer_time": profile.serializer_time,
+                    "time": elapsed,
+                    "size": None if response.streaming else len(response.content),
+                    "duplicates": profile.get_duplicates(),
+                    "time_stamp": timezone.now().isoformat(),
+                }
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, "_profile_view"):
+            request._profile_view = get_view_name(request, view_func)
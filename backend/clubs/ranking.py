@@ -0,0 +1,109 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from clubs.caching import cache_lock
+
+
+class RankUpdateQueue(object):
+    """
+    A debounced queue of clubs that need their rankings to be updated.
+    Changes are collected for RANK_UPDATE_DELAY seconds and then processed
+    together in a background thread.
+
+    The pending clubs are stored in the cache and not in the process, so clubs
+    that are waiting when a process exits are updated by the next flush in any
+    process, or by the next run of the rank command, which recomputes every club.
+    Pending clubs are only lost if they are evicted from the cache before then,
+    in which case their rankings are stale until the next run of the command.
+    """
+
+    key = "rank:pending"
+    lock_key = "rank:pending:lock"
+
+    # seconds to keep pending clubs, longer than the interval of the rank command
+    timeout = 60 * 60 * 24 * 2
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def add(self, club_id, components):
+        """
+        Queue ranking components of a club to be recomputed. The components are
+        recomputed synchronously if background tasks are disabled.
+        """
+        if not settings.BACKGROUND_TASKS:
+            self.update({club_id: set(components)})
+            return
+
+        self.store({club_id: set(components)})
+        with self.lock:
+            if self.timer is None:
+                self.timer = threading.Timer(settings.RANK_UPDATE_DELAY, self.run)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def store(self, changes):
+        """
+        Merge a mapping of club ids to changed components into the pending clubs.
+        """
+        with cache_lock(self.lock_key):
+            pending = cache.get(self.key) or {}
+            for club_id, components in changes.items():
+                pending.setdefault(club_id, set()).update(components)
+            cache.set(self.key, pending, self.timeout)
+
+    def take(self):
+        """
+        Remove and return the pending clubs and their changed components.
+        """
+        with cache_lock(self.lock_key):
+            pending = cache.get(self.key) or {}
+            cache.delete(self.key)
+        return pending
+
+    def update(self, pending):
+        from clubs.management.commands.rank import update_club_ranks
+
+        update_club_ranks(pending)
+
+    def flush(self):
+        """
+        Recompute the rankings of all pending clubs. Clubs that could not be
+        updated are kept for the next flush.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = None
+
+        pending = self.take()
+        if not pending:
+            return
+        try:
+            self.update(pending)
+        except Exception:
+            self.store(pending)
+            raise
+
+    def run(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+
+rank_update_queue = RankUpdateQueue()
+
+
+def queue_rank_update(club_id, *components):
+    """
+    Schedule the given ranking components of a club to be recomputed once the
+    current transaction commits.
+    """
+    if club_id is None:
+        return
+    transaction.on_commit(lambda: rank_update_queue.add(club_id, components))
@@ -0,0 +1,470 @@
+import bisect
+import html
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import (
+    BooleanField,
+    Case,
+    Count,
+    F,
+    FloatField,
+    Max,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from clubs.caching import cache_lock
+
+
+# Weights of the fields that are indexed for each model, higher is more relevant.
+# Events also match when the club that they belong to matches.
+SEARCH_FIELDS = {
+    "clubs.Club": {"A": ["name"], "B": ["code", "subtitle", "terms"]},
+    "clubs.Event": {"A": ["name"], "B": ["description"]},
+}
+RELATED_SEARCH_FIELDS = {"clubs.Event": "club"}
+
+RANK_WEIGHTS = {"A": 1.0, "B": 0.4}
+
+
+def tokenize(text):
+    """
+    Split text (possibly containing html) into a list of lowercase search terms.
+    """
+    if not text:
+        return []
+    text = html.unescape(re.sub(r"<[^>]+>", " ", text))
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def get_postgres_vector(model):
+    """
+    Return the SQL for the tsvector of a model.
+    This must match the GIN index expressions created in the migrations exactly,
+    otherwise the index will not be used.
+    """
+    table = model._meta.db_table
+    parts = []
+    for weight, fields in SEARCH_FIELDS[model._meta.label].items():
+        text = " || ' ' || ".join(f"COALESCE({table}.{field}, '')" for field in fields)
+        parts.append(f"setweight(to_tsvector('simple'::regconfig, {text}), '{weight}')")
+    return " || ".join(parts)
+
+
+class InvertedIndex(object):
+    """
+    An in process inverted index used when the database does not support full text
+    search. Maps search terms to the objects that contain them and their weights.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = SEARCH_FIELDS[model._meta.label]
+        self.lock = threading.RLock()
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.terms = []
+        self.signature = None
+        self.signature_stale = False
+
+    def get_signature(self):
+        """
+        Return a cheap signature of the table contents that changes when objects are
+        added, removed or updated without sending signals (ex: bulk_create).
+        """
+        return tuple(
+            self.model.objects.aggregate(
+                count=Count("pk"), updated=Max("updated_at")
+            ).values()
+        )
+
+    def build(self):
+        fields = [field for fields in self.fields.values() for field in fields]
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        for row in self.model.objects.values("pk", *fields).iterator():
+            self._add(row["pk"], row)
+        self.terms = sorted(self.postings)
+
+    def refresh(self):
+        """
+        Rebuild the index if the table has been modified outside of this process.
+        """
+        with self.lock:
+            signature = self.get_signature()
+            if self.signature_stale:
+                self.signature_stale = False
+            elif signature != self.signature:
+                self.build()
+            self.signature = signature
+
+    def _add(self, pk, values):
+        weights = {}
+        for weight, fields in self.fields.items():
+            for field in fields:
+                for term in tokenize(values.get(field)):
+                    weights[term] = weights.get(term, 0) + RANK_WEIGHTS[weight]
+
+        for term, score in weights.items():
+            if term not in self.postings:
+                bisect.insort(self.terms, term)
+            self.postings[term][pk] = score
+        self.documents[pk] = set(weights)
+
+    def _remove(self, pk):
+        for term in self.documents.pop(pk, ()):
+            self.postings[term].pop(pk, None)
+
+    def update(self, instance):
+        with self.lock:
+            if self.signature is None:
+                return
+            self._remove(instance.pk)
+            self._add(
+                instance.pk,
+                {
+                    field: getattr(instance, field)
+                    for fields in self.fields.values()
+                    for field in fields
+                },
+            )
+            self.signature_stale = True
+
+    def remove(self, pk):
+        with self.lock:
+            if self.signature is None:
+                return
+            self._remove(pk)
+            self.signature_stale = True
+
+    def search(self, terms):
+        """
+        Return a mapping of primary keys to relevance scores for all objects that
+        contain a term starting with each of the given search terms.
+        """
+        self.refresh()
+        with self.lock:
+            scores = None
+            for term in terms:
+                matches = defaultdict(float)
+                start = bisect.bisect_left(self.terms, term)
+                for word in self.terms[start:]:
+                    if not word.startswith(term):
+                        break
+                    for pk, score in self.postings[word].items():
+                        matches[pk] = max(matches[pk], score)
+
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {
+                        pk: score + matches[pk]
+                        for pk, score in scores.items()
+                        if pk in matches
+                    }
+                if not scores:
+                    return {}
+
+        return scores or {}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(model):
+    with _indexes_lock:
+        if model not in _indexes:
+            _indexes[model] = InvertedIndex(model)
+        return _indexes[model]
+
+
+def use_postgres():
+    return connection.vendor == "postgresql"
+
+
+def update_search_index(instance):
+    """
+    Update the in process search index after an object has been saved.
+    Postgres maintains its indexes automatically.
+    """
+    if not use_postgres():
+        get_search_index(instance.__class__).update(instance)
+
+
+def remove_from_search_index(instance):
+    """
+    Remove an object from the in process search index after it has been deleted.
+    """
+    if not use_postgres():
+        get_search_index(instance.__class__).remove(instance.pk)
+
+
+def _postgres_search(queryset, terms):
+    model = queryset.model
+    query = " & ".join(f"{term}:*" for term in terms)
+    vector = get_postgres_vector(model)
+
+    condition = RawSQL(
+        f"{vector} @@ to_tsquery('simple'::regconfig, %s)",
+        [query],
+        output_field=BooleanField(),
+    )
+    related = RELATED_SEARCH_FIELDS.get(model._meta.label)
+    if related is not None:
+        related_model = model._meta.get_field(related).related_model
+        related_table = related_model._meta.db_table
+        column = model._meta.get_field(related).column
+        condition = RawSQL(
+            f"({vector} @@ to_tsquery('simple'::regconfig, %s) OR "
+            f"{model._meta.db_table}.{column} IN (SELECT {related_table}.id FROM "
+            f"{related_table} WHERE {get_postgres_vector(related_model)} @@ "
+            "to_tsquery('simple'::regconfig, %s)))",
+            [query, query],
+            output_field=BooleanField(),
+        )
+
+    return queryset.filter(condition).annotate(
+        search_rank=RawSQL(
+            f"ts_rank({vector}, to_tsquery('simple'::regconfig, %s))",
+            [query],
+            output_field=FloatField(),
+        )
+    )
+
+
+def _index_search(queryset, terms):
+    model = queryset.model
+    scores = get_search_index(model).search(terms)
+
+    related_scores = {}
+    related = RELATED_SEARCH_FIELDS.get(model._meta.label)
+    if related is not None:
+        related_model = model._meta.get_field(related).related_model
+        related_scores = get_search_index(related_model).search(terms)
+
+    if not scores and not related_scores:
+        return queryset.none()
+
+    # related matches are ranked below direct matches
+    whens = [When(pk=pk, then=Value(score)) for pk, score in scores.items()]
+    whens += [
+        When(**{related: pk}, then=Value(score / 2))
+        for pk, score in related_scores.items()
+    ]
+    return queryset.filter(
+        Q(pk__in=scores.keys()) | Q(**{f"{related}__in": related_scores.keys()})
+        if related is not None
+        else Q(pk__in=scores.keys())
+    ).annotate(search_rank=Case(*whens, default=Value(0.0), output_field=FloatField()))
+
+
+def search_queryset(queryset, query):
+    """
+    Filter a queryset to the objects matching a search query and annotate each
+    object with a search_rank relevance score.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return queryset
+    if use_postgres():
+        return _postgres_search(queryset, terms)
+    return _index_search(queryset, terms)
+
+
+def normalize_query(query):
+    """
+    Return the form of a search query that is used for the popular query stats.
+    """
+    return " ".join(query.lower().split())[:255]
+
+
+class SearchQueryLogger(object):
+    """
+    Logs search queries in batches in a background thread.
+
+    Searches are made as students type, so a query from a student that extends
+    or shortens their previous query within SEARCH_QUERY_WINDOW seconds replaces
+    it, and only the final query is logged. The daily count of each normalized
+    query is updated at the same time.
+
+    Like the club visit buffer, queries are stored in the cache under sequential
+    keys, and the key of the latest query of each student is remembered for
+    SEARCH_QUERY_WINDOW seconds. Queries are merged across processes, and
+    queries that are waiting when a process exits are written by the next flush
+    in any process. Queries are written once they can no longer be replaced.
+    """
+
+    head_key = "search:buffer:head"
+    tail_key = "search:buffer:tail"
+    lock_key = "search:buffer:lock"
+    missing_key = "search:buffer:missing"
+
+    # seconds after which a query that was never written to the cache is skipped
+    missing_timeout = 60
+
+    # seconds to keep queries in the cache before they are discarded
+    timeout = 60 * 60 * 24 * 7
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def get_item_key(self, seq):
+        return f"search:buffer:{seq}"
+
+    def get_pending_key(self, person_id):
+        return f"search:pending:{person_id}"
+
+    def log(self, person_id, query):
+        query = " ".join(query.split())
+        if not query:
+            return
+
+        now = timezone.now()
+        if not settings.BACKGROUND_TASKS:
+            self.write([(person_id, query, now)])
+            return
+
+        pending_key = self.get_pending_key(person_id)
+        with cache_lock(f"{pending_key}:lock"):
+            seq = cache.get(pending_key)
+            previous = cache.get(self.get_item_key(seq)) if seq is not None else None
+            replace = False
+            if previous is not None:
+                old_lower, lower = previous[1].lower(), query.lower()
+                replace = lower.startswith(old_lower) or old_lower.startswith(lower)
+            if not replace:
+                cache.add(self.head_key, 0, None)
+                seq = cache.incr(self.head_key)
+            cache.set(
+                self.get_item_key(seq),
+                (person_id, query, now.isoformat()),
+                self.timeout,
+            )
+            cache.set(pending_key, seq, settings.SEARCH_QUERY_WINDOW)
+
+        self.schedule()
+
+    def schedule(self):
+        with self.lock:
+            if self.timer is None:
+                self.timer = threading.Timer(settings.SEARCH_QUERY_WINDOW, self.run)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def get_pending(self, tail, head, force):
+        """
+        Return the buffered queries after the tail in order, and the sequence
+        number of the last one. Stops at the first query that can still be
+        replaced, unless force is set, or that has not been written to the cache
+        yet, unless it has been missing for a while.
+        """
+        keys = [self.get_item_key(seq) for seq in range(tail + 1, head + 1)]
+        items = cache.get_many(keys)
+        now = timezone.now()
+
+        pending = []
+        last = tail
+        for seq, key in enumerate(keys, start=tail + 1):
+            if key not in items:
+                missing = cache.get(self.missing_key)
+                if missing is None or missing[0] != seq:
+                    cache.set(self.missing_key, (seq, time.time()), None)
+                    break
+                if time.time() - missing[1] < self.missing_timeout:
+                    break
+            else:
+                person_id, query, created_at = items[key]
+                created_at = parse_datetime(created_at)
+                age = (now - created_at).total_seconds()
+                if not force and age < settings.SEARCH_QUERY_WINDOW:
+                    break
+                pending.append((person_id, query, created_at))
+            last = seq
+        return pending, last
+
+    def flush(self, force=False):
+        """
+        Write all of the queries that can no longer be replaced by a later query,
+        or all queries if force is set. Only one process flushes the queries at
+        a time. Return the number of queries written.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = None
+
+        if not cache.add(self.lock_key, True, 60 * 5):
+            return 0
+
+        try:
+            head = cache.get(self.head_key, 0)
+            tail = cache.get(self.tail_key, 0)
+            queries, last = self.get_pending(tail, head, force)
+            self.write(queries)
+            cache.set(self.tail_key, last, None)
+            cache.delete_many(
+                [self.get_item_key(seq) for seq in range(tail + 1, last + 1)]
+            )
+        finally:
+            cache.delete(self.lock_key)
+
+        # queries that can still be replaced are written by a later flush
+        if last < head and settings.BACKGROUND_TASKS:
+            self.schedule()
+        return len(queries)
+
+    def write(self, queries):
+        from clubs.models import SearchQuery, SearchQueryStat
+
+        if not queries:
+            return
+
+        counts = defaultdict(int)
+        for _, query, created_at in queries:
+            counts[(normalize_query(query), timezone.localdate(created_at))] += 1
+
+        with transaction.atomic():
+            SearchQuery.objects.bulk_create(
+                [
+                    SearchQuery(person_id=person_id, query=query, created_at=created_at)
+                    for person_id, query, created_at in queries
+                ]
+            )
+
+            missing = []
+            for (query, date), count in counts.items():
+                if not SearchQueryStat.objects.filter(query=query, date=date).update(
+                    count=F("count") + count
+                ):
+                    missing.append((query, date, count))
+
+            # stats may have been created by a concurrent write in the meantime
+            SearchQueryStat.objects.bulk_create(
+                [SearchQueryStat(query=query, date=date) for query, date, _ in missing],
+                ignore_conflicts=True,
+            )
+            for query, date, count in missing:
+                SearchQueryStat.objects.filter(query=query, date=date).update(
+                    count=F("count") + count
+                )
+
+    def run(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+
+search_query_logger = SearchQueryLogger()
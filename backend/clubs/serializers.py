@@ -8,6 +8,7 @@ import bleach
 import pytz
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
 from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.validators import URLValidator
@@ -57,7 +58,7 @@ from clubs.models import (
     Testimonial,
     Year,
 )
-from clubs.utils import clean
+from clubs.utils import clean, get_short_description
 
 
 ALL_TAGS_SELECTED_ERROR_MESSAGE = (
@@ -849,6 +850,24 @@ class ClubConstitutionSerializer(ClubMinimalSerializer):
         fields = ClubMinimalSerializer.Meta.fields + ["files"]
 
 
+class ClubTagListSerializer(serializers.ListSerializer):
+    """
+    Serializes the tags of a club from the precomputed club card if possible,
+    which avoids fetching the tags of each club from the database.
+    """
+
+    def get_attribute(self, instance):
+        card = getattr(instance, "card", None)
+        if card and "tags" in card:
+            return card["tags"]
+        return super().get_attribute(instance)
+
+    def to_representation(self, data):
+        if isinstance(data, list):
+            return [{"id": tag["id"], "name": tag["name"]} for tag in data]
+        return super().to_representation(data)
+
+
 class ClubListSerializer(serializers.ModelSerializer):
     """
     The club list serializer returns a subset of the information that the full
@@ -856,9 +875,25 @@ class ClubListSerializer(serializers.ModelSerializer):
     Optimized for the home page, some fields may be missing if not necessary.
     For example, if the subtitle is set, the description is returned as null.
     This is done for a quicker response.
+
+    The preview text, logo and tags are read from the precomputed club card
+    when it is available.
     """
 
-    tags = TagSerializer(many=True)
+    tags = ClubTagListSerializer(child=TagSerializer())
+
+    # copied to the approved version of a club when it is shown instead
+    PRESERVED_ATTRIBUTES = [
+        "favorite_count",
+        "membership_count",
+        "user_favorite_set",
+        "user_subscribe_set",
+        "user_membership_set",
+        "user_membershiprequest_set",
+        "upcoming_events",
+        "officer_membership_set",
+        "_prefetched_objects_cache",
+    ]
     image_url = serializers.SerializerMethodField("get_image_url")
     favorite_count = serializers.IntegerField(read_only=True)
     membership_count = serializers.IntegerField(read_only=True)
@@ -875,25 +910,27 @@ class ClubListSerializer(serializers.ModelSerializer):
         return "Hidden"
 
     def get_short_description(self, obj):
+        card = getattr(obj, "card", None)
+        if card and "subtitle" in card:
+            return card["subtitle"]
         if obj.subtitle:
             return obj.subtitle
 
         # return first sentence of description without html tags
-        desc = obj.description.lstrip()[:1000]
-        cleaned_desc = re.sub(r"<[^>]+>", "", desc)
-        return (
-            "".join(re.split(r"(\.|\n|!)", cleaned_desc)[:2])
-            .replace("&amp;", "&")
-            .replace("&lt;", "<")
-            .replace("&gt;", ">")
-            .replace("&ndash;", "-")
-            .replace("&mdash;", "-")
-            .replace("&nbsp;", " ")
-            .strip()
-        )
+        return get_short_description(obj.description)
+
+    def get_user(self):
+        """
+        Return the user that this response is being generated for.
+        Shared responses are rendered as if they were requested by an anonymous user,
+        the user specific fields are merged in afterwards.
+        """
+        if self.context.get("shared", False):
+            return AnonymousUser()
+        return self.context["request"].user
 
     def get_is_favorite(self, obj):
-        user = self.context["request"].user
+        user = self.get_user()
         if not user.is_authenticated:
             return False
         if hasattr(obj, "user_favorite_set"):
@@ -901,7 +938,7 @@ class ClubListSerializer(serializers.ModelSerializer):
         return obj.favorite_set.filter(person=user).exists()
 
     def get_is_subscribe(self, obj):
-        user = self.context["request"].user
+        user = self.get_user()
         if not user.is_authenticated:
             return False
         if hasattr(obj, "user_subscribe_set"):
@@ -909,7 +946,7 @@ class ClubListSerializer(serializers.ModelSerializer):
         return obj.subscribe_set.filter(person=user).exists()
 
     def get_is_member(self, obj):
-        user = self.context["request"].user
+        user = self.get_user()
         if not user.is_authenticated:
             return False
         if hasattr(obj, "user_membership_set"):
@@ -921,20 +958,23 @@ class ClubListSerializer(serializers.ModelSerializer):
         return mship.role
 
     def get_image_url(self, obj):
-        # use small version if exists
-        image = obj.image_small
-        if not image:
-            image = obj.image
+        card = getattr(obj, "card", None)
+        if card and "image_url" in card:
+            url = card["image_url"]
+        else:
+            # use small version if exists
+            image = obj.image_small or obj.image
+            url = image.url if image else None
 
         # correct path rendering
-        if not image:
+        if not url:
             return None
-        if image.url.startswith("http"):
-            return image.url
+        if url.startswith("http"):
+            return url
         elif "request" in self.context:
-            return self.context["request"].build_absolute_uri(image.url)
+            return self.context["request"].build_absolute_uri(url)
         else:
-            return image.url
+            return url
 
     def get_fields(self):
         """
@@ -970,23 +1010,24 @@ class ClubListSerializer(serializers.ModelSerializer):
         that should not see unapproved content.
         """
         if instance.ghost and not instance.approved:
-            user = self.context["request"].user
+            user = self.get_user()
 
             can_see_pending = user.has_perm("clubs.see_pending_clubs") or user.has_perm(
                 "clubs.manage_club"
             )
-            is_member = (
-                user.is_authenticated
-                and instance.membership_set.filter(person=user).exists()
-            )
+            if not user.is_authenticated:
+                is_member = False
+            elif hasattr(instance, "user_membership_set"):
+                is_member = bool(instance.user_membership_set)
+            else:
+                is_member = instance.membership_set.filter(person=user).exists()
             if not can_see_pending and not is_member:
-                historical_club = (
-                    instance.history.filter(approved=True)
-                    .order_by("-approved_on")
-                    .first()
-                )
-                if historical_club is not None:
-                    approved_instance = historical_club.instance
+                approved_instance = instance.get_approved_version()
+                if approved_instance is not None:
+                    # reuse the annotations and prefetched objects of the club
+                    for attr in self.PRESERVED_ATTRIBUTES:
+                        if hasattr(instance, attr):
+                            setattr(approved_instance, attr, getattr(instance, attr))
                     approved_instance._is_historical = True
                     return super().to_representation(approved_instance)
         return super().to_representation(instance)
@@ -1115,7 +1156,7 @@ class TargetYearSerializer(serializers.ModelSerializer):
         fields = ("id", "program")
 
     def get_id(self, obj):
-        return obj.target_years.id
+        return obj.target_years_id
 
 
 class TargetSchoolSerializer(serializers.ModelSerializer):
@@ -1130,7 +1171,7 @@ class TargetSchoolSerializer(serializers.ModelSerializer):
         fields = ("id", "program")
 
     def get_id(self, obj):
-        return obj.target_schools.id
+        return obj.target_schools_id
 
 
 class TargetMajorSerializer(serializers.ModelSerializer):
@@ -1145,7 +1186,7 @@ class TargetMajorSerializer(serializers.ModelSerializer):
         fields = ("id", "program")
 
     def get_id(self, obj):
-        return obj.target_majors.id
+        return obj.target_majors_id
 
 
 class TargetStudentTypeSerializer(serializers.ModelSerializer):
@@ -1160,7 +1201,7 @@ class TargetStudentTypeSerializer(serializers.ModelSerializer):
         fields = ("id", "program")
 
     def get_id(self, obj):
-        return obj.target_student_types.id
+        return obj.target_student_types_id
 
 
 class ClubSerializer(ManyToManySaveMixin, ClubListSerializer):
@@ -1193,15 +1234,16 @@ class ClubSerializer(ManyToManySaveMixin, ClubListSerializer):
     youtube = serializers.CharField(required=False, allow_null=True, allow_blank=True)
 
     def get_fairs(self, obj):
-        return list(obj.clubfair_set.values_list("id", flat=True))
+        return [fair.id for fair in obj.clubfair_set.all()]
 
     def get_events(self, obj):
-        now = timezone.now()
+        if hasattr(obj, "upcoming_events"):
+            events = obj.upcoming_events
+        else:
+            now = timezone.now()
+            events = obj.events.filter(end_time__gte=now).order_by("start_time")
         return ClubEventSerializer(
-            obj.events.filter(end_time__gte=now).order_by("start_time"),
-            many=True,
-            read_only=True,
-            context=self.context,
+            events, many=True, read_only=True, context=self.context,
         ).data
 
     def get_is_ghost(self, obj):
@@ -1231,22 +1273,24 @@ class ClubSerializer(ManyToManySaveMixin, ClubListSerializer):
         user = self.context["request"].user
         if not user.is_authenticated:
             return False
+        if hasattr(obj, "user_membershiprequest_set"):
+            return bool(obj.user_membershiprequest_set)
         return obj.membershiprequest_set.filter(person=user, withdrew=False).exists()
 
     def get_target_years(self, obj):
-        qset = TargetYear.objects.filter(club=obj)
+        qset = obj.targetyear_set.all()
         return [TargetYearSerializer(m).data for m in qset]
 
     def get_target_majors(self, obj):
-        qset = TargetMajor.objects.filter(club=obj)
+        qset = obj.targetmajor_set.all()
         return [TargetMajorSerializer(m).data for m in qset]
 
     def get_target_schools(self, obj):
-        qset = TargetSchool.objects.filter(club=obj)
+        qset = obj.targetschool_set.all()
         return [TargetSchoolSerializer(m).data for m in qset]
 
     def get_target_student_types(self, obj):
-        qset = TargetStudentType.objects.filter(club=obj)
+        qset = obj.targetstudenttype_set.all()
         return [TargetStudentTypeSerializer(m).data for m in qset]
 
     def create(self, validated_data):
@@ -1483,9 +1527,7 @@ class ClubSerializer(ManyToManySaveMixin, ClubListSerializer):
         if request and request.user.has_perm("clubs.approve_club"):
             needs_reapproval = False
 
-        has_approved_version = (
-            self.instance and self.instance.history.filter(approved=True).exists()
-        )
+        has_approved_version = self.instance and bool(self.instance.approved_snapshot)
 
         if needs_reapproval:
             self.validated_data["approved"] = None
@@ -2150,9 +2192,18 @@ class AuthenticatedClubSerializer(ClubSerializer):
     owners = serializers.SerializerMethodField("get_owners")
     officers = serializers.SerializerMethodField("get_officers")
 
+    def get_members_with_role(self, obj, role):
+        if hasattr(obj, "officer_membership_set"):
+            return [
+                mship.person
+                for mship in obj.officer_membership_set
+                if mship.role == role
+            ]
+        return obj.members.filter(membership__role=role)
+
     def get_owners(self, obj):
         return MinimalUserProfileSerializer(
-            obj.members.filter(membership__role=Membership.ROLE_OWNER),
+            self.get_members_with_role(obj, Membership.ROLE_OWNER),
             many=True,
             read_only=True,
             context=self.context,
@@ -2160,7 +2211,7 @@ class AuthenticatedClubSerializer(ClubSerializer):
 
     def get_officers(self, obj):
         return MinimalUserProfileSerializer(
-            obj.members.filter(membership__role=Membership.ROLE_OFFICER),
+            self.get_members_with_role(obj, Membership.ROLE_OFFICER),
             many=True,
             read_only=True,
             context=self.context,
@@ -2526,10 +2577,36 @@ class ApplicationSubmissionCSVSerializer(serializers.ModelSerializer):
             obj.committee.name if obj.committee else ClubApplication.DEFAULT_COMMITTEE
         )
 
+    def get_questions(self, application):
+        """
+        Return the questions of the application, which are only fetched once for
+        all of the submissions that are exported.
+        """
+        if not hasattr(self, "_questions"):
+            self._questions = {}
+        if application.id not in self._questions:
+            self._questions[application.id] = list(application.questions.all())
+        return self._questions[application.id]
+
+    def get_columns(self, application):
+        """
+        Return the keys of the exported rows in order, with one column per
+        question prompt.
+        """
+        columns = ["name", "email", "graduation_year", "committee"]
+        for question in self.get_questions(application):
+            if (
+                question.question_type != ApplicationQuestion.INFO_TEXT
+                and question.prompt not in columns
+            ):
+                columns.append(question.prompt)
+        return columns
+
     def to_representation(self, instance):
         """
-        Override to also include values for fields we add when we override init. We
-        need to query the responses to find the appropriate response for each question
+        Override to also include values for fields we add when we override init.
+        The responses of the submission are matched to the questions of the
+        application, using prefetched responses if available.
         """
         fields = {
             "name": self.get_name(instance),
@@ -2537,9 +2614,13 @@ class ApplicationSubmissionCSVSerializer(serializers.ModelSerializer):
             "graduation_year": instance.user.profile.graduation_year,
             "committee": self.get_committee(instance),
         }
-        application = instance.application
-        for question in application.questions.all():
-            response = instance.responses.filter(question=question).first()
+        # use the first response to each question
+        responses = {}
+        for response in sorted(instance.responses.all(), key=lambda r: r.pk):
+            responses.setdefault(response.question_id, response)
+
+        for question in self.get_questions(instance.application):
+            response = responses.get(question.id)
             if response:
                 # format the responses depending on the question type
                 if question.question_type == ApplicationQuestion.FREE_RESPONSE:
@@ -2570,14 +2651,12 @@ class ApplicationSubmissionCSVSerializer(serializers.ModelSerializer):
         per question (the XLSXFormatterMixin just gives each field a column)
         """
         super(ApplicationSubmissionCSVSerializer, self).__init__(*args, **kwargs)
-        (queryset,) = args
+        queryset = args[0] if args else None
 
-        submission = queryset[0] if len(queryset) else None
+        submission = queryset[0] if queryset is not None and len(queryset) else None
         if submission:
-            application = submission.application
-            for question in application.questions.all():
-                if question.question_type != ApplicationQuestion.INFO_TEXT:
-                    self.fields[question.prompt] = serializers.CharField()
+            for prompt in self.get_columns(submission.application)[4:]:
+                self.fields[prompt] = serializers.CharField()
 
     class Meta:
         model = ApplicationSubmission
@@ -35,6 +35,7 @@ from clubs.views import (
     OptionListView,
     QuestionAnswerViewSet,
     ReportViewSet,
+    RequestProfileAPIView,
     SchoolViewSet,
     ScriptExecutionView,
     SearchQueryViewSet,
@@ -145,6 +146,7 @@ urlpatterns = [
     path(r"emailpreview/", email_preview, name="email-preview"),
     path(r"scripts/", ScriptExecutionView.as_view(), name="scripts"),
     path(r"options/", OptionListView.as_view(), name="options"),
+    path(r"profiling/", RequestProfileAPIView.as_view(), name="profiling"),
     path(r"social/", include("social_django.urls", namespace="social")),
     path(
         r"webhook/meeting/",
@@ -29,6 +29,53 @@ def get_domain(request):
     return domain
 
 
+def get_zoom_meeting_id(url):
+    """
+    Return the meeting id of a Zoom meeting link, such as
+    https://upenn.zoom.us/j/4880003126?pwd=abc, or None if the url is not a link
+    to a Zoom meeting.
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    host = parsed.hostname or ""
+    if parsed.scheme not in {"http", "https"} or not (
+        host == "zoom.us" or host.endswith(".zoom.us")
+    ):
+        return None
+    match = re.match(r"/[^/]*/(\d+)/?$", parsed.path)
+    return match[1] if match is not None else None
+
+
+class Echo(object):
+    """
+    A file-like object that returns what is written to it instead of storing it,
+    used to stream the rows of a CSV writer in a response.
+    """
+
+    def write(self, value):
+        return value
+
+
+def get_short_description(description):
+    """
+    Return the first sentence of an HTML description without any tags,
+    used as the preview text for clubs that do not have a subtitle.
+    """
+    desc = description.lstrip()[:1000]
+    cleaned_desc = re.sub(r"<[^>]+>", "", desc)
+    return (
+        "".join(re.split(r"(\.|\n|!)", cleaned_desc)[:2])
+        .replace("&amp;", "&")
+        .replace("&lt;", "<")
+        .replace("&gt;", ">")
+        .replace("&ndash;", "-")
+        .replace("&mdash;", "-")
+        .replace("&nbsp;", " ")
+        .strip()
+    )
+
+
 def html_to_text(html):
     """
     Cleans up HTML and converts into a text-only format,
@@ -1,7 +1,9 @@
 import argparse
 import collections
+import csv
 import datetime
 import functools
+import hashlib
 import io
 import json
 import os
@@ -10,12 +12,9 @@ import secrets
 import string
 from urllib.parse import urlparse
 
-import pandas as pd
 import pytz
 import qrcode
 import requests
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from dateutil.parser import parse
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -29,18 +28,20 @@ from django.core.management import call_command, get_commands, load_command_clas
 from django.core.validators import validate_email
 from django.db.models import (
     Count,
-    DurationField,
-    ExpressionWrapper,
+    Exists,
     F,
+    OuterRef,
     Prefetch,
     Q,
+    Subquery,
+    Sum,
     TextField,
     Value,
 )
 from django.db.models.expressions import RawSQL
 from django.db.models.functions import SHA1, Concat, Lower, Trunc
 from django.db.models.query import prefetch_related_objects
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.template.loader import render_to_string
 from django.utils import timezone
@@ -64,11 +65,29 @@ from rest_framework.views import APIView
 from social_django.utils import load_strategy
 from tatsu.exceptions import FailedParse
 
-from clubs.filters import RandomOrderingFilter, RandomPageNumberPagination
+from clubs.attendance import (
+    get_live_event_stats,
+    get_live_event_summary,
+    get_officers,
+    get_zoom_event_id,
+    record_zoom_visit,
+)
+from clubs.caching import cache_get_tagged, cache_set_tagged, invalidate_cache_tags
+from clubs.fairs import build_fair_directory, get_current_fair_id, get_fair_directory
+from clubs.filters import (
+    OptionalPageNumberPagination,
+    RandomOrderingFilter,
+    RandomPageNumberPagination,
+    SearchIndexFilter,
+)
+from clubs.hierarchy import get_relationship_tree
+from clubs.management.commands.flush_visits import visit_buffer
+from clubs.management.commands.rollup_analytics import get_bucket
 from clubs.mixins import XLSXFormatterMixin
 from clubs.models import (
     AdminNote,
     Advisor,
+    AnalyticsRollup,
     ApplicationMultipleChoice,
     ApplicationQuestion,
     ApplicationQuestionResponse,
@@ -93,6 +112,7 @@ from clubs.models import (
     Report,
     School,
     SearchQuery,
+    SearchQueryStat,
     StudentType,
     Subscribe,
     Tag,
@@ -119,8 +139,11 @@ from clubs.permissions import (
     QuestionAnswerPermission,
     ReadOnly,
     WhartonApplicationPermission,
-    find_membership_helper,
+    get_permission_resolver,
 )
+from clubs.profiling import profile_buffer
+from clubs.ranking import queue_rank_update
+from clubs.search import search_query_logger
 from clubs.serializers import (
     AdminNoteSerializer,
     AdvisorSerializer,
@@ -179,7 +202,7 @@ from clubs.serializers import (
     WritableClubFairSerializer,
     YearSerializer,
 )
-from clubs.utils import fuzzy_lookup_club, html_to_text
+from clubs.utils import Echo, fuzzy_lookup_club, html_to_text
 
 
 def file_upload_endpoint_helper(request, code):
@@ -232,29 +255,6 @@ def upload_endpoint_helper(request, cls, keyword, field, save=True, **kwargs):
     )
 
 
-def find_relationship_helper(relationship, club_object, found):
-    """
-    Format and retrieve all parents or children of a club into tree.
-    """
-    children = getattr(club_object, relationship).all().prefetch_related(relationship)
-    children_recurse = []
-    for child in children:
-        if child.code not in found:
-            found.add(child.code)
-            children_recurse.append(
-                find_relationship_helper(relationship, child, found)
-            )
-            found.remove(child.code)
-        else:
-            children_recurse.append({"name": child.name, "code": child.code})
-
-    return {
-        "name": club_object.name,
-        "code": club_object.code,
-        "children": children_recurse,
-    }
-
-
 def filter_note_permission(queryset, club, user):
     """
     Filter the note queryset so that only notes the user has access
@@ -530,6 +530,10 @@ class ClubsOrderingFilter(RandomOrderingFilter):
         if not ordering and hasattr(view, "ordering"):
             ordering = [view.ordering]
 
+        # order search results by relevance, if there is a search query
+        if "relevance" in ordering and "search_rank" in queryset.query.annotations:
+            return queryset.order_by("-search_rank", "-id")
+
         if "featured" in ordering:
             if queryset.model == Club:
                 return queryset.order_by("-rank", "-favorite_count", "-id")
@@ -642,60 +646,30 @@ class ClubFairViewSet(viewsets.ModelViewSet):
         ---
         """
         fair = self.get_object()
-        clubs = fair.participating_clubs.all()
-        events = (
-            Event.objects.filter(
-                club__in=clubs,
-                type=Event.FAIR,
-                start_time__gte=fair.start_time,
-                end_time__lte=fair.end_time,
-            )
-            .annotate(
-                participant_count=Count(
-                    "visits__person",
-                    distinct=True,
-                    filter=Q(visits__leave_time__isnull=True),
-                )
-            )
-            .annotate(
-                already_attended=Count(
-                    "visits__person",
-                    distinct=True,
-                    filter=Q(visits__leave_time__isnull=False),
-                )
-            )
-            .filter(visits__leave_time__isnull=False)
-            .annotate(
-                durations=ExpressionWrapper(
-                    F("visits__leave_time") - F("visits__join_time"),
-                    output_field=DurationField(),
-                )
-            )
-        )
+        events = Event.objects.filter(
+            club__in=fair.participating_clubs.all(),
+            type=Event.FAIR,
+            start_time__gte=fair.start_time,
+            end_time__lte=fair.end_time,
+        ).values_list("id", "club_id")
 
-        median_list = collections.defaultdict(list)
-        for event_id, duration in events.values_list("id", "durations").order_by(
-            "durations"
-        ):
-            median_list[event_id].append(duration.total_seconds())
-        median_list = {k: v[len(v) // 2] if v else 0 for k, v in median_list.items()}
-
-        event_list = events.values_list("id", "participant_count", "already_attended")
-        officer_mapping = collections.defaultdict(list)
-        for k, v in events.filter(
-            club__in=clubs,
-            club__membership__role__lte=10,
-            visits__leave_time__isnull=True,
-        ).values_list("id", "club__membership__person__username"):
-            officer_mapping[k].append(v)
+        # counts are kept up to date by the zoom webhook
+        stats = get_live_event_stats([event_id for event_id, _ in events])
+        officers = get_officers({club_id for _, club_id in events})
 
         formatted = {}
-        for event_id, particpant_count, already_attended in event_list:
+        for event_id, club_id in events:
+            event_stats = stats[event_id]
+            attending = event_stats.attending
             formatted[event_id] = {
-                "participant_count": particpant_count,
-                "already_attended": already_attended,
-                "officers": officer_mapping.get(event_id, []),
-                "median": median_list.get(event_id, 0),
+                "participant_count": len(attending),
+                "already_attended": len(event_stats.attended),
+                "officers": [
+                    username
+                    for person_id, username in officers[club_id].items()
+                    if person_id in attending
+                ],
+                "median": event_stats.get_median(),
             }
         return Response(formatted)
 
@@ -961,7 +935,7 @@ class ClubFairViewSet(viewsets.ModelViewSet):
             )
 
         # check if user can actually register club
-        mship = find_membership_helper(request.user, club)
+        mship = get_permission_resolver(request).get_membership(club)
         if (
             mship is not None
             and mship.role <= Membership.ROLE_OFFICER
@@ -1015,12 +989,11 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
             favorite_count=Count("favorite", distinct=True),
             membership_count=Count("membership", distinct=True, filter=Q(active=True)),
         )
-        .prefetch_related("tags")
         .order_by("-favorite_count", "name")
     )
     permission_classes = [ClubPermission | IsSuperuser]
-    filter_backends = [filters.SearchFilter, ClubsSearchFilter, ClubsOrderingFilter]
-    search_fields = ["name", "subtitle", "code", "terms"]
+    filter_backends = [SearchIndexFilter, ClubsSearchFilter, ClubsOrderingFilter]
+    random_ordering_cache_tags = ["clubs"]
     ordering_fields = ["favorite_count", "name"]
     ordering = "featured"
 
@@ -1028,6 +1001,9 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
     http_method_names = ["get", "post", "put", "patch", "delete"]
     pagination_class = RandomPageNumberPagination
 
+    # set when rendering a response that is shared between all users
+    _shared_response = False
+
     def get_queryset(self):
         queryset = super().get_queryset()
 
@@ -1037,23 +1013,24 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
             person = None
 
         if self.action in {"list", "retrieve"}:
-            queryset = queryset.prefetch_related(
-                Prefetch(
-                    "favorite_set",
-                    queryset=Favorite.objects.filter(person=person),
-                    to_attr="user_favorite_set",
-                ),
-                Prefetch(
-                    "subscribe_set",
-                    queryset=Subscribe.objects.filter(person=person),
-                    to_attr="user_subscribe_set",
-                ),
-                Prefetch(
-                    "membership_set",
-                    queryset=Membership.objects.filter(person=person),
-                    to_attr="user_membership_set",
-                ),
-            )
+            if person is not None and not self._shared_response:
+                queryset = queryset.prefetch_related(
+                    Prefetch(
+                        "favorite_set",
+                        queryset=Favorite.objects.filter(person=person),
+                        to_attr="user_favorite_set",
+                    ),
+                    Prefetch(
+                        "subscribe_set",
+                        queryset=Subscribe.objects.filter(person=person),
+                        to_attr="user_subscribe_set",
+                    ),
+                    Prefetch(
+                        "membership_set",
+                        queryset=Membership.objects.filter(person=person),
+                        to_attr="user_membership_set",
+                    ),
+                )
 
             if self.action in {"retrieve"}:
                 queryset = queryset.prefetch_related(
@@ -1072,13 +1049,48 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
                     ),
                 )
 
-        # if there is a search query made by a signed-in user, save it to the database
-        if self.request.query_params.get("search") and isinstance(
-            self.request.user, get_user_model()
-        ):
-            SearchQuery(
-                person=self.request.user, query=self.request.query_params.get("search"),
-            ).save()
+            renderer = getattr(self.request, "accepted_renderer", None)
+            if self.action in {"list"} and getattr(renderer, "format", None) == "xlsx":
+                # the spreadsheet export uses the full club serializer for every club
+                queryset = queryset.select_related("approved_by").prefetch_related(
+                    "advisor_set",
+                    "asset_set",
+                    "badges",
+                    "clubfair_set",
+                    "targetmajor_set",
+                    "targetschool_set",
+                    "targetstudenttype_set",
+                    "targetyear_set",
+                    "testimonials",
+                    Prefetch(
+                        "events",
+                        queryset=Event.objects.filter(
+                            end_time__gte=timezone.now()
+                        ).order_by("start_time"),
+                        to_attr="upcoming_events",
+                    ),
+                    Prefetch(
+                        "membership_set",
+                        queryset=Membership.objects.select_related("person__profile"),
+                    ),
+                    Prefetch(
+                        "membership_set",
+                        queryset=Membership.objects.filter(
+                            role__lte=Membership.ROLE_OFFICER
+                        ).select_related("person"),
+                        to_attr="officer_membership_set",
+                    ),
+                )
+                if person is not None:
+                    queryset = queryset.prefetch_related(
+                        Prefetch(
+                            "membershiprequest_set",
+                            queryset=MembershipRequest.objects.filter(
+                                person=person, withdrew=False
+                            ),
+                            to_attr="user_membershiprequest_set",
+                        )
+                    )
 
         # select subset of clubs if requested
         subset = self.request.query_params.get("in", None)
@@ -1148,7 +1160,7 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
             club.approved = None
             club.approved_by = None
             club.approved_on = None
-            if club.history.filter(approved=True).exists():
+            if club.approved_snapshot:
                 club.ghost = True
 
             club._change_reason = "Mark pending approval due to image change"
@@ -1252,7 +1264,7 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
         ---
         """
         club = self.get_object()
-        child_tree = find_relationship_helper("children_orgs", club, {club.code})
+        child_tree = get_relationship_tree("children_orgs", club)
         return Response(child_tree)
 
     @action(detail=True, methods=["get"])
@@ -1279,7 +1291,7 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
         ---
         """
         club = self.get_object()
-        parent_tree = find_relationship_helper("parent_orgs", club, {club.code})
+        parent_tree = get_relationship_tree("parent_orgs", club)
         return Response(parent_tree)
 
     @action(detail=True, methods=["get"])
@@ -1365,12 +1377,16 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
 
         If a student has indicated that they want to share their bookmarks as well,
         include this information in the results.
+
+        Pass the cursor parameter to paginate the results. The shared bookmarks
+        are included with the last page of subscriptions.
         """
         club = self.get_object()
         subscribes = (
             Subscribe.objects.filter(club=club)
             .select_related("person", "person__profile", "club")
             .prefetch_related("person__profile__school", "person__profile__major")
+            .order_by("created_at", "id")
         )
         shared_bookmarks = (
             Favorite.objects.exclude(
@@ -1380,6 +1396,13 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
             .select_related("person", "person__profile", "club")
             .prefetch_related("person__profile__school", "person__profile__major")
         )
+        page = self.paginate_queryset(subscribes)
+        if page is not None:
+            output = list(SubscribeSerializer(page, many=True).data)
+            if self.paginator.get_next_link() is None:
+                output += SubscribeBookmarkSerializer(shared_bookmarks, many=True).data
+            return self.get_paginated_response(output)
+
         bookmark_serializer = SubscribeBookmarkSerializer(shared_bookmarks, many=True)
         serializer = SubscribeSerializer(subscribes, many=True)
         output = serializer.data + bookmark_serializer.data
@@ -1410,33 +1433,49 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
         ---
         """
         club = self.get_object()
-        lower_bound = timezone.now() - datetime.timedelta(days=30 * 6)
+        lower_bound = get_bucket(
+            timezone.now() - datetime.timedelta(days=30 * 6),
+            AnalyticsRollup.GRANULARITY_DAY,
+        )
         category = self.request.query_params.get("category")
         metric = self.request.query_params.get("metric")
 
         def get_breakdown(category, metric):
+            # each student is counted once for every school that they belong to
             if category == "graduation_year":
+                category_field = "graduation_year"
                 category_join = "person__profile__graduation_year"
+                total_field = "total"
             else:
+                category_field = "school__name"
                 category_join = "person__profile__school__name"
+                total_field = "school_total"
 
+            queryset = AnalyticsRollup.objects.filter(
+                club=club,
+                granularity=AnalyticsRollup.GRANULARITY_DAY,
+                bucket__gte=lower_bound,
+            )
             if metric == "favorite":
-                queryset = Favorite.objects.filter(
-                    club=club, created_at__gte=lower_bound
-                )
+                queryset = queryset.filter(metric=AnalyticsRollup.METRIC_FAVORITE)
             elif metric == "subscribe":
-                queryset = Subscribe.objects.filter(
-                    club=club, created_at__gte=lower_bound
-                )
+                queryset = queryset.filter(metric=AnalyticsRollup.METRIC_SUBSCRIBE)
             else:
-                queryset = ClubVisit.objects.filter(
-                    club=club, created_at__gte=lower_bound, visit_type=1
+                queryset = queryset.filter(
+                    metric=AnalyticsRollup.METRIC_VISIT, visit_type=ClubVisit.CLUB_PAGE,
                 )
 
+            objs = (
+                queryset.values(category_field)
+                .annotate(count=Sum(total_field))
+                .filter(count__gt=0)
+                .order_by(category_field)
+            )
             return {
-                "content": list(
-                    queryset.values(category_join).annotate(count=Count("id"))
-                ),
+                "content": [
+                    {category_join: item[category_field], "count": item["count"]}
+                    for item in objs
+                ],
             }
 
         return Response(get_breakdown(category, metric))
@@ -1445,7 +1484,8 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
     def analytics(self, request, *args, **kwargs):
         """
         Returns a list of all analytics (club visits, favorites,
-        subscriptions) for a club.
+        subscriptions) for a club. Computed from the hourly and daily rollups,
+        which are built using the rollup_analytics command.
         ---
         responses:
             "200":
@@ -1488,39 +1528,42 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
         else:
             end = start + datetime.timedelta(days=1)
 
-        # retrieve data
-        def get_count(queryset):
+        # retrieve data from the hourly or daily rollups
+        if group == "hour":
+            granularity = AnalyticsRollup.GRANULARITY_HOUR
+        else:
+            granularity = AnalyticsRollup.GRANULARITY_DAY
+
+        def get_count(metric, **kwargs):
             """
             Return a json serializable aggregation of
-            analytics data for a specific model.
+            analytics data for a specific metric.
             """
             objs = (
-                queryset.annotate(group=Trunc("created_at", group))
+                AnalyticsRollup.objects.filter(
+                    club=club,
+                    metric=metric,
+                    granularity=granularity,
+                    bucket__gte=get_bucket(start, granularity),
+                    bucket__lte=end,
+                    **kwargs,
+                )
+                .annotate(group=Trunc("bucket", group))
                 .values("group")
-                .annotate(count=Count("id"))
+                .annotate(count=Sum("total"))
+                .filter(count__gt=0)
+                .order_by("group")
             )
-            for item in objs:
-                item["group"] = item["group"].isoformat()
-            return list(objs)
+            return [
+                {"group": item["group"].isoformat(), "count": item["count"]}
+                for item in objs
+            ]
 
         visits_data = get_count(
-            ClubVisit.objects.filter(
-                club=club,
-                created_at__gte=start,
-                created_at__lte=end,
-                visit_type=ClubVisit.CLUB_PAGE,
-            )
-        )
-        favorites_data = get_count(
-            Favorite.objects.filter(
-                club=club, created_at__gte=start, created_at__lte=end
-            )
-        )
-        subscriptions_data = get_count(
-            Subscribe.objects.filter(
-                club=club, created_at__gte=start, created_at__lte=end
-            )
+            AnalyticsRollup.METRIC_VISIT, visit_type=ClubVisit.CLUB_PAGE
         )
+        favorites_data = get_count(AnalyticsRollup.METRIC_FAVORITE)
+        subscriptions_data = get_count(AnalyticsRollup.METRIC_SUBSCRIBE)
 
         max_value = max(
             max([v["count"] for v in visits_data], default=0),
@@ -1877,6 +1920,12 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
                             for club in unregistered_clubs
                         ]
                     )
+                    # bulk_create does not send post_save
+                    invalidate_cache_tags(
+                        "events:fair", *(f"club:{c.id}" for c in unregistered_clubs)
+                    )
+                    for club in unregistered_clubs:
+                        queue_rank_update(club.id, "fair")
                     count += len(unregistered_clubs)
                 elif action == "remove":
                     count += ClubFairRegistration.objects.filter(
@@ -1928,53 +1977,161 @@ class ClubViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
                     "or deregistering for the SAC fair."
                 )
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["shared"] = self._shared_response
+        return context
+
+    def get_user_overlay(self):
+        """
+        Return a mapping of club codes to the user specific fields for the current
+        user. Only clubs that the user has favorited, subscribed to, or is a member
+        of are included. Uses a single query.
+        """
+        person = self.request.user
+        if not person.is_authenticated:
+            return {}
+
+        clubs = (
+            Club.objects.filter(
+                Q(pk__in=Favorite.objects.filter(person=person).values("club"))
+                | Q(pk__in=Subscribe.objects.filter(person=person).values("club"))
+                | Q(pk__in=Membership.objects.filter(person=person).values("club"))
+            )
+            .annotate(
+                user_favorite=Exists(
+                    Favorite.objects.filter(club=OuterRef("pk"), person=person)
+                ),
+                user_subscribe=Exists(
+                    Subscribe.objects.filter(club=OuterRef("pk"), person=person)
+                ),
+                user_role=Subquery(
+                    Membership.objects.filter(
+                        club=OuterRef("pk"), person=person
+                    ).values("role")[:1]
+                ),
+            )
+            .values_list("code", "user_favorite", "user_subscribe", "user_role")
+        )
+
+        return {
+            code: {
+                "is_favorite": favorite,
+                "is_subscribe": subscribe,
+                "is_member": False if role is None else role,
+            }
+            for code, favorite, subscribe, role in clubs
+        }
+
+    def log_search_query(self):
+        """
+        Log the search query of a signed in user. Only the first page of results
+        is logged, so that paginating and exporting results are not counted.
+        """
+        query = self.request.query_params.get("search", "")
+        params = self.request.query_params
+        if (
+            query.strip()
+            and self.request.user.is_authenticated
+            and self.request.accepted_renderer.format == "json"
+            and params.get("page", "1") == "1"
+            and not params.get("cursor")
+        ):
+            search_query_logger.log(self.request.user.id, query)
+
     def list(self, *args, **kwargs):
         """
-        Return a list of all clubs. Responses cached for 1 hour
+        Return a list of all clubs. Responses cached for 24 hours and invalidated
+        when any of the clubs on the page change.
+
+        The cached response is shared between all users and rendered as if it was
+        requested by an anonymous user. The user specific fields (is_favorite,
+        is_subscribe, is_member) are merged in afterwards.
 
-        Responses are only cached for people with specific permissions
+        Responses are not cached for people that can see pending clubs.
         """
-        key = self.request.build_absolute_uri()
-        cached_object = cache.get(key)
+        self.log_search_query()
+
+        user = self.request.user
         if (
-            cached_object
-            and not self.request.user.groups.filter(name="Approvers").exists()
+            self.request.accepted_renderer.format != "json"
+            or user.has_perm("clubs.see_pending_clubs")
+            or user.has_perm("clubs.manage_club")
+            or user.groups.filter(name="Approvers").exists()
         ):
-            return Response(cached_object)
+            return super().list(*args, **kwargs)
 
-        resp = super().list(*args, **kwargs)
-        cache.set(key, resp.data, 60 * 60)
-        return resp
+        key = "clubs:list:{}".format(
+            hashlib.md5(self.request.build_absolute_uri().encode("utf-8")).hexdigest()
+        )
+        cached = cache_get_tagged(key)
+        if cached is None:
+            self._shared_response = True
+            try:
+                queryset = self.filter_queryset(self.get_queryset())
+                page = self.paginate_queryset(queryset)
+                clubs = page if page is not None else queryset
+                data = self.get_serializer(clubs, many=True).data
+                if page is not None:
+                    data = self.get_paginated_response(data).data
+            finally:
+                self._shared_response = False
+
+            cached = {
+                "data": data,
+                "codes": [club.code for club in clubs],
+                "pending": [
+                    club.code for club in clubs if club.ghost and not club.approved
+                ],
+            }
+            cache_set_tagged(
+                key,
+                cached,
+                60 * 60 * 24,
+                ["clubs", "badges", "tags"] + [f"club:{club.id}" for club in clubs],
+            )
+
+        overlay = self.get_user_overlay()
+
+        # members of pending clubs see the unapproved version of their club
+        if any(code in overlay for code in cached["pending"]):
+            return super().list(*args, **kwargs)
+
+        data = cached["data"]
+        results = data["results"] if isinstance(data, dict) else data
+        for code, item in zip(cached["codes"], results):
+            fields = overlay.get(code)
+            if fields is not None:
+                item.update({k: v for k, v in fields.items() if k in item})
+
+        return Response(data)
 
     def retrieve(self, *args, **kwargs):
         """
         Retrieve data about a specific club. Responses cached for 1 hour
         """
-        key = f"clubs:{self.get_object().id}"
-        cached = cache.get(key)
+        club_id = self.get_object().id
+        key = f"clubs:{club_id}"
+        cached = cache_get_tagged(key)
         if cached:
             return Response(cached)
 
         resp = super().retrieve(*args, **kwargs)
-        cache.set(key, resp.data, 60 * 60)
+        cache_set_tagged(key, resp.data, 60 * 60, [f"club:{club_id}", "badges", "tags"])
         return resp
 
     def update(self, request, *args, **kwargs):
         """
-        Invalidate caches
+        Check approval permissions before updating.
         """
         self.check_approval_permission(request)
-        key = f"clubs:{self.get_object().id}"
-        cache.delete(key)
         return super().update(request, *args, **kwargs)
 
     def partial_update(self, request, *args, **kwargs):
         """
-        Invalidate caches
+        Check approval permissions before updating.
         """
         self.check_approval_permission(request)
-        key = f"clubs:{self.get_object().id}"
-        cache.delete(key)
         return super().partial_update(request, *args, **kwargs)
 
     def perform_destroy(self, instance):
@@ -2240,14 +2397,8 @@ class ClubEventViewSet(viewsets.ModelViewSet):
     """
 
     permission_classes = [EventPermission | IsSuperuser]
-    filter_backends = [filters.SearchFilter, ClubsSearchFilter, ClubsOrderingFilter]
-    search_fields = [
-        "name",
-        "club__name",
-        "club__subtitle",
-        "description",
-        "club__code",
-    ]
+    filter_backends = [SearchIndexFilter, ClubsSearchFilter, ClubsOrderingFilter]
+    random_ordering_cache_tags = ["clubs", "events"]
     lookup_field = "id"
     http_method_names = ["get", "post", "put", "patch", "delete"]
     pagination_class = RandomPageNumberPagination
@@ -2523,88 +2674,16 @@ class EventViewSet(ClubEventViewSet):
         if fair:
             fair = int(re.sub(r"\D", "", fair))
 
-        # cache the response for this endpoint with short timeout
         if date is None:
-            key = f"events:fair:directory:{request.user.is_authenticated}:{fair}"
-            cached = cache.get(key)
-            if cached:
-                return Response(cached)
-        else:
-            key = None
+            return Response(get_fair_directory(fair))
 
-        # lookup fair from id
+        # previews for a specific date are not cached
         if fair:
             fair = get_object_or_404(ClubFair, id=fair)
         else:
-            fair = (
-                ClubFair.objects.filter(
-                    end_time__gte=timezone.now() - datetime.timedelta(minutes=30)
-                )
-                .order_by("start_time")
-                .first()
-            )
-        if not date and fair is not None:
-            date = fair.start_time.date()
-
-        now = date or timezone.now()
-        events = Event.objects.filter(
-            type=Event.FAIR, club__badges__purpose="fair", club__badges__fair=fair
-        )
-
-        # filter event range based on the fair times or provide a reasonable fallback
-        if fair is None:
-            events = events.filter(
-                start_time__lte=now + datetime.timedelta(days=7),
-                end_time__gte=now - datetime.timedelta(days=1),
-            )
-        else:
-            events = events.filter(
-                start_time__lte=fair.end_time, end_time__gte=fair.start_time
-            )
-
-        events = events.values_list(
-            "start_time", "end_time", "club__name", "club__code", "club__badges__label"
-        ).distinct()
-        output = {}
-        for event in events:
-            # group by start date
-            ts = int(event[0].replace(second=0, microsecond=0).timestamp())
-            if ts not in output:
-                output[ts] = {
-                    "start_time": event[0],
-                    "end_time": event[1],
-                    "events": {},
-                }
-
-            # group by category
-            category = event[4]
-            if category not in output[ts]["events"]:
-                output[ts]["events"][category] = {
-                    "category": category,
-                    "events": [],
-                }
-
-            output[ts]["events"][category]["events"].append(
-                {"name": event[2], "code": event[3]}
-            )
-        for item in output.values():
-            item["events"] = list(
-                sorted(item["events"].values(), key=lambda cat: cat["category"])
-            )
-            for category in item["events"]:
-                category["events"] = list(
-                    sorted(category["events"], key=lambda e: e["name"].casefold())
-                )
-
-        output = list(sorted(output.values(), key=lambda cat: cat["start_time"]))
-        final_output = {
-            "events": output,
-            "fair": ClubFairSerializer(instance=fair).data,
-        }
-        if key:
-            cache.set(key, final_output, 60 * 5)
-
-        return Response(final_output)
+            fair_id = get_current_fair_id()
+            fair = ClubFair.objects.filter(id=fair_id).first() if fair_id else None
+        return Response(build_fair_directory(fair, date))
 
     @action(detail=False, methods=["get"])
     def owned(self, request, *args, **kwargs):
@@ -2750,7 +2829,7 @@ class MembershipViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         queryset = Membership.objects.filter(
             person=self.request.user, club__archived=False
-        ).prefetch_related("club__tags")
+        )
         person = self.request.user
         queryset = queryset.prefetch_related(
             Prefetch(
@@ -2823,7 +2902,7 @@ class FavoriteViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         queryset = Favorite.objects.filter(
             person=self.request.user, club__archived=False
-        ).prefetch_related("club__tags")
+        )
 
         person = self.request.user
         queryset = queryset.prefetch_related(
@@ -2886,7 +2965,7 @@ class SubscribeViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         queryset = Subscribe.objects.filter(
             person=self.request.user, club__archived=False
-        ).prefetch_related("club__tags")
+        )
 
         person = self.request.user
         queryset = queryset.prefetch_related(
@@ -2929,6 +3008,18 @@ class ClubVisitViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return ClubVisit.objects.filter(person=self.request.user, club__archived=False)
 
+    def perform_create(self, serializer):
+        """
+        Add the visit to the visit buffer instead of writing it immediately.
+        """
+        data = serializer.validated_data
+        visit_buffer.add(
+            data["club"].id,
+            data["person"].id,
+            data.get("visit_type", ClubVisit.CLUB_PAGE),
+            serializer.get_ip(),
+        )
+
     def get_serializer_class(self):
         if self.action == "create":
             return UserClubVisitWriteSerializer
@@ -2946,6 +3037,54 @@ class SearchQueryViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     http_method_names = ["get"]
 
+    @action(detail=False, methods=["get"], permission_classes=[IsSuperuser])
+    def popular(self, request, *args, **kwargs):
+        """
+        Return the most popular search queries over the last few days,
+        computed from the daily search query counts.
+        ---
+        parameters:
+            - name: days
+              in: query
+              type: integer
+            - name: limit
+              in: query
+              type: integer
+        responses:
+            "200":
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items:
+                                type: object
+                                properties:
+                                    query:
+                                        type: string
+                                    count:
+                                        type: integer
+        ---
+        """
+        try:
+            days = int(request.query_params.get("days", 30))
+            limit = min(int(request.query_params.get("limit", 25)), 1000)
+        except ValueError:
+            return Response(
+                {"detail": "The days and limit parameters must be integers."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        start = timezone.localdate() - datetime.timedelta(days=days)
+        stats = (
+            SearchQueryStat.objects.filter(date__gt=start)
+            .values("query")
+            .annotate(total=Sum("count"))
+            .order_by("-total", "query")[:limit]
+        )
+        return Response(
+            [{"query": item["query"], "count": item["total"]} for item in stats]
+        )
+
     def get_queryset(self):
         if self.request.user.is_superuser:
             return SearchQuery.objects.all()
@@ -3076,6 +3215,7 @@ class MemberViewSet(XLSXFormatterMixin, viewsets.ModelViewSet):
     permission_classes = [MemberPermission | IsSuperuser]
     http_method_names = ["get", "post", "put", "patch", "delete"]
     lookup_field = "person__username"
+    pagination_class = OptionalPageNumberPagination
 
     def get_queryset(self):
         return (
@@ -3525,13 +3665,14 @@ class UserPermissionAPIView(APIView):
             if key in {"clubs.manage_club", "clubs.delete_club"}:
                 perm_checker = ClubPermission()
                 view = FakeView("destroy" if key == "clubs.delete_club" else "update")
-                objs = Club.objects.filter(code__in=values)
+                objs = Club.objects.filter(code__in=values).only("id", "code")
                 global_perm = perm_checker.has_permission(request, view)
-                for obj in objs:
-                    perm = f"{key}:{obj.code}"
-                    ret[perm] = global_perm and perm_checker.has_object_permission(
-                        request, view, obj
-                    )
+                if global_perm:
+                    results = perm_checker.has_object_permissions(request, view, objs)
+                else:
+                    results = {obj.code: False for obj in objs}
+                for code, allowed in results.items():
+                    ret[f"{key}:{code}"] = allowed
 
         return Response({"permissions": ret})
 
@@ -3588,6 +3729,85 @@ def generate_zoom_password():
     return "".join(secrets.choice(alphabet) for i in range(10))
 
 
+class RequestProfileAPIView(APIView):
+    """
+    get: Return the recorded request profiles aggregated by view, ordered by
+    the total time spent in the database. Profiles are only recorded if
+    request profiling is enabled.
+
+    delete: Clear the recorded request profiles.
+    """
+
+    permission_classes = [IsSuperuser]
+
+    def get(self, request):
+        """
+        ---
+        responses:
+            "200":
+                content:
+                    application/json:
+                        schema:
+                            type: object
+                            properties:
+                                enabled:
+                                    type: boolean
+                                views:
+                                    type: array
+                                    items:
+                                        type: object
+                                        properties:
+                                            view:
+                                                type: string
+                                            requests:
+                                                type: integer
+                                            queries_avg:
+                                                type: number
+                                            queries_max:
+                                                type: integer
+                                            sql_time_total:
+                                                type: number
+                                            sql_time_avg:
+                                                type: number
+                                            serializer_time_avg:
+                                                type: number
+                                            time_avg:
+                                                type: number
+                                            size_avg:
+                                                type: number
+                                            duplicates:
+                                                type: array
+                                                items:
+                                                    type: object
+                                                    properties:
+                                                        sql:
+                                                            type: string
+                                                        count:
+                                                            type: integer
+                                            last_seen:
+                                                type: string
+                                                format: date-time
+        ---
+        """
+        return Response(
+            {
+                "enabled": settings.REQUEST_PROFILING,
+                "views": profile_buffer.get_summary(),
+            }
+        )
+
+    def delete(self, request):
+        """
+        ---
+        responses:
+            "204":
+                content: {}
+        ---
+        """
+        profile_buffer.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class MeetingZoomWebhookAPIView(APIView):
     """
     get: Given an event id, return the number of people on the Zoom call.
@@ -3632,48 +3852,19 @@ class MeetingZoomWebhookAPIView(APIView):
                                         the meeting.
         ---
         """
-        event_id = request.query_params.get("event")
+        try:
+            event_id = int(request.query_params.get("event"))
+        except (TypeError, ValueError):
+            event_id = None
 
-        time_query = (
-            ZoomMeetingVisit.objects.filter(
-                event__id=event_id, leave_time__isnull=False
-            )
-            .annotate(
-                time=ExpressionWrapper(
-                    F("leave_time") - F("join_time"), DurationField()
-                )
-            )
-            .order_by("time")
-        )
-        time_index = time_query.count()
-        if time_index > 0:
-            time_index //= 2
-            median_time = time_query[time_index].time
-        else:
-            median_time = 0
+        summary = None
+        if event_id is not None:
+            summary = get_live_event_summary([event_id]).get(event_id)
 
-        return Response(
-            {
-                "attending": ZoomMeetingVisit.objects.filter(
-                    event__id=event_id, leave_time__isnull=True
-                ).count(),
-                "attended": ZoomMeetingVisit.objects.filter(
-                    event__id=event_id, leave_time__isnull=False
-                )
-                .values("person")
-                .distinct()
-                .count(),
-                "officers": ZoomMeetingVisit.objects.filter(
-                    event__id=event_id,
-                    leave_time__isnull=True,
-                    person=F("event__club__membership__person"),
-                )
-                .values("person")
-                .distinct()
-                .count(),
-                "time": median_time,
-            }
-        )
+        # events that do not exist have not been attended by anyone
+        if summary is None:
+            summary = {"attending": 0, "officers": 0, "attended": 0, "time": 0}
+        return Response(summary)
 
     def post(self, request):
         # security check to make sure request contains zoom provided token
@@ -3689,7 +3880,6 @@ class MeetingZoomWebhookAPIView(APIView):
                 )
 
         action = request.data.get("event")
-        event_id = None
         if action == "meeting.participant_joined":
             email = (
                 request.data.get("payload", {})
@@ -3707,10 +3897,9 @@ class MeetingZoomWebhookAPIView(APIView):
             meeting_id = (
                 request.data.get("payload", {}).get("object", {}).get("id", None)
             )
-            regex = (
-                rf"https?:\/\/([A-z]*\.)?zoom\.us/[^\/]*\/{meeting_id}(\?pwd=[A-z,0-9]*)?"
+            event_id = (
+                get_zoom_event_id(str(meeting_id)) if meeting_id is not None else None
             )
-            event = Event.objects.filter(url__regex=regex).first()
 
             participant_id = (
                 request.data.get("payload", {})
@@ -3725,15 +3914,15 @@ class MeetingZoomWebhookAPIView(APIView):
                 .get("join_time", None)
             )
 
-            if event:
-                ZoomMeetingVisit.objects.create(
+            if event_id is not None:
+                visit = ZoomMeetingVisit.objects.create(
                     person=person,
-                    event=event,
+                    event_id=event_id,
                     meeting_id=meeting_id,
                     participant_id=participant_id,
                     join_time=join_time,
                 )
-                event_id = event.id
+                record_zoom_visit(visit)
         elif action == "meeting.participant_left":
             meeting_id = (
                 request.data.get("payload", {}).get("object", {}).get("id", None)
@@ -3763,14 +3952,9 @@ class MeetingZoomWebhookAPIView(APIView):
             if meeting is not None:
                 meeting.leave_time = leave_time
                 meeting.save()
-                event_id = meeting.event.id
-
-        if event_id is not None:
-            channel_layer = get_channel_layer()
-            if channel_layer is not None:
-                async_to_sync(channel_layer.group_send)(
-                    f"events-live-{event_id}", {"type": "join_leave", "event": action}
-                )
+                # the times in the payload are strings
+                meeting.refresh_from_db(fields=["join_time", "leave_time"])
+                record_zoom_visit(meeting)
 
         return Response({"success": True})
 
@@ -4299,7 +4483,7 @@ class MemberInviteViewSet(viewsets.ModelViewSet):
         invite = self.get_object()
 
         if request.user.is_authenticated:
-            membership = find_membership_helper(request.user, invite.club)
+            membership = get_permission_resolver(request).get_membership(invite.club)
             is_officer = (
                 membership is not None and membership.role <= Membership.ROLE_OFFICER
             )
@@ -4478,9 +4662,6 @@ class UserViewSet(viewsets.ModelViewSet):
             user=self.request.user, application=application, committee=committee,
         )
 
-        key = f"applicationsubmissions:{application.id}"
-        cache.delete(key)
-
         for question_pk in questions:
             question = ApplicationQuestion.objects.filter(pk=question_pk).first()
             question_type = question.question_type
@@ -4715,8 +4896,7 @@ class ClubApplicationViewSet(viewsets.ModelViewSet):
 
         if not dry_run:
             # Invalidate submission viewset cache
-            key = f"applicationsubmissions:{app.id}"
-            cache.delete(key)
+            invalidate_cache_tags(f"application:{app.id}")
 
         email_type = self.request.data.get("email_type")["id"]
 
@@ -4957,6 +5137,9 @@ class ApplicationSubmissionViewSet(viewsets.ModelViewSet):
     permission_classes = [ClubSensitiveItemPermission | IsSuperuser]
     http_method_names = ["get", "post"]
 
+    # number of submissions loaded at a time when exporting
+    export_chunk_size = 500
+
     def get_queryset(self):
         # Use a raw SQL query to obtain the most recent (user, committee) pairs
         # of application submissions for a specific application.
@@ -5005,24 +5188,24 @@ class ApplicationSubmissionViewSet(viewsets.ModelViewSet):
         app_id = self.kwargs["application_pk"]
         key = f"applicationsubmissions:{app_id}"
 
-        cached = cache.get(key)
+        cached = cache_get_tagged(key)
         if cached is not None:
             return Response(cached)
         else:
             serializer = self.get_serializer_class()
             qs = self.get_queryset()
             data = serializer(qs, many=True).data
-            cache.set(key, data, 60 * 60)
+            cache_set_tagged(key, data, 60 * 60 * 24, [f"application:{app_id}"])
 
         return Response(data)
 
-    @method_decorator(cache_page(60 * 60 * 2))
     @action(detail=False, methods=["get"])
     def export(self, *args, **kwargs):
         """
         Given some application submissions, export them to CSV.
 
-        Cached for 2 hours.
+        The rows are streamed in chunks of submissions, so that the memory usage and
+        the number of queries per chunk do not depend on the number of submissions.
         ---
         requestBody:
             content:
@@ -5045,43 +5228,29 @@ class ApplicationSubmissionViewSet(viewsets.ModelViewSet):
         ---
         """
         app_id = int(self.kwargs["application_pk"])
-        data = (
-            ApplicationSubmission.objects.filter(
-                application=app_id,
-                created_at__in=RawSQL(
-                    """SELECT recent_time
-                    FROM
-                    (SELECT user_id,
-                            committee_id,
-                            application_id,
-                            max(created_at) recent_time
-                        FROM clubs_applicationsubmission
-                        WHERE NOT archived
-                        GROUP BY user_id,
-                                committee_id, application_id) recent_subs""",
-                    (),
-                ),
-                archived=False,
-            )
-            .select_related("user__profile", "committee", "application__club")
-            .prefetch_related(
-                Prefetch(
-                    "responses",
-                    queryset=ApplicationQuestionResponse.objects.select_related(
-                        "multiple_choice", "question"
-                    ),
-                ),
-                "responses__question__committees",
-                "responses__question__multiple_choice",
-            )
-        )
-        df = pd.DataFrame(ApplicationSubmissionCSVSerializer(data, many=True).data)
-        resp = HttpResponse(
+        application = ClubApplication.objects.filter(pk=app_id).first()
+        queryset = self.get_queryset().order_by("pk")
+        pks = list(queryset.values_list("pk", flat=True))
+
+        serializer = ApplicationSubmissionCSVSerializer()
+        columns = serializer.get_columns(application) if application else []
+
+        def rows():
+            yield [""] + columns
+            index = 0
+            for start in range(0, len(pks), self.export_chunk_size):
+                chunk = pks[start : start + self.export_chunk_size]
+                for submission in queryset.filter(pk__in=chunk):
+                    row = serializer.to_representation(submission)
+                    yield [index] + [row.get(column, "") for column in columns]
+                    index += 1
+
+        writer = csv.writer(Echo())
+        return StreamingHttpResponse(
+            (writer.writerow(row) for row in rows()),
             content_type="text/csv",
             headers={"Content-Disposition": "attachment;filename=submissions.csv"},
         )
-        df.to_csv(index=True, path_or_buf=resp)
-        return resp
 
     @action(detail=False, methods=["post"])
     def status(self, *args, **kwargs):
@@ -5118,15 +5287,14 @@ class ApplicationSubmissionViewSet(viewsets.ModelViewSet):
             status in map(lambda x: x[0], ApplicationSubmission.STATUS_TYPES)
             and len(submission_pks) > 0
         ):
-            # Invalidate submission viewset cache
             submissions = ApplicationSubmission.objects.filter(pk__in=submission_pks)
             app_id = submissions.first().application.id if submissions.first() else None
             if not app_id:
                 return Response({"detail": "No submissions found"})
-            key = f"applicationsubmissions:{app_id}"
-            cache.delete(key)
 
+            # bulk updates do not send signals, invalidate submission viewset cache
             submissions.update(status=status)
+            invalidate_cache_tags(f"application:{app_id}")
 
             return Response(
                 {
@@ -5183,8 +5351,7 @@ class ApplicationSubmissionViewSet(viewsets.ModelViewSet):
         )
         if not app_id:
             return Response({"detail": "No submissions found"})
-        key = f"applicationsubmissions:{app_id}"
-        cache.delete(key)
+        invalidate_cache_tags(f"application:{app_id}")
 
         for idx, pk in enumerate(pks):
             obj = submission_objs.filter(pk=pk).first()
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "clubs.profiling.ProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -250,6 +251,49 @@ SOCIAL_AUTH_LOGIN_REDIRECT_URL = "/"
 ZOOM_VERIFICATION_TOKEN = os.environ.get("ZOOM_VERIFICATION_TOKEN")
 
 
+# Background task settings
+
+# Run deferred work in background threads
+# If disabled, the work is performed synchronously when the transaction commits
+BACKGROUND_TASKS = True
+
+# Seconds to wait for more changes before incrementally recomputing club rankings
+RANK_UPDATE_DELAY = 30
+
+# Number of club visits to buffer before writing them to the database
+VISIT_BUFFER_SIZE = 500
+
+# Maximum number of seconds to buffer club visits before writing them
+VISIT_BUFFER_DELAY = 15
+
+# Seconds in which a search query replaces the previous query that it extends
+SEARCH_QUERY_WINDOW = 10
+
+# Number of club calendars that are downloaded at the same time
+ICS_IMPORT_WORKERS = 8
+
+# Seconds to wait for a club calendar to respond
+ICS_IMPORT_TIMEOUT = 15
+
+# Seconds to wait for more participants to join or leave a Zoom meeting before
+# sending the attendance counts to the students viewing the event
+LIVE_EVENT_BROADCAST_DELAY = 2
+
+
+# Request profiling settings
+
+# Record the queries and serializer time of requests, see /api/profiling/
+REQUEST_PROFILING = os.environ.get("REQUEST_PROFILING", "false").lower() == "true"
+
+# Fraction of requests that are profiled
+REQUEST_PROFILING_SAMPLE_RATE = float(
+    os.environ.get("REQUEST_PROFILING_SAMPLE_RATE", "1.0")
+)
+
+# Number of request profiles kept in the cache
+REQUEST_PROFILING_BUFFER_SIZE = 1000
+
+
 # Phone number field
 
 PHONENUMBER_DB_FORMAT = "NATIONAL"
@@ -15,6 +15,9 @@ CACHES = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
 
 del PLATFORM_ACCOUNTS["REDIRECT_URI"]
 
+# Perform deferred work synchronously
+BACKGROUND_TASKS = False
+
 # Use a dummy backend for sending emails
 EMAIL_BACKEND = "django.core.mail.backends.dummy.EmailBackend"
 
@@ -11,29 +11,42 @@ import tempfile
 import uuid
 from unittest import mock
 
+import requests
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.core import mail
+from django.core.cache import cache
 from django.core.management import call_command
 from django.core.management.base import CommandError
-from django.test import TestCase
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from ics import Calendar
 from ics import Event as ICSEvent
 
+from clubs.management.commands.rank import RankingEngine
+from clubs.management.commands.rollup_analytics import apply_rollup_counts
 from clubs.models import (
+    AnalyticsRollup,
+    Badge,
     Club,
     ClubApplication,
     ClubFair,
+    ClubRank,
+    ClubVisit,
     Event,
     Favorite,
     Membership,
     MembershipInvite,
+    School,
     Subscribe,
     Tag,
     get_mail_type_annotation,
 )
+from clubs.ranking import rank_update_queue
 from clubs.utils import fuzzy_lookup_club
 
 
@@ -43,15 +56,20 @@ def mocked_requests_get(time):
     starting at the specified start time.
     """
 
-    def fake_request(url, *args):
+    def fake_request(url, *args, **kwargs):
         class MockResponse:
             def __init__(self, content, status_code):
                 self.text = str(content)
                 self.status_code = status_code
+                self.headers = {}
 
             def text(self):
                 return self.text
 
+            def raise_for_status(self):
+                if self.status_code >= 400:
+                    raise requests.exceptions.HTTPError(self.status_code)
+
         cal = Calendar()
         event = ICSEvent()
         event.name = "A test event"
@@ -131,7 +149,8 @@ class ImportCalendarTestCase(TestCase):
         a arbitrary file downloaded from the internet.
         """
         with mock.patch(
-            "requests.get", return_value=mock.Mock(text=SAMPLE_ICS, status_code=200)
+            "requests.get",
+            return_value=mock.Mock(text=SAMPLE_ICS, status_code=200, headers={}),
         ):
             call_command("import_calendar_events")
 
@@ -149,7 +168,9 @@ class ImportCalendarTestCase(TestCase):
         with mock.patch("requests.get", side_effect=mocked_requests_get(now)) as m:
             call_command("import_calendar_events")
 
-            m.assert_called_with(self.club1.ics_import_url)
+            m.assert_called_with(
+                self.club1.ics_import_url, headers={}, timeout=mock.ANY
+            )
 
         desired = self.club1.events.first()
 
@@ -172,7 +193,9 @@ class ImportCalendarTestCase(TestCase):
         with mock.patch("requests.get", side_effect=mocked_requests_get(now)) as m:
             call_command("import_calendar_events")
 
-            m.assert_called_with(self.club1.ics_import_url)
+            m.assert_called_with(
+                self.club1.ics_import_url, headers={}, timeout=mock.ANY
+            )
 
         # ensure that only one event exists
         self.assertEqual(self.club1.events.count(), 1)
@@ -184,11 +207,70 @@ class ImportCalendarTestCase(TestCase):
         with mock.patch("requests.get", side_effect=mocked_requests_get(now)) as m:
             call_command("import_calendar_events")
 
-            m.assert_called_with(self.club1.ics_import_url)
+            m.assert_called_with(
+                self.club1.ics_import_url, headers={}, timeout=mock.ANY
+            )
 
         # ensure that only one event exists
         self.assertEqual(self.club1.events.count(), 1)
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_import_calendar_conditional(self):
+        """
+        Test that calendars are imported in bulk and are not imported again if the
+        server reports that they have not changed.
+        """
+        cache.clear()
+        calendar = Calendar(SAMPLE_ICS)
+        for i in range(10):
+            event = ICSEvent()
+            event.name = f"Event {i}"
+            event.description = "Join at https://upenn.zoom.us/j/123456789"
+            event.begin = timezone.now() + datetime.timedelta(days=i)
+            event.end = event.begin + datetime.timedelta(hours=1)
+            calendar.events.add(event)
+        response = mock.Mock(
+            text=str(calendar), status_code=200, headers={"ETag": '"abc"'}
+        )
+
+        with mock.patch("requests.get", return_value=response) as m, mock.patch(
+            "clubs.calendars.queue_rank_update"
+        ) as rank:
+            with CaptureQueriesContext(connection) as queries:
+                call_command("import_calendar_events", stdout=io.StringIO())
+            m.assert_called_with(
+                self.club1.ics_import_url, headers={}, timeout=mock.ANY
+            )
+        # bulk saved events do not send signals, so rankings are updated directly
+        rank.assert_called_once_with(self.club1.id, "events")
+        self.assertEqual(self.club1.events.count(), 11)
+        self.assertEqual(
+            self.club1.events.filter(zoom_meeting_id="123456789").count(), 10
+        )
+        # the number of queries does not depend on the number of events
+        self.assertLessEqual(len(queries), 8, queries.captured_queries)
+
+        # unchanged calendars are skipped
+        with mock.patch(
+            "requests.get", return_value=mock.Mock(status_code=304, headers={})
+        ) as m:
+            with self.assertNumQueries(1):
+                call_command("import_calendar_events", stdout=io.StringIO())
+            m.assert_called_with(
+                self.club1.ics_import_url,
+                headers={"If-None-Match": '"abc"'},
+                timeout=mock.ANY,
+            )
+        self.assertEqual(self.club1.events.count(), 11)
+
+        # changed calendars are imported again, keeping existing events
+        ids = set(self.club1.events.values_list("id", flat=True))
+        with mock.patch("requests.get", return_value=response):
+            call_command("import_calendar_events", stdout=io.StringIO())
+        self.assertEqual(set(self.club1.events.values_list("id", flat=True)), ids)
+
 
 class SendInvitesTestCase(TestCase):
     def setUp(self):
@@ -489,6 +571,78 @@ class PopulateTestCase(TestCase):
         # ensure ranking works properly
         call_command("rank")
 
+    def get_synthetic_fingerprint(self):
+        return (
+            list(Club.objects.order_by("code").values_list("code", "name", "approved")),
+            sorted(
+                Membership.objects.values_list("person__username", "club__code", "role")
+            ),
+            sorted(Favorite.objects.values_list("person__username", "club__code")),
+            sorted(Event.objects.values_list("code", "type", "ics_uuid")),
+        )
+
+    def test_populate_synthetic(self):
+        options = {
+            "scale": 1,
+            "seed": 42,
+            "visits_per_club": 5,
+            "submissions_per_application": 3,
+            "batch_size": 100,
+            "stdout": io.StringIO(),
+        }
+        savepoint = transaction.savepoint()
+        call_command("populate", **options)
+
+        self.assertEqual(
+            Club.objects.filter(code__startswith="synthetic-club-").count(), 100
+        )
+        self.assertEqual(
+            get_user_model().objects.filter(username__startswith="synthetic").count(),
+            1000,
+        )
+        self.assertEqual(ClubVisit.objects.count(), 500)
+        self.assertTrue(Membership.objects.exists())
+        self.assertTrue(Favorite.objects.exists())
+        self.assertTrue(Event.objects.filter(type=Event.FAIR).exists())
+        self.assertTrue(ClubApplication.objects.exists())
+
+        # every synthetic user has a profile and the clubs have cards
+        self.assertFalse(
+            get_user_model()
+            .objects.filter(username__startswith="synthetic", profile__isnull=True)
+            .exists()
+        )
+        self.assertFalse(Club.objects.filter(card={}).exists())
+
+        # every club with members has exactly one owner
+        owners = (
+            Membership.objects.filter(role=Membership.ROLE_OWNER)
+            .values("club")
+            .annotate(count=Count("id"))
+        )
+        self.assertEqual({row["count"] for row in owners}, {1})
+        self.assertEqual(
+            len(owners), Membership.objects.values("club").distinct().count()
+        )
+
+        # activity is concentrated on the most popular clubs
+        counts = list(
+            Club.objects.order_by("id")
+            .annotate(count=Count("favorite"))
+            .values_list("count", flat=True)
+        )
+        self.assertGreater(sum(counts[:10]), sum(counts[-10:]))
+
+        # the script refuses to generate the data twice
+        with self.assertRaises(CommandError):
+            call_command("populate", **options)
+
+        # the same seed produces the same dataset
+        fingerprint = self.get_synthetic_fingerprint()
+        transaction.savepoint_rollback(savepoint)
+        call_command("populate", **options)
+        self.assertEqual(self.get_synthetic_fingerprint(), fingerprint)
+
 
 class RankTestCase(TestCase):
     def test_rank(self):
@@ -530,11 +684,213 @@ class RankTestCase(TestCase):
         )
 
         # run the rank command
-        call_command("rank")
+        with CaptureQueriesContext(connection) as ctx:
+            call_command("rank", stdout=io.StringIO())
 
         for club in Club.objects.all():
             self.assertGreater(club.rank, 0)
 
+        # rankings are computed with a fixed number of queries
+        self.assertLess(len(ctx.captured_queries), 25)
+
+        # first club has tags and an event today
+        club = Club.objects.get(code="club-1")
+        scores = RankingEngine(now).compute([club])[club.id]
+        self.assertEqual(scores["tags"], 15)
+        self.assertEqual(scores["events"], 30)
+        self.assertEqual(scores["profile"], 15 + 5 - 30)
+
+    def test_incremental_rank(self):
+        club = Club.objects.create(
+            code="incremental", name="Incremental Club", active=True
+        )
+        call_command("rank", stdout=io.StringIO())
+        club.refresh_from_db()
+        breakdown = ClubRank.objects.get(club=club)
+        self.assertEqual(breakdown.members, 0)
+        initial_rank = club.rank
+
+        # changes to members only recompute that component
+        users = [
+            get_user_model().objects.create_user(f"user{i}", f"user{i}@upenn.edu")
+            for i in range(3)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in users:
+                Membership.objects.create(
+                    person=user, club=club, role=Membership.ROLE_OFFICER
+                )
+
+        breakdown.refresh_from_db()
+        self.assertEqual(breakdown.members, 15)
+        club.refresh_from_db()
+        self.assertEqual(club.rank, initial_rank + 15)
+
+        # clubs without a breakdown have all components computed
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Club.objects.create(code="other", name="Other Club", active=True)
+        other.refresh_from_db()
+        self.assertTrue(ClubRank.objects.filter(club=other).exists())
+        self.assertNotEqual(other.rank, 0)
+
+    @override_settings(
+        BACKGROUND_TASKS=True,
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    def test_rank_update_queue(self):
+        """
+        Test that clubs waiting for a ranking update are kept in the cache, so that
+        they are updated by any process or by the rank command.
+        """
+        cache.clear()
+        club = Club.objects.create(code="queued", name="Queued Club", active=True)
+        call_command("rank", stdout=io.StringIO())
+        users = [
+            get_user_model().objects.create_user(f"user{i}", f"user{i}@upenn.edu")
+            for i in range(3)
+        ]
+
+        with mock.patch("clubs.ranking.threading.Timer") as timer:
+            with self.captureOnCommitCallbacks(execute=True):
+                for user in users:
+                    Membership.objects.create(
+                        person=user, club=club, role=Membership.ROLE_OFFICER
+                    )
+        timer.assert_called_once()
+        self.assertEqual(cache.get(rank_update_queue.key), {club.id: {"members"}})
+
+        # a new queue, as in another process, updates the pending clubs
+        type(rank_update_queue)().flush()
+        self.assertIsNone(cache.get(rank_update_queue.key))
+        self.assertEqual(ClubRank.objects.get(club=club).members, 15)
+
+        # the rank command drains the queue, since it recomputes every club
+        with mock.patch("clubs.ranking.threading.Timer"):
+            with self.captureOnCommitCallbacks(execute=True):
+                club.testimonials.create(text="Great club!")
+        self.assertIsNotNone(cache.get(rank_update_queue.key))
+        call_command("rank", stdout=io.StringIO())
+        self.assertIsNone(cache.get(rank_update_queue.key))
+
+
+class RollupAnalyticsTestCase(TestCase):
+    def test_rollup_analytics(self):
+        """
+        Test that rebuilding the analytics rollups matches the incremental updates.
+        """
+        club = Club.objects.create(code="one", name="One", active=True)
+        school = School.objects.create(name="Wharton", is_graduate=False)
+        other_school = School.objects.create(name="Engineering", is_graduate=False)
+        for i in range(3):
+            user = get_user_model().objects.create_user(
+                f"user{i}", f"user{i}@upenn.edu", "test"
+            )
+            user.profile.graduation_year = 2024 + i
+            user.profile.save()
+            user.profile.school.add(school)
+            if i == 0:
+                user.profile.school.add(other_school)
+            ClubVisit.objects.create(person=user, club=club)
+            ClubVisit.objects.create(person=user, club=club)
+            Subscribe.objects.create(person=user, club=club)
+
+        def get_totals():
+            return sorted(
+                AnalyticsRollup.objects.values_list(
+                    "metric",
+                    "visit_type",
+                    "school",
+                    "graduation_year",
+                    "granularity",
+                    "bucket",
+                    "total",
+                    "school_total",
+                )
+            )
+
+        incremental = get_totals()
+        self.assertTrue(incremental)
+
+        # students in multiple schools are only counted once towards the total
+        for granularity in ["hour", "day"]:
+            rollups = AnalyticsRollup.objects.filter(
+                metric="visit", granularity=granularity
+            )
+            self.assertEqual(sum(rollups.values_list("total", flat=True)), 6)
+            self.assertEqual(sum(rollups.values_list("school_total", flat=True)), 8)
+
+        AnalyticsRollup.objects.all().delete()
+        call_command("rollup_analytics", stdout=io.StringIO())
+        self.assertEqual(get_totals(), incremental)
+
+    def test_apply_rollup_counts(self):
+        """
+        Test that applying counts for the same key updates a single rollup, even
+        if the rollup is created concurrently.
+        """
+        club = Club.objects.create(code="one", name="One", active=True)
+        bucket = timezone.now().replace(minute=0, second=0, microsecond=0)
+        key = (club.id, None, None, None, AnalyticsRollup.GRANULARITY_HOUR, bucket)
+        rollups = AnalyticsRollup.objects.filter(club=club)
+
+        apply_rollup_counts(AnalyticsRollup.METRIC_FAVORITE, {key: [1, 1]})
+        apply_rollup_counts(AnalyticsRollup.METRIC_FAVORITE, {key: [2, 3]})
+        self.assertEqual(list(rollups.values_list("total", "school_total")), [(3, 4)])
+
+        # a duplicate row for the same key cannot be created
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            AnalyticsRollup.objects.create(
+                club=club,
+                metric=AnalyticsRollup.METRIC_FAVORITE,
+                granularity=AnalyticsRollup.GRANULARITY_HOUR,
+                bucket=bucket,
+            )
+
+        # another request creates the row after this request found it missing
+        update = QuerySet.update
+        calls = []
+
+        def racing_update(queryset, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", racing_update):
+            apply_rollup_counts(AnalyticsRollup.METRIC_FAVORITE, {key: [1, 1]})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(list(rollups.values_list("total", "school_total")), [(4, 5)])
+
+
+class SyncTestCase(TestCase):
+    def test_sync_badges(self):
+        """
+        Test that badges are synchronized with the club hierarchy.
+        """
+        parent = Club.objects.create(code="parent", name="Parent")
+        child = Club.objects.create(code="child", name="Child")
+        grandchild = Club.objects.create(code="grandchild", name="Grandchild")
+        other = Club.objects.create(code="other", name="Other")
+        child.parent_orgs.add(parent)
+        grandchild.parent_orgs.add(child)
+
+        badge = Badge.objects.create(label="Parent", org=parent)
+        other.badges.add(badge)
+
+        call_command("sync", stdout=io.StringIO())
+
+        # badges are added to all children of the organization
+        self.assertEqual(
+            set(badge.club_set.values_list("code", flat=True)),
+            {"parent", "child", "grandchild", "other"},
+        )
+
+        # clubs with the badge become children of the organization
+        self.assertEqual(list(other.parent_orgs.all()), [parent])
+        self.assertFalse(grandchild.parent_orgs.filter(pk=parent.pk).exists())
+
 
 class RenewalTestCase(TestCase):
     def test_renewal(self):
@@ -85,6 +85,22 @@ class EventTestCase(TestCase):
     def test_str(self):
         self.assertEqual(str(self.event), self.event.name)
 
+    def test_zoom_meeting_id(self):
+        self.assertIsNone(self.event.zoom_meeting_id)
+        for url, meeting_id in [
+            ("https://upenn.zoom.us/j/4880003126?pwd=abc123", "4880003126"),
+            ("https://zoom.us/j/4880003126", "4880003126"),
+            ("http://upenn.zoom.us/s/4880003126/", "4880003126"),
+            ("https://upenn.zoom.us/j/4880003126/extra", None),
+            ("https://zoom.us.example.com/j/4880003126", None),
+            ("https://example.com/j/4880003126", None),
+            (None, None),
+        ]:
+            self.event.url = url
+            self.event.save(update_fields=["url"])
+            self.event.refresh_from_db()
+            self.assertEqual(self.event.zoom_meeting_id, meeting_id, url)
+
 
 class FavoriteTestCase(TestCase):
     def setUp(self):
@@ -0,0 +1,352 @@
+"""
+Query count budgets and benchmarks for the most frequently used API endpoints.
+
+Each endpoint is requested once, the dataset is then doubled in size and the
+endpoint is requested again. The test fails if the endpoint uses more queries
+than its budget or if the number of queries grows with the size of the dataset,
+which usually means that an N+1 query was introduced.
+
+The dataset is small by default so that the suite runs quickly in CI. Set the
+BENCHMARK_SCALE environment variable to seed a realistic dataset, for example
+BENCHMARK_SCALE=100 creates 2000 clubs, 4000 events, 10000 favorites and 40000
+visits per copy of the dataset. Set BENCHMARK_OUTPUT to a file path to write
+the query counts, wall times and peak memory usage of each endpoint as JSON.
+"""
+
+import json
+import os
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from clubs.management.commands.rollup_analytics import rebuild_analytics
+from clubs.models import (
+    ApplicationCommittee,
+    ApplicationMultipleChoice,
+    ApplicationQuestion,
+    ApplicationQuestionResponse,
+    ApplicationSubmission,
+    Badge,
+    Club,
+    ClubApplication,
+    ClubFair,
+    ClubVisit,
+    Event,
+    Favorite,
+    Membership,
+    Profile,
+    Tag,
+    update_club_cards,
+)
+
+
+BENCHMARK_SCALE = max(1, int(os.environ.get("BENCHMARK_SCALE", "1")))
+BENCHMARK_OUTPUT = os.environ.get("BENCHMARK_OUTPUT")
+
+# number of objects created per unit of scale
+CLUBS = 20
+EVENTS_PER_CLUB = 2
+FAVORITES_PER_CLUB = 5
+VISITS_PER_CLUB = 20
+SUBMISSIONS = 10
+
+# maximum number of queries for each endpoint
+QUERY_BUDGETS = {
+    "clubs-list": 2,
+    "clubs-list-authenticated": 8,
+    "clubs-detail": 26,
+    "clubs-export": 30,
+    "clubs-analytics": 8,
+    "events-list": 4,
+    "events-fair": 4,
+    "submissions-list": 8,
+    "submissions-export": 10,
+}
+
+
+class BenchmarkTestCase(TestCase):
+    """
+    Benchmarks for the hot API endpoints, see the module documentation.
+    """
+
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.superuser = get_user_model().objects.create_superuser(
+            "bench", "bench@example.com", "test"
+        )
+        cls.user = get_user_model().objects.create_user(
+            "benchuser", "benchuser@example.com", "test"
+        )
+        cls.tag = Tag.objects.create(name="Benchmark")
+        cls.fair = ClubFair.objects.create(
+            name="Benchmark Fair",
+            start_time=now + timezone.timedelta(days=1),
+            end_time=now + timezone.timedelta(days=2),
+            registration_end_time=now + timezone.timedelta(hours=12),
+        )
+        cls.badge = Badge.objects.create(
+            label="Benchmark Category", purpose="fair", fair=cls.fair
+        )
+
+        cls.club = Club.objects.create(
+            code="benchmark", name="Benchmark Club", approved=True, active=True
+        )
+        cls.application = ClubApplication.objects.create(
+            name="Benchmark Application",
+            club=cls.club,
+            application_start_time=now - timezone.timedelta(days=1),
+            application_end_time=now + timezone.timedelta(days=1),
+            result_release_time=now + timezone.timedelta(days=2),
+        )
+        cls.committee = ApplicationCommittee.objects.create(
+            name="Benchmark Committee", application=cls.application
+        )
+        cls.question = ApplicationQuestion.objects.create(
+            question_type=ApplicationQuestion.FREE_RESPONSE,
+            prompt="Why?",
+            application=cls.application,
+        )
+        cls.choice_question = ApplicationQuestion.objects.create(
+            question_type=ApplicationQuestion.MULTIPLE_CHOICE,
+            prompt="Which?",
+            application=cls.application,
+        )
+        cls.choice = ApplicationMultipleChoice.objects.create(
+            value="This one", question=cls.choice_question
+        )
+
+        cls.seed(0)
+
+    @classmethod
+    def seed(cls, copy):
+        """
+        Create one copy of the benchmark dataset using bulk inserts.
+        """
+        now = timezone.now()
+        prefix = f"bench-{copy}"
+        count = CLUBS * BENCHMARK_SCALE
+
+        users = get_user_model().objects.bulk_create(
+            [
+                get_user_model()(
+                    username=f"{prefix}-user-{i}",
+                    email=f"{prefix}-user-{i}@example.com",
+                    first_name="Bench",
+                    last_name=str(i),
+                )
+                for i in range(max(FAVORITES_PER_CLUB, SUBMISSIONS) * BENCHMARK_SCALE)
+            ]
+        )
+        if not all(user.pk for user in users):
+            users = list(
+                get_user_model().objects.filter(username__startswith=f"{prefix}-user-")
+            )
+        Profile.objects.bulk_create(
+            [Profile(user=user, graduation_year=2025) for user in users]
+        )
+
+        clubs = Club.objects.bulk_create(
+            [
+                Club(
+                    code=f"{prefix}-club-{i}",
+                    name=f"Benchmark Club {copy} {i}",
+                    description="<p>A club used for benchmarks. More text.</p>",
+                    approved=True,
+                    active=True,
+                )
+                for i in range(count)
+            ]
+        )
+        if not all(club.pk for club in clubs):
+            clubs = list(Club.objects.filter(code__startswith=f"{prefix}-club-"))
+        Club.tags.through.objects.bulk_create(
+            [Club.tags.through(club=club, tag=cls.tag) for club in clubs]
+        )
+        Club.badges.through.objects.bulk_create(
+            [Club.badges.through(club=club, badge=cls.badge) for club in clubs]
+        )
+        update_club_cards([club.id for club in clubs])
+
+        Membership.objects.bulk_create(
+            [
+                Membership(person=users[i % len(users)], club=club)
+                for i, club in enumerate(clubs)
+            ]
+        )
+        Event.objects.bulk_create(
+            [
+                Event(
+                    code=f"{prefix}-event-{i}-{j}",
+                    name=f"Benchmark Event {i} {j}",
+                    club=club,
+                    type=Event.FAIR if j == 0 else Event.OTHER,
+                    start_time=cls.fair.start_time,
+                    end_time=cls.fair.end_time,
+                )
+                for i, club in enumerate(clubs)
+                for j in range(EVENTS_PER_CLUB)
+            ]
+        )
+        Favorite.objects.bulk_create(
+            [
+                Favorite(person=users[j], club=club)
+                for club in clubs + [cls.club]
+                for j in range(FAVORITES_PER_CLUB)
+            ]
+        )
+        ClubVisit.objects.bulk_create(
+            [
+                ClubVisit(
+                    person=users[j % len(users)],
+                    club=club,
+                    visit_type=ClubVisit.CLUB_PAGE,
+                    created_at=now - timezone.timedelta(hours=j),
+                )
+                for club in clubs + [cls.club]
+                for j in range(VISITS_PER_CLUB)
+            ]
+        )
+        rebuild_analytics([club.id for club in clubs] + [cls.club.id])
+
+        submissions = ApplicationSubmission.objects.bulk_create(
+            [
+                ApplicationSubmission(
+                    user=users[i], application=cls.application, committee=cls.committee
+                )
+                for i in range(SUBMISSIONS * BENCHMARK_SCALE)
+            ]
+        )
+        if not all(submission.pk for submission in submissions):
+            submissions = list(
+                ApplicationSubmission.objects.filter(
+                    user__username__startswith=f"{prefix}-user-"
+                )
+            )
+        ApplicationQuestionResponse.objects.bulk_create(
+            [
+                ApplicationQuestionResponse(
+                    text="Because", question=cls.question, submission=submission
+                )
+                for submission in submissions
+            ]
+            + [
+                ApplicationQuestionResponse(
+                    question=cls.choice_question,
+                    multiple_choice=cls.choice,
+                    submission=submission,
+                )
+                for submission in submissions
+            ]
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if BENCHMARK_OUTPUT and cls.results:
+            with open(BENCHMARK_OUTPUT, "w") as f:
+                json.dump({"scale": BENCHMARK_SCALE, "results": cls.results}, f)
+
+    def measure(self, url, params=None):
+        """
+        Request an endpoint and return the number of queries, the wall time in
+        seconds and the peak memory usage in bytes.
+        """
+        tracemalloc.start()
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url, params)
+            # exports may be streamed
+            if resp.streaming:
+                content = b"".join(resp.streaming_content)
+            else:
+                content = resp.content
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertIn(resp.status_code, [200], content)
+        return {"queries": len(queries), "time": elapsed, "memory": peak}
+
+    def check_endpoint(self, name, url, params=None):
+        """
+        Ensure that the endpoint stays within its query budget and that the
+        number of queries does not depend on the size of the dataset.
+        """
+        # warm up any per process state, such as content types and permissions
+        self.client.get(url, params)
+
+        budget = QUERY_BUDGETS[name]
+
+        small = self.measure(url, params)
+        self.seed(1)
+        large = self.measure(url, params)
+        self.results[name] = {"small": small, "large": large}
+
+        self.assertLessEqual(
+            small["queries"],
+            budget,
+            f"{name} used {small['queries']} queries, the budget is {budget}",
+        )
+        self.assertEqual(
+            large["queries"],
+            small["queries"],
+            f"{name} used more queries after the dataset was doubled",
+        )
+
+    def test_club_list(self):
+        self.check_endpoint("clubs-list", reverse("clubs-list"))
+
+    def test_club_list_authenticated(self):
+        self.client.login(username=self.user.username, password="test")
+        self.check_endpoint("clubs-list-authenticated", reverse("clubs-list"))
+
+    def test_club_detail(self):
+        self.check_endpoint(
+            "clubs-detail", reverse("clubs-detail", args=(self.club.code,))
+        )
+
+    def test_club_export(self):
+        self.client.login(username=self.superuser.username, password="test")
+        self.check_endpoint("clubs-export", reverse("clubs-list"), {"format": "xlsx"})
+
+    def test_club_analytics(self):
+        self.client.login(username=self.superuser.username, password="test")
+        self.check_endpoint(
+            "clubs-analytics", reverse("clubs-analytics", args=(self.club.code,))
+        )
+
+    def test_event_list(self):
+        self.check_endpoint("events-list", reverse("events-list"))
+
+    def test_event_fair(self):
+        self.check_endpoint(
+            "events-fair", reverse("events-fair"), {"fair": self.fair.id}
+        )
+
+    def test_submission_list(self):
+        self.client.login(username=self.superuser.username, password="test")
+        self.check_endpoint(
+            "submissions-list",
+            reverse(
+                "club-application-submissions-list",
+                args=(self.club.code, self.application.id),
+            ),
+        )
+
+    def test_submission_export(self):
+        self.client.login(username=self.superuser.username, password="test")
+        self.check_endpoint(
+            "submissions-export",
+            reverse(
+                "club-application-submissions-export",
+                args=(self.club.code, self.application.id),
+            ),
+        )
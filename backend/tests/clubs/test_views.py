@@ -1,37 +1,61 @@
+import csv
 import datetime
 import io
 import json
 import os
+import time
 from collections import Counter
 from unittest.mock import MagicMock, patch
 
+import openpyxl
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core import mail
+from django.core.cache import cache
 from django.core.management import call_command
-from django.test import Client, TestCase
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from ics import Calendar
 
+from clubs.attendance import LiveEventStats, broadcast_live_event
+from clubs.caching import cache_get_or_build_tagged, invalidate_cache_tags
+from clubs.fairs import FAIR_DIRECTORY_VERSION
 from clubs.filters import DEFAULT_PAGE_SIZE
+from clubs.management.commands.flush_visits import VisitBuffer
 from clubs.models import (
+    AnalyticsRollup,
+    ApplicationMultipleChoice,
+    ApplicationQuestion,
+    ApplicationQuestionResponse,
+    ApplicationSubmission,
     Asset,
     Badge,
     Club,
+    ClubApplication,
     ClubFair,
     ClubFairRegistration,
+    ClubVisit,
     Event,
     Favorite,
     Membership,
     MembershipInvite,
     QuestionAnswer,
     School,
+    SearchQuery,
+    SearchQueryStat,
+    Subscribe,
     Tag,
     Testimonial,
     ZoomMeetingVisit,
 )
+from clubs.permissions import PermissionResolver, find_membership_helper
+from clubs.search import SearchQueryLogger, search_query_logger
 
 
 class SearchTestCase(TestCase):
@@ -53,12 +77,70 @@ class SearchTestCase(TestCase):
     def test_random_listing_odd_page(self):
         self.perform_random_fetch(17)
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_random_listing_cached(self):
+        self.perform_random_fetch(DEFAULT_PAGE_SIZE)
+
+        # cached permutation is invalidated when clubs change
+        Club.objects.create(code="new-club", name="New Club", approved=True)
+        self.perform_random_fetch(DEFAULT_PAGE_SIZE)
+
     def test_featured_listing(self):
         self.perform_random_fetch(DEFAULT_PAGE_SIZE, ordering="featured")
 
     def test_alphabetical_listing(self):
         self.perform_random_fetch(DEFAULT_PAGE_SIZE, ordering="name")
 
+    def test_cursor_listing(self):
+        for ordering in ["featured", "name", "-favorite_count"]:
+            resp = self.client.get(
+                reverse("clubs-list"),
+                {
+                    "ordering": ordering,
+                    "cursor": "",
+                    "page_size": "17",
+                    "count": "true",
+                },
+            )
+            self.assertIn(resp.status_code, [200], resp.content)
+            data = resp.json()
+            self.assertEqual(data["count"], 100)
+            self.assertIsNone(data["previous"])
+
+            codes = [club["code"] for club in data["results"]]
+            first_page = list(codes)
+            while data["next"] is not None:
+                # objects added before the cursor do not shift the next page
+                Club.objects.create(code=f"new-{ordering}-{len(codes)}", name="Aaa")
+
+                resp = self.client.get(data["next"])
+                self.assertIn(resp.status_code, [200], resp.content)
+                data = resp.json()
+                self.assertNotIn("count", data)
+                self.assertLessEqual(len(data["results"]), 17)
+                codes.extend(club["code"] for club in data["results"])
+
+            self.assertEqual(
+                sorted(code for code in codes if code.startswith("club-")),
+                sorted(f"club-{i}" for i in range(100)),
+            )
+            self.assertEqual(len(codes), len(set(codes)))
+            Club.objects.filter(code__startswith="new-").delete()
+
+            # previous links return to the earlier pages
+            resp = self.client.get(
+                reverse("clubs-list"),
+                {"ordering": ordering, "cursor": "", "page_size": "17"},
+            )
+            data = self.client.get(resp.json()["next"]).json()
+            data = self.client.get(data["previous"]).json()
+            self.assertEqual([club["code"] for club in data["results"]], first_page)
+
+        resp = self.client.get(reverse("clubs-list"), {"cursor": "invalid"})
+        self.assertEqual(resp.status_code, 404, resp.content)
+
     def perform_random_fetch(self, page_size, ordering="random"):
         # fetch clubs using specified ordering
         resp = self.client.get(
@@ -258,6 +340,24 @@ class ClubTestCase(TestCase):
         resp = self.client.get(reverse("clubs-subscription", args=(self.club1.code,)))
         self.assertIn(resp.status_code, [200, 201], resp.content)
 
+        # paginate the subscriptions using a cursor
+        for user in [self.user1, self.user2, self.user3]:
+            Subscribe.objects.create(person=user, club=self.club1)
+
+        resp = self.client.get(
+            reverse("clubs-subscription", args=(self.club1.code,)),
+            {"cursor": "", "page_size": "2"},
+        )
+        self.assertIn(resp.status_code, [200], resp.content)
+        data = resp.json()
+        self.assertEqual(len(data["results"]), 2)
+
+        resp = self.client.get(data["next"])
+        self.assertIn(resp.status_code, [200], resp.content)
+        data = resp.json()
+        self.assertEqual(len(data["results"]), 1)
+        self.assertIsNone(data["next"])
+
     def test_clubs_notes_about(self):
         """
         Test retrieving the list of notes about a club.
@@ -429,6 +529,159 @@ class ClubTestCase(TestCase):
         resp = self.client.delete(reverse("favorites-detail", args=(self.club1.code,)))
         self.assertIn(resp.status_code, [200, 204], resp.content)
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_club_list_user_overlay(self):
+        """
+        Test that the shared club list cache does not leak user specific fields.
+        """
+        Favorite.objects.create(person=self.user1, club=self.club1)
+        Membership.objects.create(
+            person=self.user1, club=self.club1, role=Membership.ROLE_OFFICER
+        )
+
+        def get_club(params):
+            resp = self.client.get(reverse("clubs-list"), params)
+            self.assertIn(resp.status_code, [200], resp.content)
+            data = json.loads(resp.content.decode("utf-8"))
+            if isinstance(data, dict):
+                data = data["results"]
+            return next(club for club in data if club["code"] == self.club1.code)
+
+        for params in [{}, {"page": 1}]:
+            # anonymous users populate the shared cache
+            club = get_club(params)
+            self.assertFalse(club["is_favorite"])
+            self.assertFalse(club["is_member"])
+
+            # user specific fields are merged into the cached response
+            self.client.login(username=self.user1.username, password="test")
+            club = get_club(params)
+            self.assertTrue(club["is_favorite"])
+            self.assertFalse(club["is_subscribe"])
+            self.assertEqual(club["is_member"], Membership.ROLE_OFFICER)
+
+            # other users do not see those fields
+            self.client.login(username=self.user2.username, password="test")
+            club = get_club(params)
+            self.assertFalse(club["is_favorite"])
+            self.assertFalse(club["is_member"])
+            self.client.logout()
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_club_list_cache_invalidation(self):
+        """
+        Test that cached club responses are invalidated when the club changes.
+        """
+
+        def get_club():
+            resp = self.client.get(reverse("clubs-list"))
+            self.assertIn(resp.status_code, [200], resp.content)
+            data = json.loads(resp.content.decode("utf-8"))
+            return next(club for club in data if club["code"] == self.club1.code)
+
+        self.assertEqual(get_club()["favorite_count"], 0)
+
+        Favorite.objects.create(person=self.user1, club=self.club1)
+        self.assertEqual(get_club()["favorite_count"], 1)
+
+        self.club1.name = "Renamed Club"
+        self.club1.save()
+        self.assertEqual(get_club()["name"], "Renamed Club")
+
+        tag = Tag.objects.get(name="Graduate")
+        self.club1.tags.add(tag)
+        self.assertEqual(get_club()["tags"][0]["name"], "Graduate")
+
+        tag.name = "Graduate Students"
+        tag.save()
+        self.assertEqual(get_club()["tags"][0]["name"], "Graduate Students")
+
+    def test_club_list_card(self):
+        """
+        Test that the club list is rendered from the precomputed club cards and
+        that the cards are updated when the club or its tags change.
+        """
+
+        def get_club():
+            resp = self.client.get(reverse("clubs-list"))
+            self.assertIn(resp.status_code, [200], resp.content)
+            data = json.loads(resp.content.decode("utf-8"))
+            return next(club for club in data if club["code"] == self.club1.code)
+
+        self.club1.subtitle = ""
+        self.club1.description = "<p>First &amp; best sentence. Second sentence.</p>"
+        self.club1.save()
+        self.assertEqual(get_club()["subtitle"], "First & best sentence.")
+        self.assertEqual(
+            Club.objects.get(pk=self.club1.pk).card["subtitle"],
+            "First & best sentence.",
+        )
+
+        # tags changed from either side of the relationship are updated
+        tag = Tag.objects.create(name="Card Tag")
+        tag.club_set.add(self.club1)
+        self.assertEqual(get_club()["tags"], [{"id": tag.id, "name": "Card Tag"}])
+        tag.club_set.clear()
+        self.assertEqual(get_club()["tags"], [])
+        self.club1.tags.add(tag)
+        tag.delete()
+        self.assertEqual(get_club()["tags"], [])
+
+        # the tags of the clubs are not fetched separately
+        for i in range(5):
+            club = Club.objects.create(
+                code=f"card-{i}", name=f"Card {i}", approved=True
+            )
+            club.tags.add(*Tag.objects.all())
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("clubs-list"))
+        self.assertFalse(
+            any("clubs_club_tags" in query["sql"] for query in queries), queries
+        )
+
+    def test_club_list_ghost(self):
+        """
+        Test that the approved version of ghost clubs is shown from the approved
+        snapshot without looking up the club history.
+        """
+        self.club1.approved = True
+        self.club1.name = "Approved Name"
+        self.club1.save()
+
+        # edit the club so that it needs to be approved again
+        self.club1.approved = None
+        self.club1.ghost = True
+        self.club1.name = "Pending Name"
+        self.club1.subtitle = "Pending subtitle"
+        self.club1.save()
+        self.assertEqual(self.club1.approved_snapshot["name"], "Approved Name")
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse("clubs-list"))
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertFalse(
+            any("historical" in query["sql"] for query in queries), queries
+        )
+        club = next(club for club in resp.json() if club["code"] == self.club1.code)
+        self.assertEqual(club["name"], "Approved Name")
+        self.assertNotEqual(club["subtitle"], "Pending subtitle")
+
+        resp = self.client.get(reverse("clubs-detail", args=(self.club1.code,)))
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertEqual(resp.data["name"], "Approved Name")
+        self.assertTrue(resp.data["is_ghost"])
+
+        # members see the pending version
+        Membership.objects.create(person=self.user1, club=self.club1)
+        self.client.login(username=self.user1.username, password="test")
+        resp = self.client.get(reverse("clubs-detail", args=(self.club1.code,)))
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertEqual(resp.data["name"], "Pending Name")
+
     def test_event_list(self):
         """
         Test listing club events.
@@ -553,6 +806,129 @@ class ClubTestCase(TestCase):
         self.assertIn(resp.status_code, [400, 401, 403], resp.data)
         self.assertTrue(Event.objects.filter(pk=e2.pk).exists())
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_fair_directory(self):
+        """
+        Test that the fair directory groups the events of the fair by time and
+        category, is served from the cache and is rebuilt when the fair changes.
+        """
+        now = timezone.now()
+        fair = ClubFair.objects.create(
+            name="Test Fair",
+            start_time=now + timezone.timedelta(days=1),
+            end_time=now + timezone.timedelta(days=2),
+            registration_end_time=now,
+        )
+        arts = Badge.objects.create(label="Arts", purpose="fair", fair=fair)
+        sports = Badge.objects.create(label="Sports", purpose="fair", fair=fair)
+        clubs = []
+        for name, badge in [("b Club", arts), ("A Club", arts), ("C Club", sports)]:
+            club = Club.objects.create(
+                code=name.lower().replace(" ", "-"), name=name, approved=True
+            )
+            club.badges.add(badge)
+            Event.objects.create(
+                code=f"{club.code}-fair",
+                club=club,
+                name="Fair Event",
+                type=Event.FAIR,
+                start_time=fair.start_time,
+                end_time=fair.end_time,
+            )
+            clubs.append(club)
+
+        def get_directory():
+            resp = self.client.get(reverse("events-fair"), {"fair": fair.id})
+            self.assertIn(resp.status_code, [200], resp.content)
+            return resp.json()
+
+        data = get_directory()
+        self.assertEqual(data["fair"]["id"], fair.id)
+        self.assertEqual(len(data["events"]), 1)
+        self.assertEqual(
+            [
+                (category["category"], [event["name"] for event in category["events"]])
+                for category in data["events"][0]["events"]
+            ],
+            [("Arts", ["A Club", "b Club"]), ("Sports", ["C Club"])],
+        )
+
+        # the current fair is the default
+        resp = self.client.get(reverse("events-fair"))
+        self.assertEqual(resp.json(), data)
+
+        # the directory is cached
+        with self.assertNumQueries(0):
+            self.client.get(reverse("events-fair"), {"fair": fair.id})
+
+        # the directory is rebuilt when the clubs of the fair change
+        clubs[0].badges.remove(arts)
+        data = get_directory()
+        self.assertEqual(
+            [category["category"] for category in data["events"][0]["events"]],
+            ["Arts", "Sports"],
+        )
+        self.assertEqual(
+            [event["name"] for event in data["events"][0]["events"][0]["events"]],
+            ["A Club"],
+        )
+
+        # missing fairs do not exist and are not cached
+        resp = self.client.get(reverse("events-fair"), {"fair": fair.id + 100})
+        self.assertIn(resp.status_code, [404], resp.content)
+        self.assertIsNone(
+            cache.get(
+                f"events:fair:directory:v{FAIR_DIRECTORY_VERSION}:{fair.id + 100}"
+            )
+        )
+
+    @override_settings(
+        BACKGROUND_TASKS=True,
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    def test_cache_stale_while_revalidate(self):
+        """
+        Test that invalidated values are served stale while a single caller
+        rebuilds them.
+        """
+        builds = []
+
+        def build():
+            builds.append(True)
+            return len(builds)
+
+        self.assertEqual(cache_get_or_build_tagged("test", build, 60, ["test"]), 1)
+        self.assertEqual(cache_get_or_build_tagged("test", build, 60, ["test"]), 1)
+        self.assertEqual(len(builds), 1)
+
+        # the stale value is returned while the value is rebuilt in the background
+        invalidate_cache_tags("test")
+        with patch("clubs.caching.threading.Thread") as thread:
+            self.assertEqual(cache_get_or_build_tagged("test", build, 60, ["test"]), 1)
+            self.assertEqual(thread.call_count, 1)
+
+            # other callers do not start another rebuild
+            self.assertEqual(cache_get_or_build_tagged("test", build, 60, ["test"]), 1)
+            self.assertEqual(thread.call_count, 1)
+
+        # the rebuild stores the new value and releases the lock
+        thread.call_args.kwargs["target"]()
+        self.assertEqual(cache_get_or_build_tagged("test", build, 60, ["test"]), 2)
+        self.assertEqual(len(builds), 2)
+
+        # callers without a previous value only wait briefly for another build
+        cache.delete("test")
+        cache.add("test:lock", True, 60)
+        start = time.monotonic()
+        self.assertEqual(
+            cache_get_or_build_tagged("test", build, 60, ["test"], lock_wait=0.1), 3
+        )
+        self.assertLess(time.monotonic() - start, 5)
+
     def test_event_favorited_users(self):
         """
         Test retrieving the correct set of events from the ICS endpoint.
@@ -1261,6 +1637,120 @@ class ClubTestCase(TestCase):
         data = json.loads(resp.content.decode("utf-8"))
         self.assertTrue(data)
 
+    @override_settings(
+        BACKGROUND_TASKS=True,
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+        SEARCH_QUERY_WINDOW=60 * 60,
+    )
+    def test_club_list_search_logging(self):
+        """
+        Test that search queries are logged once per search.
+        """
+        cache.clear()
+        self.client.login(username=self.user1.username, password="test")
+
+        # queries made while typing are merged together
+        for query in ["c", "ch", "che", "chess", "chess club"]:
+            resp = self.client.get(reverse("clubs-list"), {"search": query})
+            self.assertIn(resp.status_code, [200], resp.content)
+
+        # later pages and other queries are logged separately
+        resp = self.client.get(
+            reverse("clubs-list"), {"search": "chess club", "page": "2"}
+        )
+        resp = self.client.get(reverse("clubs-list"), {"search": "Penn  Labs"})
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertFalse(SearchQuery.objects.exists())
+
+        search_query_logger.flush(force=True)
+        self.assertEqual(
+            sorted(SearchQuery.objects.values_list("query", flat=True)),
+            ["Penn Labs", "chess club"],
+        )
+
+        # queries are merged and written by any process, since they are kept in
+        # the cache
+        search_query_logger.log(self.user2.id, "penn")
+        other_logger = SearchQueryLogger()
+        other_logger.log(self.user2.id, "penn labs")
+        self.assertEqual(search_query_logger.flush(), 0)
+        self.assertEqual(other_logger.flush(force=True), 1)
+
+        # popular queries are counted from the normalized queries
+        self.assertEqual(
+            list(
+                SearchQueryStat.objects.filter(query="penn labs").values_list(
+                    "count", flat=True
+                )
+            ),
+            [2],
+        )
+
+        resp = self.client.get(reverse("searches-popular"))
+        self.assertIn(resp.status_code, [403], resp.content)
+
+        self.client.login(username=self.user5.username, password="test")
+        resp = self.client.get(reverse("searches-popular"))
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertEqual(
+            resp.json(),
+            [{"query": "penn labs", "count": 2}, {"query": "chess club", "count": 1}],
+        )
+
+    def test_club_list_search_relevance(self):
+        """
+        Test searching clubs with relevance ordering.
+        """
+        Club.objects.create(
+            code="chess",
+            name="Penn Chess Club",
+            subtitle="We play chess.",
+            approved=True,
+        )
+        Club.objects.create(
+            code="games",
+            name="Board Games",
+            subtitle="Chessboards and other games.",
+            approved=True,
+        )
+
+        resp = self.client.get(
+            reverse("clubs-list"), {"search": "ches", "ordering": "relevance"}
+        )
+        self.assertIn(resp.status_code, [200], resp.content)
+        data = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual([club["code"] for club in data], ["chess", "games"])
+
+        # all terms must match
+        resp = self.client.get(reverse("clubs-list"), {"search": "penn games"})
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertFalse(json.loads(resp.content.decode("utf-8")))
+
+        # index is updated when clubs are saved
+        club = Club.objects.get(code="games")
+        club.name = "Penn Games"
+        club.save()
+        resp = self.client.get(reverse("clubs-list"), {"search": "penn games"})
+        self.assertIn(resp.status_code, [200], resp.content)
+        data = json.loads(resp.content.decode("utf-8"))
+        self.assertEqual([club["code"] for club in data], ["games"])
+
+    def test_event_search(self):
+        """
+        Test that events can be found by their own fields or their club.
+        """
+        for query in ["test event", "test club", "test-club"]:
+            resp = self.client.get(reverse("events-list"), {"search": query})
+            self.assertIn(resp.status_code, [200], resp.content)
+            data = json.loads(resp.content.decode("utf-8"))
+            self.assertEqual([e["id"] for e in data], [self.event1.id], query)
+
+        resp = self.client.get(reverse("events-list"), {"search": "nonexistent"})
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertFalse(json.loads(resp.content.decode("utf-8")))
+
     def test_club_list_filter(self):
         """
         Test complex club filtering.
@@ -1348,6 +1838,77 @@ class ClubTestCase(TestCase):
         resp = self.client.get(reverse("clubs-children", args=(self.club1.code,)))
         self.assertIn(resp.status_code, [200], resp.content)
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_club_hierarchy(self):
+        """
+        Test the children and parent trees and that memberships in parent clubs
+        grant authority over their children.
+        """
+        child = Club.objects.create(code="child", name="Child", approved=True)
+        grandchild = Club.objects.create(
+            code="grandchild", name="Grandchild", approved=True
+        )
+        sibling = Club.objects.create(code="sibling", name="Sibling", approved=True)
+        child.parent_orgs.add(self.club1)
+        sibling.parent_orgs.add(self.club1)
+        grandchild.parent_orgs.add(child)
+
+        self.client.login(username=self.user3.username, password="test")
+        resp = self.client.get(reverse("clubs-children", args=(self.club1.code,)))
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertEqual(
+            resp.json(),
+            {
+                "name": self.club1.name,
+                "code": self.club1.code,
+                "children": [
+                    {
+                        "name": "Child",
+                        "code": "child",
+                        "children": [
+                            {"name": "Grandchild", "code": "grandchild", "children": []}
+                        ],
+                    },
+                    {"name": "Sibling", "code": "sibling", "children": []},
+                ],
+            },
+        )
+
+        # cycles are not expanded
+        self.club1.parent_orgs.add(grandchild)
+        resp = self.client.get(reverse("clubs-parents", args=(child.code,)))
+        self.assertIn(resp.status_code, [200], resp.content)
+        data = resp.json()
+        self.assertEqual(data["children"][0]["code"], self.club1.code)
+        self.assertEqual(
+            data["children"][0]["children"][0]["children"],
+            [{"name": "Child", "code": "child"}],
+        )
+
+        # officers of a parent club can manage the child clubs
+        self.assertIsNone(find_membership_helper(self.user2, grandchild))
+        Membership.objects.create(
+            person=self.user2, club=self.club1, role=Membership.ROLE_OFFICER
+        )
+        self.assertEqual(
+            find_membership_helper(self.user2, grandchild).club, self.club1
+        )
+
+        # removing a relationship updates the hierarchy
+        grandchild.parent_orgs.remove(child)
+        self.club1.parent_orgs.remove(grandchild)
+        self.assertIsNone(find_membership_helper(self.user2, grandchild))
+
+        # permission checks for many clubs share the same queries
+        resolver = PermissionResolver(self.user2)
+        with CaptureQueriesContext(connection) as queries:
+            for club in [self.club1, child, sibling, "child", "sibling"]:
+                self.assertTrue(resolver.has_role(club, Membership.ROLE_OFFICER))
+            self.assertFalse(resolver.has_role(grandchild, Membership.ROLE_MEMBER))
+        self.assertLessEqual(len(queries), 4)
+
     def test_club_modify(self):
         """
         Owners and officers should be able to modify the club.
@@ -1738,6 +2299,32 @@ class ClubTestCase(TestCase):
         self.assertTrue(isinstance(res.data[0], dict))
         self.assertTrue(len(res.data[0]) > 2)
 
+    def test_club_report_chunked(self):
+        """
+        Test that spreadsheet reports are written in the order of the queryset with
+        formatted headers and values when the clubs are serialized in chunks.
+        """
+        for i in range(4):
+            Club.objects.create(code=f"report-{i}", name=f"Report {i}", approved=True)
+        self.client.login(username=self.user5.username, password="test")
+
+        with patch("clubs.views.ClubViewSet.xlsx_chunk_size", 2):
+            resp = self.client.get(
+                reverse("clubs-list"),
+                {"format": "xlsx", "fields": "name,code,approved", "ordering": "name"},
+            )
+        self.assertEqual(200, resp.status_code)
+        self.assertIn("attachment", resp["Content-Disposition"])
+
+        sheet = openpyxl.load_workbook(io.BytesIO(resp.content)).active
+        rows = [[cell.value for cell in row] for row in sheet.iter_rows()]
+        self.assertEqual(rows[0], ["Name", "Code", "Approved"])
+        self.assertEqual(
+            rows[1:],
+            [[f"Report {i}", f"report-{i}", "True"] for i in range(4)]
+            + [["Test Club", "test-club", "True"]],
+        )
+
     def test_club_members_report(self):
         # login for extended member information
         self.client.login(username=self.user5.username, password="test")
@@ -2100,6 +2687,120 @@ class ClubTestCase(TestCase):
         resp = self.client.get(reverse("clubs-analytics", args=(club.code,)))
         self.assertIn(resp.status_code, [200], resp.content)
 
+        # analytics are counted from the rollups
+        school = School.objects.create(name="Engineering", is_graduate=False)
+        for user in [self.user1, self.user2, self.user3]:
+            user.profile.graduation_year = 2025
+            user.profile.save()
+            user.profile.school.add(school)
+            ClubVisit.objects.create(person=user, club=club)
+            Favorite.objects.create(person=user, club=club)
+        Favorite.objects.filter(person=self.user3, club=club).delete()
+        ClubVisit.objects.create(
+            person=self.user1, club=club, visit_type=ClubVisit.EVENT_MODAL
+        )
+
+        resp = self.client.get(
+            reverse("clubs-analytics", args=(club.code,)),
+            {"date": timezone.localtime().strftime("%Y-%m-%d")},
+        )
+        self.assertIn(resp.status_code, [200], resp.content)
+        data = resp.json()
+        self.assertEqual(sum(item["count"] for item in data["visits"]), 3)
+        self.assertEqual(sum(item["count"] for item in data["favorites"]), 2)
+        self.assertEqual(data["subscriptions"], [])
+        self.assertEqual(data["max"], 3)
+
+        resp = self.client.get(
+            reverse("clubs-analytics-pie-charts", args=(club.code,)),
+            {"category": "school", "metric": "favorite"},
+        )
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertEqual(
+            resp.json()["content"],
+            [{"person__profile__school__name": "Engineering", "count": 2}],
+        )
+
+        resp = self.client.get(
+            reverse("clubs-analytics-pie-charts", args=(club.code,)),
+            {"category": "graduation_year", "metric": "visit"},
+        )
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertEqual(
+            resp.json()["content"],
+            [{"person__profile__graduation_year": 2025, "count": 3}],
+        )
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+        BACKGROUND_TASKS=True,
+        VISIT_BUFFER_SIZE=1000,
+        VISIT_BUFFER_DELAY=60 * 60,
+    )
+    def test_club_visit_buffer(self):
+        self.client.login(username=self.user1.username, password="test")
+
+        # visits are buffered instead of being written immediately
+        for visit_type in [
+            ClubVisit.CLUB_PAGE,
+            ClubVisit.CLUB_PAGE,
+            ClubVisit.FAIR_PAGE,
+        ]:
+            resp = self.client.post(
+                reverse("clubvisits-list"),
+                {"club": self.club1.code, "visit_type": visit_type},
+                content_type="application/json",
+            )
+            self.assertIn(resp.status_code, [201], resp.content)
+        self.assertFalse(ClubVisit.objects.exists())
+
+        # buffered visits are written in a batch
+        call_command("flush_visits", stdout=io.StringIO())
+        self.assertEqual(
+            ClubVisit.objects.filter(person=self.user1, club=self.club1).count(), 3
+        )
+        self.assertEqual(
+            sum(
+                AnalyticsRollup.objects.filter(
+                    club=self.club1, metric="visit", granularity="day"
+                ).values_list("total", flat=True)
+            ),
+            3,
+        )
+
+        # visits are only written once
+        call_command("flush_visits", stdout=io.StringIO())
+        self.assertEqual(ClubVisit.objects.count(), 3)
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+        BACKGROUND_TASKS=True,
+        VISIT_BUFFER_SIZE=2,
+    )
+    def test_club_visit_buffer_full(self):
+        """
+        Test that a full visit buffer starts a single flush in each process.
+        """
+        cache.clear()
+        buffer = VisitBuffer()
+        with patch(
+            "clubs.management.commands.flush_visits.threading.Thread"
+        ) as thread, patch("clubs.management.commands.flush_visits.threading.Timer"):
+            for _ in range(5):
+                buffer.add(self.club1.id, self.user1.id, ClubVisit.CLUB_PAGE, None)
+            self.assertEqual(thread.call_count, 1)
+
+            # the flush writes the visits and allows the next flush to start
+            buffer.run_flush()
+            self.assertEqual(ClubVisit.objects.count(), 5)
+            for _ in range(2):
+                buffer.add(self.club1.id, self.user1.id, ClubVisit.CLUB_PAGE, None)
+            self.assertEqual(thread.call_count, 2)
+
     def test_report_saving(self):
         # login as superuser
         self.client.login(username=self.user5.username, password="test")
@@ -2241,6 +2942,37 @@ class ClubTestCase(TestCase):
         self.assertEqual(tag.club_set.count(), Club.objects.count())
         self.assertEqual(tag2.club_set.count(), Club.objects.count())
 
+        # register clubs for a fair, which must invalidate the cached club data
+        now = timezone.now()
+        fair = ClubFair.objects.create(
+            name="Bulk Fair",
+            start_time=now,
+            end_time=now + datetime.timedelta(days=1),
+            registration_end_time=now,
+        )
+        ClubFairRegistration.objects.create(
+            registrant=self.user5, club=self.club1, fair=fair
+        )
+        with patch("clubs.views.invalidate_cache_tags") as invalidate:
+            resp = self.client.post(
+                reverse("clubs-bulk"),
+                {
+                    "action": "add",
+                    "clubs": "\n".join(Club.objects.values_list("code", flat=True)),
+                    "fairs": [{"id": fair.id}],
+                },
+                content_type="application/json",
+            )
+        self.assertIn(resp.status_code, [200, 201], resp.content)
+        self.assertEqual(fair.participating_clubs.count(), Club.objects.count())
+        others = Club.objects.exclude(pk=self.club1.pk)
+        invalidate.assert_called_once()
+        self.assertEqual(invalidate.call_args[0][0], "events:fair")
+        self.assertEqual(
+            sorted(invalidate.call_args[0][1:]),
+            sorted(f"club:{club.id}" for club in others),
+        )
+
     def test_email_preview(self):
         """
         Ensure that the email preview page can load without any issues.
@@ -2425,6 +3157,183 @@ class ClubTestCase(TestCase):
         for perm in permissions:
             self.assertTrue(data[perm], perm)
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_permission_lookup_batch(self):
+        """
+        Test that checking many club permissions at once uses a fixed number of
+        queries and that the cached roles are updated when memberships change.
+        """
+        children = [
+            Club.objects.create(code=f"child-{i}", name=f"Child {i}", approved=True)
+            for i in range(10)
+        ]
+        for child in children:
+            child.parent_orgs.add(self.club1)
+        other = Club.objects.create(code="other-club", name="Other Club")
+        membership = Membership.objects.create(
+            person=self.user4, club=self.club1, role=Membership.ROLE_OFFICER
+        )
+        self.client.login(username=self.user4.username, password="test")
+
+        def check(clubs):
+            permissions = [f"clubs.manage_club:{club.code}" for club in clubs]
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(
+                    reverse("users-permission"), {"perm": ",".join(permissions)}
+                )
+            self.assertIn(resp.status_code, [200], resp.content)
+            data = resp.json()["permissions"]
+            return [data[perm] for perm in permissions], len(queries)
+
+        # officers of the parent club can manage all of the children
+        results, _ = check(children[:1])
+        self.assertTrue(all(results))
+        results, few_queries = check(children[:2])
+        self.assertTrue(all(results))
+        results, many_queries = check([self.club1, other, *children])
+        self.assertEqual(results, [True, False] + [True] * len(children))
+        self.assertEqual(few_queries, many_queries)
+
+        # removing the membership revokes the cached permissions
+        membership.delete()
+        results, _ = check([self.club1, *children])
+        self.assertFalse(any(results))
+
+    @override_settings(
+        REQUEST_PROFILING=True,
+        REQUEST_PROFILING_SAMPLE_RATE=1.0,
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    def test_request_profiling(self):
+        """
+        Test that profiled requests are aggregated by view and action and that
+        only superusers can see them.
+        """
+        for user in [self.user1, self.user2, self.user3]:
+            Membership.objects.create(person=user, club=self.club1)
+
+        self.client.login(username=self.user4.username, password="test")
+        resp = self.client.get(reverse("club-members-list", args=(self.club1.code,)))
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.client.get(reverse("club-members-list", args=(self.club1.code,)))
+        resp = self.client.get(reverse("profiling"))
+        self.assertIn(resp.status_code, [403], resp.content)
+
+        self.client.login(username=self.user5.username, password="test")
+        resp = self.client.get(reverse("profiling"))
+        self.assertIn(resp.status_code, [200], resp.content)
+        data = resp.json()
+        self.assertTrue(data["enabled"])
+        views = {item["view"]: item for item in data["views"]}
+        self.assertIn("MemberViewSet.list", views, views.keys())
+
+        stats = views["MemberViewSet.list"]
+        self.assertEqual(stats["requests"], 2)
+        self.assertGreater(stats["queries_avg"], 0)
+        self.assertGreater(stats["sql_time_total"], 0)
+        self.assertGreater(stats["serializer_time_avg"], 0)
+        self.assertGreater(stats["size_avg"], 0)
+
+        # the profiles can be cleared
+        resp = self.client.delete(reverse("profiling"))
+        self.assertIn(resp.status_code, [204], resp.content)
+        resp = self.client.get(reverse("profiling"))
+        views = [item["view"] for item in resp.json()["views"]]
+        self.assertNotIn("MemberViewSet.list", views)
+
+    def test_application_submission_export(self):
+        """
+        Test that submissions are exported as a streamed CSV with one column per
+        question and that the number of queries does not depend on the number of
+        submissions.
+        """
+        now = timezone.now()
+        application = ClubApplication.objects.create(
+            name="Test Application",
+            club=self.club1,
+            application_start_time=now - timezone.timedelta(days=1),
+            application_end_time=now + timezone.timedelta(days=1),
+            result_release_time=now + timezone.timedelta(days=2),
+        )
+        free_response = ApplicationQuestion.objects.create(
+            question_type=ApplicationQuestion.FREE_RESPONSE,
+            prompt="Why?",
+            application=application,
+        )
+        ApplicationQuestion.objects.create(
+            question_type=ApplicationQuestion.INFO_TEXT,
+            prompt="Welcome!",
+            application=application,
+        )
+        multiple_choice = ApplicationQuestion.objects.create(
+            question_type=ApplicationQuestion.MULTIPLE_CHOICE,
+            prompt="Which?",
+            application=application,
+        )
+        choice = ApplicationMultipleChoice.objects.create(
+            value="This one", question=multiple_choice
+        )
+
+        def submit(user):
+            submission = ApplicationSubmission.objects.create(
+                user=user, application=application
+            )
+            ApplicationQuestionResponse.objects.create(
+                text=f"Because I am {user.first_name}",
+                question=free_response,
+                submission=submission,
+            )
+            ApplicationQuestionResponse.objects.create(
+                multiple_choice=choice, question=multiple_choice, submission=submission,
+            )
+
+        def export():
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(
+                    reverse(
+                        "club-application-submissions-export",
+                        args=(self.club1.code, application.id),
+                    )
+                )
+                self.assertEqual(resp.status_code, 200)
+                self.assertTrue(resp.streaming)
+                content = b"".join(resp.streaming_content).decode("utf-8")
+            return list(csv.reader(io.StringIO(content))), len(queries)
+
+        submit(self.user1)
+        submit(self.user2)
+        self.client.login(username=self.user5.username, password="test")
+        with patch("clubs.views.ApplicationSubmissionViewSet.export_chunk_size", 10):
+            rows, few_queries = export()
+            self.assertEqual(
+                rows[0],
+                ["", "name", "email", "graduation_year", "committee", "Why?", "Which?"],
+            )
+            self.assertEqual(
+                rows[1],
+                [
+                    "0",
+                    "Benjamin Franklin",
+                    self.user1.email,
+                    "",
+                    "General Member",
+                    "Because I am Benjamin",
+                    "This one",
+                ],
+            )
+            self.assertEqual(rows[2][1], "Thomas Jefferson")
+
+            submit(self.user3)
+            submit(self.user4)
+            rows, many_queries = export()
+            self.assertEqual(len(rows), 5)
+            self.assertEqual([row[0] for row in rows[1:]], [str(i) for i in range(4)])
+            self.assertEqual(few_queries, many_queries)
+
     def test_zoom_add_meeting(self):
         # setup fair event
         self.event1.type = Event.FAIR
@@ -2555,10 +3464,15 @@ class ClubTestCase(TestCase):
             },
         }
 
-        resp = self.client.post(
-            reverse("webhooks-meeting"), req, content_type="application/json"
-        )
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.post(
+                reverse("webhooks-meeting"), req, content_type="application/json"
+            )
         self.assertIn(resp.status_code, [200, 201], resp.content)
+        self.assertFalse(
+            any("REGEXP" in query["sql"].upper() for query in queries),
+            queries.captured_queries,
+        )
         self.assertTrue(
             ZoomMeetingVisit.objects.filter(
                 person=person,
@@ -2597,3 +3511,192 @@ class ClubTestCase(TestCase):
                 leave_time=leave_time,
             )
         )
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_zoom_webhook_live_stats(self):
+        """
+        Test that the live fair dashboard is updated by the Zoom webhook and does
+        not depend on the number of visits.
+        """
+        cache.clear()
+        now = timezone.now()
+        fair = ClubFair.objects.create(
+            name="Example Fair",
+            start_time=now - datetime.timedelta(days=1),
+            end_time=now + datetime.timedelta(days=1),
+            registration_end_time=now - datetime.timedelta(weeks=1),
+        )
+        ClubFairRegistration.objects.create(
+            registrant=self.user1, club=self.club1, fair=fair
+        )
+        Membership.objects.create(
+            person=self.user2, club=self.club1, role=Membership.ROLE_OFFICER
+        )
+        self.event1.type = Event.FAIR
+        self.event1.start_time = fair.start_time
+        self.event1.end_time = fair.end_time
+        self.event1.save()
+
+        def send(action, user, key, value):
+            req = {
+                "event": action,
+                "payload": {
+                    "object": {
+                        "participant": {
+                            "user_id": f"participant-{user.username}",
+                            key: value,
+                            "email": user.email,
+                        },
+                        "id": "4880003126",
+                    }
+                },
+            }
+            with self.captureOnCommitCallbacks(execute=True):
+                resp = self.client.post(
+                    reverse("webhooks-meeting"), req, content_type="application/json"
+                )
+            self.assertIn(resp.status_code, [200, 201], resp.content)
+
+        def live():
+            resp = self.client.get(reverse("clubfairs-live", args=(fair.id,)))
+            self.assertIn(resp.status_code, [200], resp.content)
+            return resp.data[self.event1.id]
+
+        self.client.login(username=self.user1.username, password="test")
+        self.assertEqual(
+            live(),
+            {
+                "participant_count": 0,
+                "already_attended": 0,
+                "officers": [],
+                "median": 0,
+            },
+        )
+
+        join_time = now - datetime.timedelta(hours=1)
+        users = [self.user2, self.user3, self.user4]
+        for user in users:
+            send("meeting.participant_joined", user, "join_time", join_time.isoformat())
+
+        data = live()
+        self.assertEqual(data["participant_count"], 3)
+        self.assertEqual(data["officers"], [self.user2.username])
+
+        for i, user in enumerate(users):
+            leave_time = join_time + datetime.timedelta(minutes=i + 1)
+            send("meeting.participant_left", user, "leave_time", leave_time.isoformat())
+
+        with CaptureQueriesContext(connection) as queries:
+            data = live()
+        self.assertEqual(data["participant_count"], 0)
+        self.assertEqual(data["already_attended"], 3)
+        self.assertEqual(data["officers"], [])
+        self.assertEqual(data["median"], 120)
+        self.assertFalse(
+            any("clubs_zoommeetingvisit" in query["sql"] for query in queries),
+            queries.captured_queries,
+        )
+
+    def test_live_event_stats_repeated_visits(self):
+        """
+        Test that visits are only counted once when they are added more than once.
+        """
+        join_time = timezone.now() - datetime.timedelta(minutes=5)
+        visit = ZoomMeetingVisit.objects.create(
+            person=self.user2, event=self.event1, join_time=join_time
+        )
+        stats = LiveEventStats.build([self.event1.id])[self.event1.id]
+        stats.add_visit(visit)
+        self.assertEqual(stats.attending, {self.user2.id})
+
+        visit.leave_time = join_time + datetime.timedelta(minutes=1)
+        visit.save()
+        for _ in range(2):
+            stats.add_visit(visit)
+        self.assertEqual(stats.attending, set())
+        self.assertEqual(stats.attended, {self.user2.id})
+        self.assertEqual(sum(stats.durations.values()), 1)
+        self.assertEqual(stats.get_median(), 60)
+
+        # the same visit is counted once when the statistics are rebuilt
+        rebuilt = LiveEventStats.build([self.event1.id])[self.event1.id]
+        self.assertEqual(rebuilt.durations, stats.durations)
+        self.assertEqual(rebuilt.attended, stats.attended)
+
+    @override_settings(
+        BACKGROUND_TASKS=True,
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+        CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    )
+    def test_zoom_webhook_broadcast(self):
+        """
+        Test that bursts of participants joining a meeting are coalesced into a
+        single broadcast of the attendance counts.
+        """
+        cache.clear()
+        Membership.objects.create(
+            person=self.user2, club=self.club1, role=Membership.ROLE_OFFICER
+        )
+        # every member of the club is counted, not only the officers
+        Membership.objects.create(
+            person=self.user3, club=self.club1, role=Membership.ROLE_MEMBER
+        )
+        # members that are not in the meeting are not counted
+        Membership.objects.create(
+            person=self.user5, club=self.club1, role=Membership.ROLE_MEMBER
+        )
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(f"events-live-{self.event1.id}", "viewer")
+
+        join_time = timezone.now() - datetime.timedelta(minutes=5)
+        with patch("clubs.attendance.threading.Timer") as timer:
+            for user in [self.user2, self.user3, self.user4]:
+                req = {
+                    "event": "meeting.participant_joined",
+                    "payload": {
+                        "object": {
+                            "participant": {
+                                "user_id": f"participant-{user.username}",
+                                "join_time": join_time.isoformat(),
+                                "email": user.email,
+                            },
+                            "id": "4880003126",
+                        }
+                    },
+                }
+                with self.captureOnCommitCallbacks(execute=True):
+                    resp = self.client.post(
+                        reverse("webhooks-meeting"),
+                        req,
+                        content_type="application/json",
+                    )
+                self.assertIn(resp.status_code, [200, 201], resp.content)
+        self.assertEqual(timer.call_count, 1)
+
+        expected = {"attending": 3, "officers": 2, "attended": 0, "time": 0}
+        broadcast_live_event(self.event1.id)
+        message = async_to_sync(layer.receive)("viewer")
+        self.assertEqual(message, {"type": "join_leave", "stats": expected})
+
+        self.client.login(username=self.user1.username, password="test")
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(
+                reverse("webhooks-meeting"), {"event": self.event1.id}
+            )
+        self.assertIn(resp.status_code, [200], resp.content)
+        self.assertEqual(resp.data, expected)
+        self.assertFalse(
+            any("clubs_zoommeetingvisit" in query["sql"] for query in queries),
+            queries.captured_queries,
+        )
+
+        # missing and unknown events have no attendance
+        empty = {"attending": 0, "officers": 0, "attended": 0, "time": 0}
+        for params in [{}, {"event": "abc"}, {"event": self.event1.id + 1000}]:
+            resp = self.client.get(reverse("webhooks-meeting"), params)
+            self.assertIn(resp.status_code, [200], resp.content)
+            self.assertEqual(resp.data, empty)
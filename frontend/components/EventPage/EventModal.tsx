@@ -103,21 +103,22 @@ const formatDuration = (time: number): string => {
 
 /**
  * Given an event ID, listen using a websocket connection for updates to this event.
+ * The updates contain the new statistics for the event.
  */
 const LiveEventUpdater = ({
   id,
   onUpdate,
 }: {
   id: number
-  onUpdate: () => void
+  onUpdate: (stats: LiveStatsData) => void
 }): null => {
   useEffect(() => {
     const wsUrl = `${location.protocol === 'http:' ? 'ws' : 'wss'}://${
       location.host
     }/api/ws/event/${id}/`
     const ws = new WebSocket(wsUrl)
-    ws.onmessage = () => {
-      onUpdate()
+    ws.onmessage = (msg) => {
+      onUpdate(JSON.parse(msg.data))
     }
     return () => ws.close()
   }, [id])
@@ -256,7 +257,7 @@ const EventModal = (props: {
       />
       <EventDetails>
         {isZoomMeeting && (
-          <LiveEventUpdater id={event.id} onUpdate={refreshLiveData} />
+          <LiveEventUpdater id={event.id} onUpdate={setUserCount} />
         )}
         <MetaDataGrid>
           <DateInterval start={new Date(start_time)} end={new Date(end_time)} />